@@ -4,19 +4,44 @@ Each instance of this class corresponds to one user, and all devices/homes assoc
 """
 
 import asyncio
+import logging
 import ssl
-from typing import Callable
+import time
+from concurrent.futures import Executor
+from typing import Callable, Iterable
 
 from .auth import Auth
-from .devices import create_device, CyncDevice, device_storage
-from .exceptions import MissingAuthError
+from .devices import device_storage
+from .devices.capabilities import CyncCapability
+from .devices.state_changes import DEFAULT_MAX_BUFFERED_STATE_CHANGES, OverflowPolicy, StateChangeStream
+from .devices.subscriptions import Subscription
+from .devices.topology import build_home, index_device_info, reconcile_homes, TopologyChange
+from .devices.topology_cache import load_topology_cache, save_topology_cache
+from .exceptions import AuthFailedError, MissingAuthError
 from .const import REST_API_BASE_URL
-from pycync.devices.groups import CyncRoom, CyncGroup, CyncHome
+from pycync.devices.groups import CyncHome, CyncRoom, CyncGroup
 from pycync.tcp.command_client import CommandClient
+from pycync.tcp.packet_queue import DEFAULT_INBOUND_QUEUE_HIGH_WATER_MARK, DEFAULT_INBOUND_QUEUE_LOW_WATER_MARK
+from pycync.tcp.tcp_manager import (DEFAULT_COMMAND_ACK_TIMEOUT_SECONDS, DEFAULT_HEARTBEAT_INTERVAL_SECONDS,
+                                    DEFAULT_MAX_IN_FLIGHT_COMMANDS, DEFAULT_MAX_MISSED_PONGS,
+                                    DEFAULT_WRITE_BUFFER_HIGH_WATER_MARK, DEFAULT_WRITE_BUFFER_LOW_WATER_MARK)
+
+DEFAULT_MAX_CONCURRENT_HOME_FETCHES = 4
 
 
 class Cync:
-    def __init__(self, auth: Auth):
+    _LOGGER = logging.getLogger(__name__)
+
+    def __init__(self, auth: Auth, max_concurrent_home_fetches: int = DEFAULT_MAX_CONCURRENT_HOME_FETCHES,
+                 topology_cache_path: str | None = None, callback_executor: Executor | None = None,
+                 max_in_flight_commands: int = DEFAULT_MAX_IN_FLIGHT_COMMANDS,
+                 command_ack_timeout: float = DEFAULT_COMMAND_ACK_TIMEOUT_SECONDS,
+                 heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL_SECONDS,
+                 max_missed_pongs: int = DEFAULT_MAX_MISSED_PONGS,
+                 write_buffer_high_water_mark: int = DEFAULT_WRITE_BUFFER_HIGH_WATER_MARK,
+                 write_buffer_low_water_mark: int = DEFAULT_WRITE_BUFFER_LOW_WATER_MARK,
+                 inbound_queue_high_water_mark: int = DEFAULT_INBOUND_QUEUE_HIGH_WATER_MARK,
+                 inbound_queue_low_water_mark: int = DEFAULT_INBOUND_QUEUE_LOW_WATER_MARK):
         """
         Initialize a Cync object.
         The static create function should be used to create a new Cync object.
@@ -24,17 +49,85 @@ class Cync:
         if not auth.user:
             raise MissingAuthError("No logged in user exists on auth object.")
         self._auth = auth
-        self._command_client = CommandClient(auth.user)
+        self._command_client = CommandClient(auth.user, callback_executor=callback_executor,
+                                             max_in_flight_commands=max_in_flight_commands,
+                                             command_ack_timeout=command_ack_timeout,
+                                             heartbeat_interval=heartbeat_interval,
+                                             max_missed_pongs=max_missed_pongs,
+                                             write_buffer_high_water_mark=write_buffer_high_water_mark,
+                                             write_buffer_low_water_mark=write_buffer_low_water_mark,
+                                             inbound_queue_high_water_mark=inbound_queue_high_water_mark,
+                                             inbound_queue_low_water_mark=inbound_queue_low_water_mark)
+        self._max_concurrent_home_fetches = max_concurrent_home_fetches
+        self._topology_cache_path = topology_cache_path
+        self._background_refresh: asyncio.Task | None = None
+        self._startup_timings: dict[str, float] = {}
+        self._state_change_streams: set[StateChangeStream] = set()
 
     @classmethod
-    async def create(cls, auth: Auth, ssl_context: ssl.SSLContext = None, ssl_context_no_verify: ssl.SSLContext = None):
-        cync_api = Cync(auth)
-
-        await cync_api.refresh_home_info()
+    async def create(cls, auth: Auth, ssl_context: ssl.SSLContext = None, ssl_context_no_verify: ssl.SSLContext = None,
+                     topology_cache_path: str | None = None, callback_executor: Executor | None = None,
+                     max_in_flight_commands: int = DEFAULT_MAX_IN_FLIGHT_COMMANDS,
+                     command_ack_timeout: float = DEFAULT_COMMAND_ACK_TIMEOUT_SECONDS,
+                     heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL_SECONDS,
+                     max_missed_pongs: int = DEFAULT_MAX_MISSED_PONGS,
+                     write_buffer_high_water_mark: int = DEFAULT_WRITE_BUFFER_HIGH_WATER_MARK,
+                     write_buffer_low_water_mark: int = DEFAULT_WRITE_BUFFER_LOW_WATER_MARK,
+                     inbound_queue_high_water_mark: int = DEFAULT_INBOUND_QUEUE_HIGH_WATER_MARK,
+                     inbound_queue_low_water_mark: int = DEFAULT_INBOUND_QUEUE_LOW_WATER_MARK):
+        """
+        Create a new Cync object, load the account's homes, and connect to the Cync server.
+        The connection to the Cync server is started right away, and logs in while the homes are being loaded.
+        Devices are probed as soon as both have finished.
+        If a topology cache path is given and the cache holds this user's homes, they are loaded from it, and the
+        homes are then refreshed from the API in the background. After every refresh, the homes are written back to
+        the cache.
+        If a callback executor is given, synchronous update callbacks are run in it instead of on the event loop.
+        At most max_in_flight_commands commands are sent through each hub without being acknowledged, and a command
+        fails with a CommandTimeoutError if it isn't acknowledged within command_ack_timeout seconds.
+        Once nothing has been received for heartbeat_interval seconds, the server is pinged, and the connection is
+        reestablished after max_missed_pongs pings in a row go unanswered.
+        Commands wait to be sent while more than write_buffer_high_water_mark bytes are waiting to be written to the
+        connection, until the buffer drains below write_buffer_low_water_mark bytes.
+        Reading from the connection pauses while inbound_queue_high_water_mark received packets are waiting to be
+        processed, until the backlog drains to inbound_queue_low_water_mark packets.
+        """
+        cync_api = Cync(auth, topology_cache_path=topology_cache_path, callback_executor=callback_executor,
+                        max_in_flight_commands=max_in_flight_commands, command_ack_timeout=command_ack_timeout,
+                        heartbeat_interval=heartbeat_interval, max_missed_pongs=max_missed_pongs,
+                        write_buffer_high_water_mark=write_buffer_high_water_mark,
+                        write_buffer_low_water_mark=write_buffer_low_water_mark,
+                        inbound_queue_high_water_mark=inbound_queue_high_water_mark,
+                        inbound_queue_low_water_mark=inbound_queue_low_water_mark)
         cync_api._command_client.start_connection(ssl_context, ssl_context_no_verify)
 
+        phase_started_at = time.monotonic()
+        if await cync_api._load_topology_cache():
+            cync_api._startup_timings["topology_cache_load"] = time.monotonic() - phase_started_at
+            cync_api._command_client.mark_topology_ready()
+            cync_api._background_refresh = asyncio.create_task(cync_api._refresh_in_background(),
+                                                               name="Refresh Cync Homes")
+        else:
+            try:
+                await cync_api.refresh_home_info()
+            except BaseException:
+                cync_api._command_client.close()
+                raise
+            cync_api._startup_timings["topology_refresh"] = time.monotonic() - phase_started_at
+            cync_api._command_client.mark_topology_ready()
+
         return cync_api
 
+    @property
+    def startup_timings(self) -> dict[str, float]:
+        """
+        How long each phase of startup took, in seconds.
+        Loading the homes is reported as topology_cache_load or topology_refresh. The connection phases, tls_connect,
+        login, probe and initial_status, run alongside it and are reported once they finish. The probe phase
+        includes any time spent waiting for the homes to load after logging in.
+        """
+        return {**self._startup_timings, **self._command_client.connection_timings}
+
     def get_logged_in_user(self):
         """Get logged in user."""
 
@@ -47,11 +140,64 @@ class Cync:
 
     def set_update_callback(self, update_callback: Callable):
         """
-        Set the callback function that will be called when a device's state changes,
-        or when a poll request for device state receives a response.
+        Set the callback function that will be called when a device's state changes.
+        Only devices whose state actually changed are included, so polling devices that haven't changed doesn't
+        call the callback.
+        The callback is run separately from packet processing, so a slow callback doesn't delay the connection.
+        Updates for the same device are delivered in order.
         """
         device_storage.set_user_device_callback(self._auth.user.user_id, update_callback)
 
+    def subscribe(self, callback: Callable, unique_ids: Iterable[str] = None, rooms: Iterable[CyncRoom] = None,
+                  groups: Iterable[CyncGroup] = None, homes: Iterable[CyncHome] = None,
+                  capabilities: Iterable[CyncCapability] = None) -> Callable[[], None]:
+        """
+        Subscribe a callback to the state changes of specific devices.
+        The callback is called with the updated devices that match, in the same format as the update callback.
+        A device matches if it has one of the given unique IDs, or is in one of the given rooms, groups or homes.
+        If none of these are given, every device matches. If capabilities are given, only devices that support all
+        of them match.
+        Matching devices are found again whenever the home information is refreshed.
+        Returns a function that cancels the subscription.
+        """
+        user_id = self._auth.user.user_id
+        subscription = Subscription(callback, unique_ids, rooms, groups, homes, capabilities)
+        device_storage.add_user_subscription(user_id, subscription)
+
+        return lambda: device_storage.remove_user_subscription(user_id, subscription)
+
+    def state_changes(self, unique_ids: Iterable[str] = None, rooms: Iterable[CyncRoom] = None,
+                      groups: Iterable[CyncGroup] = None, homes: Iterable[CyncHome] = None,
+                      capabilities: Iterable[CyncCapability] = None,
+                      max_buffered_changes: int = DEFAULT_MAX_BUFFERED_STATE_CHANGES,
+                      overflow_policy: OverflowPolicy = OverflowPolicy.COALESCE) -> StateChangeStream:
+        """
+        Open a stream of device state changes, to be read with async for.
+        Devices are selected the same way as when subscribing. Each stream buffers up to the given number of changes,
+        and the overflow policy decides what happens once its buffer is full.
+        The stream should be closed once it's no longer needed, either by calling close() or by using it as an async
+        context manager. All streams are closed when the Cync object is shut down.
+        """
+        user_id = self._auth.user.user_id
+
+        def stream_closed():
+            device_storage.remove_user_subscription(user_id, subscription)
+            self._state_change_streams.discard(stream)
+
+        stream = StateChangeStream(max_buffered_changes, overflow_policy, stream_closed)
+        subscription = Subscription(stream.push, unique_ids, rooms, groups, homes, capabilities, is_inline=True)
+        device_storage.add_user_subscription(user_id, subscription)
+        self._state_change_streams.add(stream)
+
+        return stream
+
+    def set_topology_callback(self, topology_callback: Callable):
+        """
+        Set the callback function that will be called when refreshing home information adds, removes or changes
+        any devices, rooms or groups.
+        """
+        device_storage.set_user_topology_callback(self._auth.user.user_id, topology_callback)
+
     def update_device_states(self):
         """Query the server for current device states, and update the devices."""
         asyncio.create_task(self._command_client.update_mesh_devices())
@@ -64,59 +210,118 @@ class Cync:
         """Get all homes, devices, and groups for the account."""
         return device_storage.get_user_homes(self._auth.user.user_id)
 
-    async def refresh_home_info(self):
-        """Refresh all nested home information for this account, and update the device storage."""
+    async def refresh_home_info(self) -> dict[int, Exception]:
+        """
+        Refresh all nested home information for this account, and update the device storage.
+        Homes are fetched concurrently. If a home fails to refresh, its previously loaded information is kept, and a
+        home that has never been loaded is left out until a later refresh succeeds. If authentication failed, or no
+        home could be loaded at all, the error is raised instead.
+        Devices, rooms and groups that already exist are updated in place, so their current state is kept. If anything
+        was added, removed or changed, the topology callback is called with a summary of the changes.
+        Returns the errors for any homes that failed to refresh, keyed by home ID.
+        """
+        user_id = self._auth.user.user_id
         device_info = await self._auth._send_user_request(
-            f"{REST_API_BASE_URL}/v2/user/{self._auth.user.user_id}/subscribe/devices")
+            f"{REST_API_BASE_URL}/v2/user/{user_id}/subscribe/devices")
         home_entries = [device for device in device_info if device.get("source") == 5]
-        homes = []
+        device_info_by_id = index_device_info(device_info)
+
+        fetch_semaphore = asyncio.Semaphore(self._max_concurrent_home_fetches)
+        home_fetches = [self._fetch_home_properties(home_json, fetch_semaphore) for home_json in home_entries]
+
+        refreshed_homes: dict[int, CyncHome] = {}
+        failed_homes: dict[int, Exception] = {}
+        for home_fetch in asyncio.as_completed(home_fetches):
+            home_json, mesh_device_info, fetch_error = await home_fetch
+            if fetch_error is None:
+                try:
+                    refreshed_homes[home_json["id"]] = build_home(home_json, mesh_device_info, device_info_by_id,
+                                                                  self._command_client)
+                except Exception as ex:
+                    fetch_error = ex
+
+            if fetch_error is not None:
+                self._LOGGER.error("Failed to refresh home {}: {!r}".format(home_json["id"], fetch_error))
+                failed_homes[home_json["id"]] = fetch_error
+
+        current_homes = device_storage.get_user_homes(user_id)
+        previous_homes = {home.home_id: home for home in current_homes}
+        for fetch_error in failed_homes.values():
+            if isinstance(fetch_error, AuthFailedError):
+                raise fetch_error
 
+        homes = []
         for home_json in home_entries:
-            home_devices: list[CyncDevice] = []
-            rooms: list[CyncRoom] = []
-            groups: list[CyncGroup] = []
-            home: CyncHome = CyncHome(home_json["name"], home_json["id"], [], [])
-
-            mesh_device_info = await self._auth._send_user_request(
-                f"{REST_API_BASE_URL}/v2/product/{home_json["product_id"]}/device/{home_json["id"]}/property")
-            mesh_devices = [mesh_device for mesh_device in mesh_device_info.get("bulbsArray", []) if
-                            "switchID" in mesh_device]
-            for mesh_device in mesh_devices:
-                matching_device = next((device for device in device_info if device["id"] == mesh_device["switchID"]),
-                                       None)
-                if matching_device is not None:
-                    created_device = create_device(matching_device, mesh_device, home.home_id, self._command_client)
-
-                    home_devices.append(created_device)
-
-            room_json = []
-            group_json = []
-            if "groupsArray" in mesh_device_info:
-                room_json = [group for group in mesh_device_info["groupsArray"] if group.get("isSubgroup") == False]
-                group_json = [group for group in mesh_device_info["groupsArray"] if group.get("isSubgroup") == True]
-
-            for group in group_json:
-                group_devices = [device for device in home_devices if
-                                 device.mesh_device_id in group.get("deviceIDArray", [])]
-                groups.append(
-                    CyncGroup(group["displayName"], group["groupID"], home.home_id, group_devices,
-                              self._command_client))
-                home_devices = [device for device in home_devices if device not in group_devices]
-
-            for room in room_json:
-                room_devices = [device for device in home_devices if
-                                device.mesh_device_id in room.get("deviceIDArray", [])]
-                room_groups = [group for group in groups if group.group_id in room.get("subgroupIDArray", [])]
-                rooms.append(CyncRoom(room["displayName"], room["groupID"], home.home_id, room_groups, room_devices,
-                                      self._command_client))
-                home_devices = [device for device in home_devices if device not in room_devices]
-
-            home.global_devices = home_devices
-            home.rooms = rooms
-            homes.append(home)
-
-        device_storage.set_user_homes(self._auth.user.user_id, homes)
+            home = refreshed_homes.get(home_json["id"], previous_homes.get(home_json["id"]))
+            if home is not None:
+                homes.append(home)
+
+        if len(homes) == 0 and len(failed_homes) > 0:
+            raise next(iter(failed_homes.values()))
+
+        homes, topology_change = reconcile_homes(current_homes, homes)
+        device_storage.set_user_homes(user_id, homes)
+
+        if not topology_change.is_empty:
+            self._command_client.on_topology_changed(topology_change)
+            await self._send_topology_change(topology_change)
+
+        if self._topology_cache_path is not None:
+            await self._save_topology_cache(homes)
+
+        return failed_homes
+
+    async def _load_topology_cache(self) -> bool:
+        """Loads the user's homes from the topology cache, if there is one. Returns whether any homes were loaded."""
+        if self._topology_cache_path is None:
+            return False
+
+        user_id = self._auth.user.user_id
+        homes = await asyncio.to_thread(load_topology_cache, self._topology_cache_path, user_id, self._command_client)
+        if not homes:
+            return False
+
+        device_storage.set_user_homes(user_id, homes)
+        return True
+
+    async def _save_topology_cache(self, homes: list[CyncHome]):
+        try:
+            await asyncio.to_thread(save_topology_cache, self._topology_cache_path, self._auth.user.user_id, homes)
+        except OSError as ex:
+            self._LOGGER.warning("Could not write topology cache {}: {!r}".format(self._topology_cache_path, ex))
+
+    async def _refresh_in_background(self):
+        try:
+            await self.refresh_home_info()
+        except Exception as ex:
+            self._LOGGER.error("Failed to refresh home information: {!r}".format(ex))
+
+    async def _send_topology_change(self, topology_change: TopologyChange):
+        callback = device_storage.get_user_topology_callback(self._auth.user.user_id)
+        if callback is not None:
+            if asyncio.iscoroutinefunction(callback):
+                await callback(topology_change)
+            else:
+                callback(topology_change)
+
+    async def _fetch_home_properties(self, home_json: dict, fetch_semaphore: asyncio.Semaphore):
+        """
+        Fetches the mesh properties for a single home.
+        Returns the home JSON, the fetched properties, and the error that occurred, if any.
+        """
+        async with fetch_semaphore:
+            try:
+                mesh_device_info = await self._auth._send_user_request(
+                    f"{REST_API_BASE_URL}/v2/product/{home_json["product_id"]}/device/{home_json["id"]}/property")
+            except Exception as ex:
+                return home_json, None, ex
+
+        return home_json, mesh_device_info, None
 
     async def shut_down(self):
         """Shut down the command client instance and close its associated connections."""
+        if self._background_refresh is not None:
+            self._background_refresh.cancel()
+        for stream in list(self._state_change_streams):
+            stream.close()
         await self._command_client.shut_down()
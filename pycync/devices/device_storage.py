@@ -2,8 +2,10 @@ from __future__ import annotations
 from typing import Callable, TYPE_CHECKING
 
 from pycync.exceptions import CyncError
+from .subscriptions import Subscription, SubscriptionRegistry
 
 if TYPE_CHECKING:
+    from pycync.devices import CyncDevice
     from pycync.devices.groups import CyncHome
 
 _user_homes: dict[int, UserHomes] = {}
@@ -19,9 +21,9 @@ def get_user_homes(user_id: int):
 def get_home_by_id(user_id: int, home_id: int):
     """Fetch a home by the user and home ID."""
 
-    user_homes = _user_homes.get(user_id, UserHomes([])).homes
+    topology_index = _user_homes.get(user_id, UserHomes([])).topology_index
 
-    found_home = next((home for home in user_homes if home.home_id == home_id), None)
+    found_home = topology_index.homes_by_home_id.get(home_id)
     if found_home is None:
         raise CyncError(f"Home ID {home_id} not found on user account {user_id}.")
     return found_home
@@ -52,42 +54,163 @@ def set_user_device_callback(user_id: int, callback: Callable):
     _user_homes[user_id] = current_homes
 
 
+def get_user_topology_callback(user_id: int):
+    """Get the configured topology change callback function for the user."""
+
+    current_homes = _user_homes.get(user_id, UserHomes([]))
+    return current_homes.on_topology_change
+
+
+def set_user_topology_callback(user_id: int, callback: Callable):
+    """Set the configured topology change callback function for the user."""
+
+    current_homes = _user_homes.get(user_id, UserHomes([]))
+    current_homes.on_topology_change = callback
+
+    _user_homes[user_id] = current_homes
+
+
+def get_user_subscriptions(user_id: int) -> SubscriptionRegistry:
+    """Get the device state subscriptions for the user."""
+
+    current_homes = _user_homes.get(user_id, UserHomes([]))
+    return current_homes.subscriptions
+
+
+def add_user_subscription(user_id: int, subscription: Subscription):
+    """Add a device state subscription for the user."""
+
+    current_homes = _user_homes.get(user_id, UserHomes([]))
+    current_homes.subscriptions.add(subscription, current_homes.homes)
+
+    _user_homes[user_id] = current_homes
+
+
+def remove_user_subscription(user_id: int, subscription: Subscription):
+    """Remove a device state subscription for the user. Does nothing if the subscription was already removed."""
+
+    current_homes = _user_homes.get(user_id)
+    if current_homes is not None:
+        current_homes.subscriptions.remove(subscription)
+
+
 def get_associated_home(user_id: int, device_id: int):
     """Get the home that the provided device id belongs to."""
 
-    user_homes = _user_homes.get(user_id, UserHomes([])).homes
+    topology_index = _user_homes.get(user_id, UserHomes([])).topology_index
 
-    found_home = next((home for home in user_homes if home.contains_device_id(device_id)), None)
+    found_home = topology_index.homes_by_device_id.get(device_id)
     if found_home is None:
         raise CyncError(f"Device ID {device_id} not found on user account {user_id}.")
     return found_home
 
 
+def get_device_by_id(user_id: int, device_id: int):
+    """Get the device with the provided device id."""
+
+    topology_index = _user_homes.get(user_id, UserHomes([])).topology_index
+
+    found_device = topology_index.devices_by_device_id.get(device_id)
+    if found_device is None:
+        raise CyncError(f"Device ID {device_id} not found on user account {user_id}.")
+    return found_device
+
+
+def get_device_by_unique_id(user_id: int, unique_id: str):
+    """Get the device with the provided unique id."""
+
+    topology_index = _user_homes.get(user_id, UserHomes([])).topology_index
+
+    found_device = topology_index.devices_by_unique_id.get(unique_id)
+    if found_device is None:
+        raise CyncError(f"Device {unique_id} not found on user account {user_id}.")
+    return found_device
+
+
+def get_associated_home_mesh_devices(user_id: int, device_id: int):
+    """
+    Given a device ID, returns a mapping of isolated mesh IDs to the devices with that mesh ID,
+    for the home that the device ID belongs to.
+    """
+
+    home_for_device = get_associated_home(user_id, device_id)
+    topology_index = _user_homes[user_id].topology_index
+
+    return topology_index.mesh_devices_by_home_id[home_for_device.home_id]
+
+
 def get_associated_home_devices(user_id: int, device_id: int):
     """Given a device ID, returns a list of all devices that exist in the same home that the device ID belongs to."""
 
     home_for_device = get_associated_home(user_id, device_id)
-    return home_for_device.get_flattened_device_list()
+    topology_index = _user_homes[user_id].topology_index
 
+    return topology_index.devices_by_home_id[home_for_device.home_id]
 
-def get_flattened_devices(user_id: int):
-    """Returns a list of all devices that have been configured for the user, across all homes."""
-
-    homes = _user_homes.get(user_id, UserHomes([])).homes
-    all_devices = []
 
-    for home in homes:
-        all_devices.extend(home.get_flattened_device_list())
+def get_flattened_devices(user_id: int):
+    """Returns all devices that have been configured for the user, across all homes."""
 
-    return all_devices
+    return _user_homes.get(user_id, UserHomes([])).topology_index.all_devices
 
 
 class UserHomes:
     """
-    A summary of all homes associated with a user, and an optional callback function
-    to call when any of the home's devices are updated.
+    A summary of all homes associated with a user, and optional callback functions
+    to call when any of the home's devices are updated, or when the homes' topology changes.
+    Subscriptions to specific devices are resolved again whenever the homes are set.
     """
 
-    def __init__(self, homes: list[CyncHome], on_data_update: Callable = None):
+    def __init__(self, homes: list[CyncHome], on_data_update: Callable = None, on_topology_change: Callable = None):
+        self.subscriptions = SubscriptionRegistry()
         self.homes = homes
         self.on_data_update = on_data_update
+        self.on_topology_change = on_topology_change
+
+    @property
+    def homes(self) -> list[CyncHome]:
+        return self._homes
+
+    @homes.setter
+    def homes(self, homes: list[CyncHome]):
+        # Build the new index before swapping anything in, so lookups never see a half-built index.
+        topology_index = TopologyIndex(homes)
+
+        self._homes = homes
+        self.topology_index = topology_index
+        self.subscriptions.resolve(homes)
+
+
+class TopologyIndex:
+    """
+    Lookup tables for a user's homes, so that inbound packets can be resolved to devices without
+    searching through every home.
+    The index is rebuilt whenever the user's homes are set.
+    """
+
+    def __init__(self, homes: list[CyncHome]):
+        self.homes_by_home_id: dict[int, CyncHome] = {}
+        self.homes_by_device_id: dict[int, CyncHome] = {}
+        self.devices_by_device_id: dict[int, CyncDevice] = {}
+        self.devices_by_unique_id: dict[str, CyncDevice] = {}
+        self.devices_by_home_id: dict[int, tuple[CyncDevice, ...]] = {}
+        self.mesh_devices_by_home_id: dict[int, dict[int, list[CyncDevice]]] = {}
+
+        all_devices: list[CyncDevice] = []
+
+        for home in homes:
+            home_devices = tuple(home.get_flattened_device_list())
+            mesh_devices: dict[int, list[CyncDevice]] = {}
+
+            for device in home_devices:
+                self.homes_by_device_id.setdefault(device.device_id, home)
+                self.devices_by_device_id.setdefault(device.device_id, device)
+                self.devices_by_unique_id[device.unique_id] = device
+                mesh_devices.setdefault(device.isolated_mesh_id, []).append(device)
+
+            self.homes_by_home_id.setdefault(home.home_id, home)
+            self.devices_by_home_id[home.home_id] = home_devices
+            self.mesh_devices_by_home_id[home.home_id] = mesh_devices
+            all_devices.extend(home_devices)
+
+        self.all_devices: tuple[CyncDevice, ...] = tuple(all_devices)
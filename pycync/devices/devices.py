@@ -124,7 +124,7 @@ class CyncDevice(CyncControllable):
         self.isolated_mesh_id = self.mesh_device_id % 1000
 
     @classmethod
-    def from_dict(cls, data: dict[str, Any]) -> CyncDevice:
+    def from_dict(cls, data: dict[str, Any], command_client: CommandClient = None) -> CyncDevice:
         is_online = data.get("is_online")
         wifi_connected = data.get("wifi_connected")
         device_id = data.get("device_id")
@@ -162,7 +162,8 @@ class CyncDevice(CyncControllable):
                     data.get("is_on", False),
                     data.get("brightness", 0),
                     data.get("color_temp", 0),
-                    data.get("rgb", (0, 0, 0)))
+                    tuple(data.get("rgb", (0, 0, 0))),
+                    command_client=command_client)
             case DeviceType.PLUG:
                 return CyncPlug(
                     is_online,
@@ -177,6 +178,7 @@ class CyncDevice(CyncControllable):
                     product_id,
                     authorize_code,
                     is_on=data.get("is_on", False),
+                    command_client=command_client,
                 )
             case _:
                 return CyncDevice(
@@ -190,12 +192,52 @@ class CyncDevice(CyncControllable):
                     device_type,
                     mac_address,
                     product_id,
-                    authorize_code
+                    authorize_code,
+                    command_client=command_client
                 )
 
+    def to_dict(self) -> dict[str, Any]:
+        """Serializes the device into the format read by from_dict."""
+        return {
+            "is_online": self.is_online,
+            "wifi_connected": self.wifi_connected,
+            "device_id": self.device_id,
+            "mesh_device_id": self.mesh_device_id,
+            "home_id": self.parent_home_id,
+            "name": self._name,
+            "device_type_id": self.device_type_id,
+            "device_type": self.device_type.name,
+            "mac_address": self.mac,
+            "product_id": self.product_id,
+            "authorize_code": self.authorize_code,
+        }
+
     def set_wifi_connected(self, wifi_connected: bool):
         self.wifi_connected = wifi_connected
 
+    def update_description(self, other: CyncDevice) -> bool:
+        """
+        Copies the descriptive attributes, such as the name and device type, from a freshly fetched copy of this device.
+        Live state like power, brightness and connectivity is left untouched. Returns whether anything changed.
+        """
+        if self._description() == other._description():
+            return False
+
+        self.device_id = other.device_id
+        self._name = other._name
+        self.device_type_id = other.device_type_id
+        self.device_type = other.device_type
+        self.mac = other.mac
+        self.product_id = other.product_id
+        self.authorize_code = other.authorize_code
+        self._capabilities = other._capabilities
+
+        return True
+
+    def _description(self) -> tuple:
+        return (self.device_id, self._name, self.device_type_id, self.device_type, self.mac, self.product_id,
+                self.authorize_code)
+
     def set_datapoints(self, datapoints: dict[str, Any]):
         """Currently not used. Will be once datapoint-driven devices are implemented."""
         self.datapoints = datapoints
@@ -308,53 +350,72 @@ class CyncLight(CyncDevice):
 
         return self._rgb
 
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            **super().to_dict(),
+            "is_on": self._is_on,
+            "brightness": self._brightness,
+            "color_temp": self._color_temp,
+            "rgb": list(self._rgb),
+        }
+
     def update_state(self, is_on: bool, brightness: int = None, color_temp: int = None,
-                     rgb: Tuple[int, int, int] = None, is_online: bool = None):
-        self._is_on = is_on
-        if brightness is not None:
+                     rgb: Tuple[int, int, int] = None, is_online: bool = None) -> frozenset[str]:
+        """Sets the light's state. Returns the names of the fields that changed, which is empty if none did."""
+        changed_fields = set()
+        if self._is_on != is_on:
+            self._is_on = is_on
+            changed_fields.add("is_on")
+        if brightness is not None and self._brightness != brightness:
             self._brightness = brightness
-        if color_temp is not None:
+            changed_fields.add("brightness")
+        if color_temp is not None and self._color_temp != color_temp:
             self._color_temp = color_temp
-        if rgb is not None:
+            changed_fields.add("color_temp")
+        if rgb is not None and self._rgb != rgb:
             self._rgb = rgb
-        if is_online is not None:
+            changed_fields.add("rgb")
+        if is_online is not None and self.is_online != is_online:
             self.is_online = is_online
+            changed_fields.add("is_online")
+
+        return frozenset(changed_fields)
 
     async def turn_on(self):
         if not self.supports_capability(CyncCapability.ON_OFF):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_power_state(self, True)
+        return await self._command_client.set_power_state(self, True)
 
     async def turn_off(self):
         if not self.supports_capability(CyncCapability.ON_OFF):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_power_state(self, False)
+        return await self._command_client.set_power_state(self, False)
 
     async def set_brightness(self, brightness):
         if not self.supports_capability(CyncCapability.DIMMING):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_brightness(self, brightness)
+        return await self._command_client.set_brightness(self, brightness)
 
     async def set_color_temp(self, color_temp):
         if not self.supports_capability(CyncCapability.CCT_COLOR):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_color_temp(self, color_temp)
+        return await self._command_client.set_color_temp(self, color_temp)
 
     async def set_rgb(self, rgb: tuple[int, int, int]):
         if not self.supports_capability(CyncCapability.RGB_COLOR):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_rgb(self, rgb)
+        return await self._command_client.set_rgb(self, rgb)
 
     async def set_combo(self, is_on: bool, brightness: int, color_temp: int | None = None, rgb: tuple[int, int, int] | None = None):
         if not self.supports_capability(CyncCapability.COMBO):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_combo(self, is_on, brightness, color_temp, rgb)
+        return await self._command_client.set_combo(self, is_on, brightness, color_temp, rgb)
 
 class CyncPlug(CyncDevice):
     """Class for representing Cync plugs."""
@@ -397,19 +458,32 @@ class CyncPlug(CyncDevice):
 
         return self._is_on
 
-    def update_state(self, is_on: bool, is_online: bool = None):
-        self._is_on = is_on
-        if is_online is not None:
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            **super().to_dict(),
+            "is_on": self._is_on,
+        }
+
+    def update_state(self, is_on: bool, is_online: bool = None) -> frozenset[str]:
+        """Sets the plug's state. Returns the names of the fields that changed, which is empty if none did."""
+        changed_fields = set()
+        if self._is_on != is_on:
+            self._is_on = is_on
+            changed_fields.add("is_on")
+        if is_online is not None and self.is_online != is_online:
             self.is_online = is_online
+            changed_fields.add("is_online")
+
+        return frozenset(changed_fields)
 
     async def turn_on(self):
         if not self.supports_capability(CyncCapability.ON_OFF):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_power_state(self, True)
+        return await self._command_client.set_power_state(self, True)
 
     async def turn_off(self):
         if not self.supports_capability(CyncCapability.ON_OFF):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_power_state(self, False)
+        return await self._command_client.set_power_state(self, False)
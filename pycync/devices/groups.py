@@ -20,7 +20,75 @@ class GroupedCyncDevices(ABC):
         pass
 
 
-class CyncHome:
+class TopologyTracked:
+    """
+    Tracks structural changes to a grouping, and forwards them to the grouping that contains it.
+    Any change to a room or group therefore also bumps the topology version of its home.
+    """
+
+    _topology_version: int = 0
+    _topology_parent: TopologyTracked | None = None
+
+    @property
+    def topology_version(self) -> int:
+        return self._topology_version
+
+    def invalidate_topology(self):
+        """
+        Marks the structure of this grouping as changed.
+        Assigning or mutating its rooms, groups or device lists does this automatically.
+        """
+        self._topology_version += 1
+        if self._topology_parent is not None:
+            self._topology_parent.invalidate_topology()
+
+    def _adopt(self, children: list[TopologyTracked]):
+        for child in children:
+            child._topology_parent = self
+
+
+class _TopologyList(list):
+    """
+    A list of a grouping's rooms, groups or devices, which invalidates the grouping's topology when mutated in place.
+    Rooms and groups added to the list are adopted by the grouping.
+    """
+
+    _owner: TopologyTracked | None = None
+    _adopts_items = False
+
+    def __init__(self, owner: TopologyTracked, items: list, adopts_items: bool = False):
+        super().__init__(items)
+        self._owner = owner
+        self._adopts_items = adopts_items
+
+    def _mutated(self):
+        # The owner isn't set yet while a copy of the list is being filled in.
+        if self._owner is None:
+            return
+
+        if self._adopts_items:
+            self._owner._adopt(self)
+        self._owner.invalidate_topology()
+
+
+def _invalidating(method_name: str):
+    list_method = getattr(list, method_name)
+
+    def mutate(self: _TopologyList, *args, **kwargs):
+        result = list_method(self, *args, **kwargs)
+        self._mutated()
+        return result
+
+    mutate.__name__ = method_name
+    return mutate
+
+
+for _method_name in ("__setitem__", "__delitem__", "__iadd__", "__imul__", "append", "extend", "insert", "pop",
+                     "remove", "clear", "sort", "reverse"):
+    setattr(_TopologyList, _method_name, _invalidating(_method_name))
+
+
+class CyncHome(TopologyTracked):
     """Represents a "home" in the Cync app."""
 
     def __init__(self, name: str, home_id: int, rooms: list[CyncRoom], global_devices: list[CyncDevice]):
@@ -29,15 +97,46 @@ class CyncHome:
         self.rooms = rooms
         self.global_devices = global_devices
 
+        self._flattened_devices: tuple[CyncDevice, ...] = ()
+        self._flattened_devices_version = -1
+
+    @property
+    def rooms(self) -> list[CyncRoom]:
+        return self._rooms
+
+    @rooms.setter
+    def rooms(self, rooms: list[CyncRoom]):
+        self._rooms = _TopologyList(self, rooms, adopts_items=True)
+        self._adopt(rooms)
+        self.invalidate_topology()
+
+    @property
+    def global_devices(self) -> list[CyncDevice]:
+        return self._global_devices
+
+    @global_devices.setter
+    def global_devices(self, global_devices: list[CyncDevice]):
+        self._global_devices = _TopologyList(self, global_devices)
+        self.invalidate_topology()
+
     @classmethod
-    def from_dict(cls, data: dict) -> CyncHome:
+    def from_dict(cls, data: dict, command_client: CommandClient = None) -> CyncHome:
         name = data.get("name")
         home_id = data.get("home_id")
-        rooms = [CyncRoom.from_dict(room) for room in data.get("rooms")]
-        global_devices = [CyncDevice.from_dict(device) for device in data.get("global_devices")]
+        rooms = [CyncRoom.from_dict(room, command_client) for room in data.get("rooms")]
+        global_devices = [CyncDevice.from_dict(device, command_client) for device in data.get("global_devices")]
 
         return CyncHome(name, home_id, rooms, global_devices)
 
+    def to_dict(self) -> dict:
+        """Serializes the home, along with its rooms, groups and devices, into the format read by from_dict."""
+        return {
+            "name": self.name,
+            "home_id": self.home_id,
+            "rooms": [room.to_dict() for room in self.rooms],
+            "global_devices": [device.to_dict() for device in self.global_devices],
+        }
+
     def contains_device_id(self, device_id: int) -> bool:
         """
         Determines whether a given device ID exists in this home.
@@ -49,22 +148,27 @@ class CyncHome:
 
         return search_result is not None
 
-    def get_flattened_device_list(self) -> list[CyncDevice]:
+    def get_flattened_device_list(self) -> tuple[CyncDevice, ...]:
         """
-        Returns a flattened list of all devices in the home, across all rooms and groups.
+        Returns a flattened tuple of all devices in the home, across all rooms and groups.
+        The result is cached, and only rebuilt after the home's topology has changed.
         """
 
-        home_devices = self.global_devices.copy()
+        if self._flattened_devices_version != self.topology_version:
+            home_devices = list(self.global_devices)
 
-        for room in self.rooms:
-            home_devices.extend(room.devices)
-            for group in room.groups:
-                home_devices.extend(group.devices)
+            for room in self.rooms:
+                home_devices.extend(room.devices)
+                for group in room.groups:
+                    home_devices.extend(group.devices)
 
-        return home_devices
+            self._flattened_devices = tuple(home_devices)
+            self._flattened_devices_version = self.topology_version
 
+        return self._flattened_devices
 
-class CyncRoom(GroupedCyncDevices, CyncControllable):
+
+class CyncRoom(GroupedCyncDevices, CyncControllable, TopologyTracked):
     """Represents a "room" in the Cync app."""
 
     def __init__(self, name: str, room_id: int, home_id: int, groups: list[CyncGroup],
@@ -76,15 +180,51 @@ class CyncRoom(GroupedCyncDevices, CyncControllable):
         self.devices = devices
         self._command_client = command_client
 
+    @property
+    def groups(self) -> list[CyncGroup]:
+        return self._groups
+
+    @groups.setter
+    def groups(self, groups: list[CyncGroup]):
+        self._groups = _TopologyList(self, groups, adopts_items=True)
+        self._adopt(groups)
+        self.invalidate_topology()
+
+    @property
+    def devices(self) -> list[CyncDevice]:
+        return self._devices
+
+    @devices.setter
+    def devices(self, devices: list[CyncDevice]):
+        self._devices = _TopologyList(self, devices)
+        self.invalidate_topology()
+
+    def update_description(self, other: CyncRoom) -> bool:
+        """Copies the name from a freshly fetched copy of this room. Returns whether it changed."""
+        if self._name == other._name:
+            return False
+
+        self._name = other._name
+        return True
+
     @classmethod
-    def from_dict(cls, data: dict) -> CyncRoom:
+    def from_dict(cls, data: dict, command_client: CommandClient = None) -> CyncRoom:
         name = data.get("name")
         room_id = data.get("room_id")
         home_id = data.get("home_id")
-        groups = [CyncGroup.from_dict(group) for group in data.get("groups")]
-        devices = [CyncDevice.from_dict(device) for device in data.get("devices")]
+        groups = [CyncGroup.from_dict(group, command_client) for group in data.get("groups")]
+        devices = [CyncDevice.from_dict(device, command_client) for device in data.get("devices")]
+
+        return CyncRoom(name, room_id, home_id, groups, devices, command_client)
 
-        return CyncRoom(name, room_id, home_id, groups, devices)
+    def to_dict(self) -> dict:
+        return {
+            "name": self._name,
+            "room_id": self.room_id,
+            "home_id": self.parent_home_id,
+            "groups": [group.to_dict() for group in self.groups],
+            "devices": [device.to_dict() for device in self.devices],
+        }
 
     @property
     def capabilities(self) -> frozenset[CyncCapability]:
@@ -120,34 +260,34 @@ class CyncRoom(GroupedCyncDevices, CyncControllable):
         if not self.supports_capability(CyncCapability.ON_OFF):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_power_state(self, True)
+        return await self._command_client.set_power_state(self, True)
 
     async def turn_off(self):
         if not self.supports_capability(CyncCapability.ON_OFF):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_power_state(self, False)
+        return await self._command_client.set_power_state(self, False)
 
     async def set_brightness(self, brightness):
         if not self.supports_capability(CyncCapability.DIMMING):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_brightness(self, brightness)
+        return await self._command_client.set_brightness(self, brightness)
 
     async def set_color_temp(self, color_temp):
         if not self.supports_capability(CyncCapability.CCT_COLOR):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_color_temp(self, color_temp)
+        return await self._command_client.set_color_temp(self, color_temp)
 
     async def set_rgb(self, rgb: tuple[int, int, int]):
         if not self.supports_capability(CyncCapability.RGB_COLOR):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_rgb(self, rgb)
+        return await self._command_client.set_rgb(self, rgb)
 
 
-class CyncGroup(GroupedCyncDevices, CyncControllable):
+class CyncGroup(GroupedCyncDevices, CyncControllable, TopologyTracked):
     """Represents a "group" in the Cync app."""
 
     def __init__(self, name: str, group_id: int, home_id: int, devices: list[CyncDevice],
@@ -158,14 +298,39 @@ class CyncGroup(GroupedCyncDevices, CyncControllable):
         self.devices = devices
         self._command_client = command_client
 
+    @property
+    def devices(self) -> list[CyncDevice]:
+        return self._devices
+
+    @devices.setter
+    def devices(self, devices: list[CyncDevice]):
+        self._devices = _TopologyList(self, devices)
+        self.invalidate_topology()
+
+    def update_description(self, other: CyncGroup) -> bool:
+        """Copies the name from a freshly fetched copy of this group. Returns whether it changed."""
+        if self._name == other._name:
+            return False
+
+        self._name = other._name
+        return True
+
     @classmethod
-    def from_dict(cls, data: dict) -> CyncGroup:
+    def from_dict(cls, data: dict, command_client: CommandClient = None) -> CyncGroup:
         name = data.get("name")
         group_id = data.get("group_id")
         home_id = data.get("home_id")
-        devices = [CyncDevice.from_dict(device) for device in data.get("devices")]
+        devices = [CyncDevice.from_dict(device, command_client) for device in data.get("devices")]
+
+        return CyncGroup(name, group_id, home_id, devices, command_client)
 
-        return CyncGroup(name, group_id, home_id, devices)
+    def to_dict(self) -> dict:
+        return {
+            "name": self._name,
+            "group_id": self.group_id,
+            "home_id": self.parent_home_id,
+            "devices": [device.to_dict() for device in self.devices],
+        }
 
     @property
     def capabilities(self) -> frozenset[CyncCapability]:
@@ -198,28 +363,28 @@ class CyncGroup(GroupedCyncDevices, CyncControllable):
         if not self.supports_capability(CyncCapability.ON_OFF):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_power_state(self, True)
+        return await self._command_client.set_power_state(self, True)
 
     async def turn_off(self):
         if not self.supports_capability(CyncCapability.ON_OFF):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_power_state(self, False)
+        return await self._command_client.set_power_state(self, False)
 
     async def set_brightness(self, brightness):
         if not self.supports_capability(CyncCapability.DIMMING):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_brightness(self, brightness)
+        return await self._command_client.set_brightness(self, brightness)
 
     async def set_color_temp(self, color_temp):
         if not self.supports_capability(CyncCapability.CCT_COLOR):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_color_temp(self, color_temp)
+        return await self._command_client.set_color_temp(self, color_temp)
 
     async def set_rgb(self, rgb: tuple[int, int, int]):
         if not self.supports_capability(CyncCapability.RGB_COLOR):
             raise UnsupportedCapabilityError()
 
-        await self._command_client.set_rgb(self, rgb)
+        return await self._command_client.set_rgb(self, rgb)
@@ -0,0 +1,132 @@
+"""
+Streams of device state changes, read with async for.
+Each stream buffers its own changes, so a slow consumer never holds up the connection or any other consumer.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from enum import Enum
+from typing import Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .devices import CyncDevice
+
+DEFAULT_MAX_BUFFERED_STATE_CHANGES = 256
+
+
+class OverflowPolicy(Enum):
+    """What a state change stream does with a new change when its buffer is full."""
+
+    # Every change is buffered. Once the buffer is full, the oldest change is dropped.
+    DROP_OLDEST = "drop_oldest"
+    # A device that already has a change buffered isn't buffered again, since that change delivers its newest state.
+    # Instead, the new change's fields are merged into the buffered one.
+    # Once the buffer is full of distinct devices, the oldest change is dropped.
+    COALESCE = "coalesce"
+
+
+class StateChange:
+    """
+    A change to a device's state, and the names of the fields that changed, like is_on or brightness.
+    The device always holds its newest state.
+    """
+
+    def __init__(self, device: CyncDevice, changed_fields: frozenset[str] = frozenset()):
+        self.device = device
+        self.changed_fields = changed_fields
+
+    @property
+    def unique_id(self) -> str:
+        return self.device.unique_id
+
+
+class StateChangeStream:
+    """
+    An async iterator of device state changes.
+    Iteration ends once the stream is closed and its buffered changes have been read. Using the stream as an async
+    context manager closes it on exit.
+    """
+
+    def __init__(self, max_buffered_changes: int = DEFAULT_MAX_BUFFERED_STATE_CHANGES,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.COALESCE, on_close: Callable[[], None] = None):
+        self._max_buffered_changes = max_buffered_changes
+        self._overflow_policy = overflow_policy
+        self._on_close = on_close
+
+        self._buffered_changes: deque[StateChange] = deque()
+        # The buffered change of each device, used when coalescing.
+        self._buffered_changes_by_unique_id: dict[str, StateChange] = {}
+        self._change_available = asyncio.Event()
+        self._is_closed = False
+
+        self.dropped_changes = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> StateChange:
+        while len(self._buffered_changes) == 0:
+            if self._is_closed:
+                raise StopAsyncIteration
+
+            self._change_available.clear()
+            await self._change_available.wait()
+
+        state_change = self._buffered_changes.popleft()
+        self._forget_buffered_change(state_change)
+
+        return state_change
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def is_closed(self) -> bool:
+        return self._is_closed
+
+    def push(self, updated_data: dict[str, CyncDevice], changed_fields: dict[str, frozenset[str]] = None):
+        """Buffers the changes in a device update. Called by the command client, while the update is processed."""
+
+        if self._is_closed:
+            return
+
+        changed_fields = changed_fields or {}
+        is_coalescing = self._overflow_policy == OverflowPolicy.COALESCE
+        for unique_id, device in updated_data.items():
+            device_changed_fields = changed_fields.get(unique_id, frozenset())
+
+            buffered_change = self._buffered_changes_by_unique_id.get(unique_id)
+            if buffered_change is not None:
+                buffered_change.changed_fields |= device_changed_fields
+                continue
+
+            if len(self._buffered_changes) >= self._max_buffered_changes:
+                self._forget_buffered_change(self._buffered_changes.popleft())
+                self.dropped_changes += 1
+
+            state_change = StateChange(device, device_changed_fields)
+            self._buffered_changes.append(state_change)
+            if is_coalescing:
+                self._buffered_changes_by_unique_id[unique_id] = state_change
+
+        self._change_available.set()
+
+    def _forget_buffered_change(self, state_change: StateChange):
+        if self._buffered_changes_by_unique_id.get(state_change.unique_id) is state_change:
+            del self._buffered_changes_by_unique_id[state_change.unique_id]
+
+    def close(self):
+        """Stops the stream. Changes that are already buffered can still be read."""
+
+        if self._is_closed:
+            return
+
+        self._is_closed = True
+        self._change_available.set()
+        if self._on_close is not None:
+            self._on_close()
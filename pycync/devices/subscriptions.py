@@ -0,0 +1,114 @@
+"""
+Subscriptions to the state changes of a subset of a user's devices.
+Subscriptions are resolved to the unique IDs of their devices ahead of time, so routing an update only touches the
+subscriptions of the devices that changed.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, Iterable, TYPE_CHECKING
+
+from .capabilities import CyncCapability
+
+if TYPE_CHECKING:
+    from .devices import CyncDevice
+    from .groups import CyncHome, CyncRoom, CyncGroup
+
+
+class Subscription:
+    """
+    A callback, and the devices it is interested in.
+    A device matches if it has one of the given unique IDs, or is in one of the given rooms, groups or homes. If no
+    devices, rooms, groups or homes are given, every device matches. If capabilities are given, only devices that
+    support all of them match.
+    Callbacks normally run through the callback dispatcher. Inline callbacks are called directly while the update
+    is being processed instead, so they must be quick, synchronous, and never block. They are also given the
+    fields that changed on each device.
+    """
+
+    def __init__(self, callback: Callable, unique_ids: Iterable[str] = None, rooms: Iterable[CyncRoom] = None,
+                 groups: Iterable[CyncGroup] = None, homes: Iterable[CyncHome] = None,
+                 capabilities: Iterable[CyncCapability] = None, is_inline: bool = False):
+        self.callback = callback
+        self.is_inline = is_inline
+        self.unique_ids = frozenset(unique_ids or ())
+        # Rooms and groups are kept by unique ID, so they still match after the topology is refreshed.
+        self.room_ids = frozenset(room.unique_id for room in rooms or ())
+        self.group_ids = frozenset(group.unique_id for group in groups or ())
+        self.home_ids = frozenset(home.home_id for home in homes or ())
+        self.capabilities = frozenset(capabilities or ())
+
+    def resolve(self, homes: list[CyncHome]) -> set[str]:
+        """Returns the unique IDs of the devices in the given homes that match this subscription."""
+
+        matches_everything = not (self.unique_ids or self.room_ids or self.group_ids or self.home_ids)
+
+        candidates: list[CyncDevice] = []
+        for home in homes:
+            if matches_everything or home.home_id in self.home_ids:
+                candidates.extend(home.get_flattened_device_list())
+                continue
+
+            candidates.extend(device for device in home.get_flattened_device_list()
+                              if device.unique_id in self.unique_ids)
+            for room in home.rooms:
+                if room.unique_id in self.room_ids:
+                    candidates.extend(room.devices)
+                for group in room.groups:
+                    if room.unique_id in self.room_ids or group.unique_id in self.group_ids:
+                        candidates.extend(group.devices)
+
+        return {device.unique_id for device in candidates
+                if all(device.supports_capability(capability) for capability in self.capabilities)}
+
+
+class SubscriptionRegistry:
+    """A user's subscriptions, indexed by the unique IDs of the devices they match."""
+
+    def __init__(self):
+        self._subscriptions: list[Subscription] = []
+        self._subscriptions_by_unique_id: dict[str, list[Subscription]] = {}
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def add(self, subscription: Subscription, homes: list[CyncHome]):
+        self._subscriptions.append(subscription)
+        self._index(subscription, homes)
+
+    def remove(self, subscription: Subscription):
+        if subscription not in self._subscriptions:
+            return
+
+        self._subscriptions.remove(subscription)
+        for unique_id in [unique_id for unique_id, subscriptions in self._subscriptions_by_unique_id.items()
+                          if subscription in subscriptions]:
+            subscriptions = self._subscriptions_by_unique_id[unique_id]
+            subscriptions.remove(subscription)
+            if len(subscriptions) == 0:
+                del self._subscriptions_by_unique_id[unique_id]
+
+    def resolve(self, homes: list[CyncHome]):
+        """Rebuilds the index for the given homes, after their topology has changed."""
+
+        self._subscriptions_by_unique_id = {}
+        for subscription in self._subscriptions:
+            self._index(subscription, homes)
+
+    def route(self, updated_data: dict[str, CyncDevice]) -> list[tuple[Subscription, dict[str, CyncDevice]]]:
+        """Splits an update into the part each interested subscription should receive."""
+
+        if len(self._subscriptions_by_unique_id) == 0:
+            return []
+
+        routed_data: dict[int, tuple[Subscription, dict[str, CyncDevice]]] = {}
+        for unique_id, device in updated_data.items():
+            for subscription in self._subscriptions_by_unique_id.get(unique_id, ()):
+                subscription_data = routed_data.setdefault(id(subscription), (subscription, {}))[1]
+                subscription_data[unique_id] = device
+
+        return list(routed_data.values())
+
+    def _index(self, subscription: Subscription, homes: list[CyncHome]):
+        for unique_id in subscription.resolve(homes):
+            self._subscriptions_by_unique_id.setdefault(unique_id, []).append(subscription)
@@ -0,0 +1,247 @@
+"""
+Assembles a home's devices, groups, and rooms from the Cync REST API responses, and merges refreshed homes into the
+topology that is already loaded.
+Every lookup is driven by dictionaries, so assembly time grows linearly with the size of the home.
+"""
+
+from __future__ import annotations
+
+from typing import Any, TYPE_CHECKING
+
+from .devices import create_device, CyncDevice
+from .groups import CyncHome, CyncRoom, CyncGroup
+
+if TYPE_CHECKING:
+    from pycync.devices.controllable import CyncControllable
+    from pycync.tcp.command_client import CommandClient
+
+
+class TopologyChange:
+    """
+    The homes, devices, rooms and groups that a topology refresh added, removed or changed.
+    An entity is changed when its name or its members changed. A device that changed type is removed and re-added.
+    """
+
+    def __init__(self):
+        self.added: list[CyncHome | CyncControllable] = []
+        self.removed: list[CyncHome | CyncControllable] = []
+        self.changed: list[CyncHome | CyncControllable] = []
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.added) == 0 and len(self.removed) == 0 and len(self.changed) == 0
+
+    @property
+    def added_devices(self) -> list[CyncDevice]:
+        return [entity for entity in self.added if isinstance(entity, CyncDevice)]
+
+
+def index_device_info(device_info: list[dict[str, Any]]) -> dict[int, dict[str, Any]]:
+    """Indexes the account's device list by device ID. If an ID appears more than once, the first entry wins."""
+
+    device_info_by_id: dict[int, dict[str, Any]] = {}
+    for device in device_info:
+        device_info_by_id.setdefault(device["id"], device)
+
+    return device_info_by_id
+
+
+def build_home(home_json: dict[str, Any], mesh_device_info: dict[str, Any],
+               device_info_by_id: dict[int, dict[str, Any]], command_client: CommandClient) -> CyncHome:
+    """
+    Builds a home from its entry in the account's device list and its mesh properties.
+    A device belongs to the first group that lists it. Devices not in any group belong to the first room that lists
+    them, and anything left over is a global device of the home.
+    """
+
+    home_id = home_json["id"]
+
+    home_devices: list[CyncDevice] = []
+    for mesh_device in mesh_device_info.get("bulbsArray", []):
+        if "switchID" not in mesh_device:
+            continue
+
+        matching_device = device_info_by_id.get(mesh_device["switchID"])
+        if matching_device is not None:
+            home_devices.append(create_device(matching_device, mesh_device, home_id, command_client))
+
+    # Maps each mesh device ID to the positions of its devices in home_devices.
+    device_positions: dict[int, list[int]] = {}
+    for position, device in enumerate(home_devices):
+        device_positions.setdefault(device.mesh_device_id, []).append(position)
+    claimed_positions: set[int] = set()
+
+    group_entries = mesh_device_info.get("groupsArray", [])
+    room_json = [group for group in group_entries if group.get("isSubgroup") == False]
+    group_json = [group for group in group_entries if group.get("isSubgroup") == True]
+
+    groups: list[CyncGroup] = []
+    group_positions: dict[int, list[int]] = {}
+    for group in group_json:
+        group_devices = _claim_devices(group, home_devices, device_positions, claimed_positions)
+        group_positions.setdefault(group["groupID"], []).append(len(groups))
+        groups.append(CyncGroup(group["displayName"], group["groupID"], home_id, group_devices, command_client))
+
+    rooms: list[CyncRoom] = []
+    for room in room_json:
+        room_devices = _claim_devices(room, home_devices, device_positions, claimed_positions)
+
+        room_group_positions = {position for group_id in room.get("subgroupIDArray", [])
+                                for position in group_positions.get(group_id, [])}
+        room_groups = [groups[position] for position in sorted(room_group_positions)]
+
+        rooms.append(CyncRoom(room["displayName"], room["groupID"], home_id, room_groups, room_devices,
+                              command_client))
+
+    global_devices = [device for position, device in enumerate(home_devices) if position not in claimed_positions]
+
+    return CyncHome(home_json["name"], home_id, rooms, global_devices)
+
+
+def _claim_devices(group_json: dict[str, Any], home_devices: list[CyncDevice], device_positions: dict[int, list[int]],
+                   claimed_positions: set[int]) -> list[CyncDevice]:
+    """
+    Claims every unclaimed device listed in a group or room's device ID array.
+    Devices are returned in the order they appear in the home.
+    """
+
+    member_positions = {position for mesh_device_id in group_json.get("deviceIDArray", [])
+                        for position in device_positions.get(mesh_device_id, [])
+                        if position not in claimed_positions}
+    claimed_positions.update(member_positions)
+
+    return [home_devices[position] for position in sorted(member_positions)]
+
+
+def reconcile_homes(current_homes: list[CyncHome],
+                    refreshed_homes: list[CyncHome]) -> tuple[list[CyncHome], TopologyChange]:
+    """
+    Merges freshly built homes into the current topology.
+    Homes, rooms, groups and devices that still exist keep their current objects, updated in place, so their live
+    state survives the refresh. Returns the merged homes, and a summary of what changed.
+    """
+
+    reconciler = _TopologyReconciler(current_homes)
+    homes = [reconciler.reconcile_home(refreshed_home) for refreshed_home in refreshed_homes]
+    reconciler.collect_removed()
+
+    return homes, reconciler.topology_change
+
+
+class _TopologyReconciler:
+    def __init__(self, current_homes: list[CyncHome]):
+        self.topology_change = TopologyChange()
+
+        self._current_homes = {home.home_id: home for home in current_homes}
+        self._current_devices: dict[str, CyncDevice] = {}
+        self._current_rooms: dict[str, CyncRoom] = {}
+        self._current_groups: dict[str, CyncGroup] = {}
+        for home in current_homes:
+            for device in home.get_flattened_device_list():
+                self._current_devices.setdefault(device.unique_id, device)
+            for room in home.rooms:
+                self._current_rooms.setdefault(room.unique_id, room)
+                for group in room.groups:
+                    self._current_groups.setdefault(group.unique_id, group)
+
+        # Refreshed entities mapped to the objects they were reconciled into, keyed by object ID.
+        # Groups can be shared between rooms, so the same refreshed group may be reconciled more than once.
+        self._reconciled: dict[int, CyncControllable] = {}
+        self._kept_entity_ids: set[int] = set()
+
+    def reconcile_home(self, refreshed_home: CyncHome) -> CyncHome:
+        rooms = [self._reconcile_room(room) for room in refreshed_home.rooms]
+        global_devices = [self._reconcile_device(device) for device in refreshed_home.global_devices]
+
+        home = self._current_homes.get(refreshed_home.home_id, refreshed_home)
+        is_changed = False
+        if home is not refreshed_home:
+            self._kept_entity_ids.add(id(home))
+            if home.name != refreshed_home.name:
+                home.name = refreshed_home.name
+                is_changed = True
+        if home.rooms != rooms:
+            home.rooms = rooms
+            is_changed = True
+        if home.global_devices != global_devices:
+            home.global_devices = global_devices
+            is_changed = True
+
+        if home is refreshed_home:
+            self.topology_change.added.append(home)
+        elif is_changed:
+            self.topology_change.changed.append(home)
+
+        return home
+
+    def collect_removed(self):
+        for current_entities in (self._current_homes, self._current_devices, self._current_rooms,
+                                 self._current_groups):
+            for entity in current_entities.values():
+                if id(entity) not in self._kept_entity_ids:
+                    self.topology_change.removed.append(entity)
+
+    def _reconcile_room(self, refreshed_room: CyncRoom) -> CyncRoom:
+        if id(refreshed_room) in self._reconciled:
+            return self._reconciled[id(refreshed_room)]
+
+        groups = [self._reconcile_group(group) for group in refreshed_room.groups]
+        devices = [self._reconcile_device(device) for device in refreshed_room.devices]
+
+        room = self._reuse(refreshed_room, self._current_rooms)
+        is_changed = room is not refreshed_room and room.update_description(refreshed_room)
+        if room.groups != groups:
+            room.groups = groups
+            is_changed = True
+        if room.devices != devices:
+            room.devices = devices
+            is_changed = True
+
+        self._record_change(room, refreshed_room, is_changed)
+        return room
+
+    def _reconcile_group(self, refreshed_group: CyncGroup) -> CyncGroup:
+        if id(refreshed_group) in self._reconciled:
+            return self._reconciled[id(refreshed_group)]
+
+        devices = [self._reconcile_device(device) for device in refreshed_group.devices]
+
+        group = self._reuse(refreshed_group, self._current_groups)
+        is_changed = group is not refreshed_group and group.update_description(refreshed_group)
+        if group.devices != devices:
+            group.devices = devices
+            is_changed = True
+
+        self._record_change(group, refreshed_group, is_changed)
+        return group
+
+    def _reconcile_device(self, refreshed_device: CyncDevice) -> CyncDevice:
+        if id(refreshed_device) in self._reconciled:
+            return self._reconciled[id(refreshed_device)]
+
+        device = self._reuse(refreshed_device, self._current_devices)
+        is_changed = device is not refreshed_device and device.update_description(refreshed_device)
+
+        self._record_change(device, refreshed_device, is_changed)
+        return device
+
+    def _reuse(self, refreshed: CyncControllable, current_entities: dict[str, CyncControllable]) -> CyncControllable:
+        """
+        Returns the current object for a refreshed entity, or the refreshed object itself if the entity is new.
+        An entity whose class changed, like a device that was re-added as a different type, is treated as new.
+        """
+
+        current = current_entities.get(refreshed.unique_id)
+        if current is None or type(current) is not type(refreshed) or id(current) in self._kept_entity_ids:
+            return refreshed
+
+        self._kept_entity_ids.add(id(current))
+        return current
+
+    def _record_change(self, entity: CyncControllable, refreshed: CyncControllable, is_changed: bool):
+        self._reconciled[id(refreshed)] = entity
+
+        if entity is refreshed and id(entity) not in self._kept_entity_ids:
+            self.topology_change.added.append(entity)
+        elif is_changed:
+            self.topology_change.changed.append(entity)
@@ -0,0 +1,77 @@
+"""
+Saves a user's homes to disk, so they can be loaded instantly on the next startup instead of waiting on the REST API.
+The cache is only a starting point. The homes are still refreshed from the API afterwards.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+from typing import TYPE_CHECKING
+
+from .groups import CyncHome
+
+if TYPE_CHECKING:
+    from pycync.tcp.command_client import CommandClient
+
+# Bump whenever the serialized format changes, so caches written by older versions are ignored.
+TOPOLOGY_CACHE_VERSION = 1
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def save_topology_cache(cache_path: str, user_id: int, homes: list[CyncHome]):
+    """
+    Writes the user's homes to the cache file.
+    The file is written to a temporary file first and then moved into place, so a crash never leaves a partial cache.
+    """
+
+    cache_data = {
+        "version": TOPOLOGY_CACHE_VERSION,
+        "user_id": user_id,
+        "homes": [home.to_dict() for home in homes],
+    }
+
+    cache_directory = os.path.dirname(os.path.abspath(cache_path))
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=cache_directory, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "w") as cache_file:
+            json.dump(cache_data, cache_file)
+        os.replace(temporary_path, cache_path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def load_topology_cache(cache_path: str, user_id: int, command_client: CommandClient = None) -> list[CyncHome] | None:
+    """
+    Loads the user's homes from the cache file.
+    Returns None if there is no usable cache, such as when the file is missing, unreadable, not a cache, written by a
+    different cache version, or belongs to a different user.
+    """
+
+    try:
+        with open(cache_path) as cache_file:
+            cache_data = json.load(cache_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as ex:
+        _LOGGER.warning("Could not read topology cache {}: {!r}".format(cache_path, ex))
+        return None
+
+    if not isinstance(cache_data, dict):
+        _LOGGER.warning("Could not read topology cache {}, as it doesn't hold a JSON object.".format(cache_path))
+        return None
+
+    if cache_data.get("version") != TOPOLOGY_CACHE_VERSION or cache_data.get("user_id") != user_id:
+        _LOGGER.debug("Ignoring topology cache {}, as it was written for a different version or user.".format(
+            cache_path))
+        return None
+
+    try:
+        return [CyncHome.from_dict(home, command_client) for home in cache_data.get("homes", [])]
+    except (AttributeError, KeyError, TypeError, ValueError) as ex:
+        _LOGGER.warning("Could not load topology cache {}: {!r}".format(cache_path, ex))
+        return None
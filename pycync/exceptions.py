@@ -10,6 +10,9 @@ class AuthFailedError(CyncError):
 class NoHubConnectedError(CyncError):
     """No hub device is connected to Wi-Fi."""
 
+class CommandTimeoutError(CyncError):
+    """A command was not acknowledged by the hub in time."""
+
 class MissingAuthError(Exception):
     """Missing auth error."""
 
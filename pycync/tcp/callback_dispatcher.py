@@ -0,0 +1,98 @@
+"""
+Runs device update callbacks outside of packet processing, so a slow callback never holds up the connection.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable, Hashable
+
+DEFAULT_MAX_CONCURRENT_CALLBACKS = 4
+
+
+class CallbackDispatcher:
+    """
+    Schedules callbacks with device updates, keyed by the devices' unique IDs.
+
+    Updates for the same device are delivered to a callback in the order they were dispatched, while updates for
+    different devices may run concurrently, up to a limit. Async callbacks run on the event loop. Sync callbacks
+    run on the event loop too, unless an executor is given, in which case they run in the executor.
+
+    The updated devices are live objects that always hold their newest state. So if a device's update is still
+    waiting to be delivered to a callback, a newer update for it is dropped, since the waiting update will deliver
+    the newest state anyway. This keeps the backlog bounded by the number of devices.
+    """
+
+    _LOGGER = logging.getLogger(__name__)
+
+    def __init__(self, max_concurrent_callbacks: int = DEFAULT_MAX_CONCURRENT_CALLBACKS,
+                 executor: Executor | None = None):
+        self._concurrency_limit = asyncio.Semaphore(max_concurrent_callbacks)
+        self._executor = executor
+
+        # Keys are (callback, unique ID) pairs.
+        self._waiting_keys: set[tuple[Callable, Hashable]] = set()
+        self._last_task_by_key: dict[tuple[Callable, Hashable], asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def dispatch(self, callback: Callable, updated_data: dict[Hashable, Any]):
+        """Schedules a call of the callback with the updated data, and returns right away."""
+
+        waiting_keys = self._waiting_keys
+        callback_data = {unique_id: value for unique_id, value in updated_data.items()
+                         if (callback, unique_id) not in waiting_keys}
+        if len(callback_data) == 0:
+            return
+
+        keys = [(callback, unique_id) for unique_id in callback_data]
+        predecessors = {self._last_task_by_key[key] for key in keys if key in self._last_task_by_key}
+
+        task = asyncio.create_task(self._run_callback(callback, callback_data, keys, predecessors))
+        for key in keys:
+            self._last_task_by_key[key] = task
+        waiting_keys.update(keys)
+
+        self._tasks.add(task)
+        task.add_done_callback(lambda finished_task: self._callback_finished(finished_task, keys))
+
+    async def join(self):
+        """Waits until every dispatched callback has finished."""
+
+        while len(self._tasks) > 0:
+            await asyncio.wait(set(self._tasks))
+
+    def close(self):
+        """Cancels every callback that hasn't finished yet."""
+
+        for task in self._tasks:
+            task.cancel()
+
+    async def _run_callback(self, callback: Callable, callback_data: dict[Hashable, Any],
+                            keys: list[tuple[Callable, Hashable]], predecessors: set[asyncio.Task]):
+        # Earlier updates for the same devices have to be delivered first.
+        if len(predecessors) > 0:
+            await asyncio.wait(predecessors)
+
+        async with self._concurrency_limit:
+            # From here on, newer updates for these devices have to be delivered again.
+            self._waiting_keys.difference_update(keys)
+
+            try:
+                if asyncio.iscoroutinefunction(callback):
+                    await callback(callback_data)
+                elif self._executor is not None:
+                    await asyncio.get_running_loop().run_in_executor(self._executor, callback, callback_data)
+                else:
+                    callback(callback_data)
+            except Exception:
+                self._LOGGER.exception("Device update callback failed.")
+
+    def _callback_finished(self, task: asyncio.Task, keys: list[tuple[Callable, Hashable]]):
+        self._tasks.discard(task)
+        for key in keys:
+            if self._last_task_by_key.get(key) is task:
+                del self._last_task_by_key[key]
+                # A callback cancelled before it started never cleared its keys.
+                self._waiting_keys.discard(key)
@@ -6,85 +6,208 @@ This client listens for device state changes and updates them accordingly, and a
 from __future__ import annotations
 
 import ssl
-from typing import TYPE_CHECKING
+from concurrent.futures import Executor
+from enum import Enum
+from typing import TYPE_CHECKING, Awaitable, Callable
 
 import asyncio
 import logging
+import time
 
+from .callback_dispatcher import CallbackDispatcher, DEFAULT_MAX_CONCURRENT_CALLBACKS
+from .hub_pool import HubPool
 from .packet import MessageType, ParsedMessage, PipeCommandCode
-from .tcp_manager import TcpManager
+from .packet_queue import DEFAULT_INBOUND_QUEUE_HIGH_WATER_MARK, DEFAULT_INBOUND_QUEUE_LOW_WATER_MARK
+from .tcp_manager import (TcpManager, ConnectionState, DEFAULT_COMMAND_ACK_TIMEOUT_SECONDS,
+                          DEFAULT_HEARTBEAT_INTERVAL_SECONDS, DEFAULT_MAX_IN_FLIGHT_COMMANDS,
+                          DEFAULT_MAX_MISSED_PONGS, DEFAULT_WRITE_BUFFER_HIGH_WATER_MARK,
+                          DEFAULT_WRITE_BUFFER_LOW_WATER_MARK)
 from pycync.devices.controllable import CyncControllable
-from pycync.exceptions import NoHubConnectedError, CyncError
+from pycync.exceptions import NoHubConnectedError, CyncError, CommandTimeoutError
 from pycync.devices.capabilities import CyncCapability
 from pycync.devices import device_storage
 from pycync.user import User
 
 if TYPE_CHECKING:
     from pycync.devices import CyncDevice
-    from pycync.devices.groups import CyncHome
+    from pycync.devices.topology import TopologyChange
+
+
+DEFAULT_MIN_COMMAND_INTERVAL_SECONDS = 0.25
+DEFAULT_COMMAND_FUSION_WINDOW_SECONDS = 0.02
+# How long to let the remaining probe responses arrive after reconnecting, before querying device states again.
+_RESYNC_PROBE_SETTLE_SECONDS = 1
+# How many other hubs a command is retried through after the hub it was sent through doesn't acknowledge it.
+_MAX_HUB_FAILOVERS = 1
+
+
+class CommandKind(Enum):
+    """
+    The kinds of commands that can be sent to a controllable.
+    A newer command of the same kind for the same controllable supersedes an older one that hasn't been sent yet.
+    Controllables that support combo commands send all of their commands as the COMBO kind, so that every change to
+    them is sent in order.
+    """
+    POWER = "power"
+    BRIGHTNESS = "brightness"
+    COLOR = "color"
+    COMBO = "combo"
 
 
 class CommandClient:
     _LOGGER = logging.getLogger(__name__)
 
-    def __init__(self, user: User):
+    def __init__(self, user: User, min_command_interval: float = DEFAULT_MIN_COMMAND_INTERVAL_SECONDS,
+                 command_fusion_window: float = DEFAULT_COMMAND_FUSION_WINDOW_SECONDS,
+                 max_concurrent_callbacks: int = DEFAULT_MAX_CONCURRENT_CALLBACKS,
+                 callback_executor: Executor | None = None,
+                 max_in_flight_commands: int = DEFAULT_MAX_IN_FLIGHT_COMMANDS,
+                 command_ack_timeout: float = DEFAULT_COMMAND_ACK_TIMEOUT_SECONDS,
+                 heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL_SECONDS,
+                 max_missed_pongs: int = DEFAULT_MAX_MISSED_PONGS,
+                 write_buffer_high_water_mark: int = DEFAULT_WRITE_BUFFER_HIGH_WATER_MARK,
+                 write_buffer_low_water_mark: int = DEFAULT_WRITE_BUFFER_LOW_WATER_MARK,
+                 inbound_queue_high_water_mark: int = DEFAULT_INBOUND_QUEUE_HIGH_WATER_MARK,
+                 inbound_queue_low_water_mark: int = DEFAULT_INBOUND_QUEUE_LOW_WATER_MARK):
         self._user = user
 
-        self._device_statuses_updated = False
+        # Passed on to the TCP manager when the connection is started.
+        self._connection_options = {
+            "max_in_flight_commands": max_in_flight_commands,
+            "command_ack_timeout": command_ack_timeout,
+            "heartbeat_interval": heartbeat_interval,
+            "max_missed_pongs": max_missed_pongs,
+            "write_buffer_high_water_mark": write_buffer_high_water_mark,
+            "write_buffer_low_water_mark": write_buffer_low_water_mark,
+            "inbound_queue_high_water_mark": inbound_queue_high_water_mark,
+            "inbound_queue_low_water_mark": inbound_queue_low_water_mark,
+        }
+
         self._tcp_manager: TcpManager = None
 
+        self._min_command_interval = min_command_interval
+        self._outbound_slots: dict[tuple[str, CommandKind], _OutboundSlot] = {}
+        self._command_histories: dict[str, _CommandHistory] = {}
+
+        self._command_fusion_window = command_fusion_window
+        self._fusion_buffers: dict[str, _FusionBuffer] = {}
+
+        self._hub_pools: dict[int, HubPool] = {}
+
+        self._callback_dispatcher = CallbackDispatcher(max_concurrent_callbacks, callback_executor)
+
+        # Devices can only be probed once the account's topology has been loaded.
+        self._topology_ready = asyncio.Event()
+        self._probe_task: asyncio.Task | None = None
+
+        self._resync_needed = False
+        self._resync_task: asyncio.Task | None = None
+
     def start_connection(self, ssl_context: ssl.SSLContext = None, ssl_context_no_verify: ssl.SSLContext = None):
-        self._tcp_manager = TcpManager(self._user, self.on_message_received, ssl_context, ssl_context_no_verify)
+        self._tcp_manager = TcpManager(self._user, self.on_message_received, ssl_context, ssl_context_no_verify,
+                                       state_callback=self.on_connection_state_changed, **self._connection_options)
+
+    def mark_topology_ready(self):
+        """
+        Signals that the account's homes have been loaded.
+        The connection may log in before then, in which case the devices are probed as soon as this is called.
+        """
+        self._topology_ready.set()
+
+    @property
+    def connection_timings(self) -> dict[str, float]:
+        """How long each phase of the most recent connection took, in seconds."""
+        if self._tcp_manager is None:
+            return {}
+
+        return dict(self._tcp_manager.connection_timings)
 
     async def on_message_received(self, parsed_message: ParsedMessage):
         match parsed_message.message_type:
             case MessageType.LOGIN.value:
-                await self.probe_devices()
+                # Probe in the background, so packets keep being processed while the topology is still loading.
+                self._probe_task = asyncio.create_task(self._probe_when_topology_ready(), name="Probe Cync Devices")
             case MessageType.PROBE.value if parsed_message.version != 0:
-                devices_in_home = device_storage.get_associated_home_devices(self._user.user_id,
-                                                                             parsed_message.device_id)
-                device = next(device for device in devices_in_home if device.device_id == parsed_message.device_id)
+                device = device_storage.get_device_by_id(self._user.user_id, parsed_message.device_id)
                 device.set_wifi_connected(True)
-                self._device_statuses_updated = True
+                if CyncCapability.CAN_ACT_AS_WIFI_PROXY in device.capabilities:
+                    self._get_hub_pool(device.parent_home_id).add_hub(device)
             case MessageType.SYNC.value:
-                await self._send_update_to_listener(parsed_message.data)
+                self._update_hubs(parsed_message.data, parsed_message.changed_fields)
+                self._send_update_to_listener(parsed_message.data, parsed_message.changed_fields)
             case MessageType.PIPE.value:
                 if parsed_message.command_code == PipeCommandCode.QUERY_DEVICE_STATUS_PAGES.value:
-                    updated_devices: dict[str, CyncDevice] = parsed_message.data
-                    for device in device_storage.get_flattened_devices(self._user.user_id):
-                        device.is_online = device.unique_id in updated_devices
-                    await self._send_update_to_listener(parsed_message.data)
+                    # The parser has already marked the devices in the page's home that the page left out as offline.
+                    self._update_hubs(parsed_message.data, parsed_message.changed_fields)
+                    self._send_update_to_listener(parsed_message.data, parsed_message.changed_fields)
+
+    def on_topology_changed(self, topology_change: TopologyChange):
+        removed_entities = set(topology_change.removed)
+        for hub_pool in self._hub_pools.values():
+            for hub in hub_pool.hubs:
+                if hub.device in removed_entities:
+                    hub_pool.remove_hub(hub.device.device_id)
+
+        # Devices that were already loaded were probed after logging in, but newly added ones still need to be.
+        added_devices = topology_change.added_devices
+        if (self._tcp_manager is not None and len(added_devices) > 0 and
+                self._tcp_manager.connection_state >= ConnectionState.PROBED):
+            asyncio.create_task(self._tcp_manager.probe_devices(added_devices))
+
+    def on_connection_state_changed(self, connection_state: ConnectionState):
+        if connection_state == ConnectionState.RECONNECTING:
+            # Hubs are rediscovered by the probe sent after logging back in.
+            self._hub_pools.clear()
+            self._resync_needed = True
+        elif connection_state == ConnectionState.LOGGED_IN and self._resync_needed:
+            self._resync_needed = False
+            self._resync_task = asyncio.create_task(self._resync_device_states(), name="Resync Cync Devices")
 
     async def probe_devices(self):
         await self._tcp_manager.probe_devices(device_storage.get_flattened_devices(self._user.user_id))
 
+    async def _resync_device_states(self):
+        """
+        Queries every home's device states after reconnecting, since any state changes sent while disconnected were
+        missed. Homes without a hub that answered the probe are skipped.
+        """
+
+        await self._tcp_manager.wait_for_state(ConnectionState.PROBED)
+        await asyncio.sleep(_RESYNC_PROBE_SETTLE_SECONDS)
+
+        hub_devices: list[CyncDevice] = []
+        for home in device_storage.get_user_homes(self._user.user_id):
+            hub_device = self._get_hub_pool(home.home_id).select_hub()
+            if hub_device is not None:
+                hub_devices.append(hub_device)
+
+        await self._tcp_manager.update_mesh_devices(hub_devices)
+
+    async def _probe_when_topology_ready(self):
+        await self._topology_ready.wait()
+        await self.probe_devices()
+
     async def update_mesh_devices(self):
         """Get new device state."""
         homes_for_user = device_storage.get_user_homes(self._user.user_id)
 
         hub_devices: list[CyncDevice] = []
         for home in homes_for_user:
-            hub_device = await self._fetch_hub_device(home)
+            hub_device = await self._fetch_hub_device(home.home_id)
             hub_devices.append(hub_device)
 
         await self._tcp_manager.update_mesh_devices(hub_devices)
 
     async def set_power_state(self, controllable: CyncControllable, is_on: bool):
         """Set device(s) to either on or off."""
-        associated_home = device_storage.get_home_by_id(self._user.user_id, controllable.parent_home_id)
-        hub_device = await self._fetch_hub_device(associated_home)
-
-        await self._tcp_manager.set_power_state(hub_device, controllable.mesh_reference_id, controllable.mesh_group_id, is_on)
+        return await self._submit_fields(controllable, _CommandFields(is_on=is_on))
 
     async def set_brightness(self, controllable: CyncControllable, brightness: int):
         """Sets the brightness. Must be between 0 and 100 inclusive."""
         if brightness < 0 or brightness > 100:
             raise CyncError("Brightness must be between 0 and 100 inclusive")
 
-        associated_home = device_storage.get_home_by_id(self._user.user_id, controllable.parent_home_id)
-        hub_device = await self._fetch_hub_device(associated_home)
-
-        await self._tcp_manager.set_brightness(hub_device, controllable.mesh_reference_id, brightness)
+        return await self._submit_fields(controllable, _CommandFields(brightness=brightness))
 
     async def set_color_temp(self, controllable: CyncControllable, color_temp: int):
         """
@@ -94,20 +217,14 @@ class CommandClient:
         if color_temp < 1 or color_temp > 100:
             raise CyncError("Color temperature must be between 1 and 100 inclusive.")
 
-        associated_home = device_storage.get_home_by_id(self._user.user_id, controllable.parent_home_id)
-        hub_device = await self._fetch_hub_device(associated_home)
-
-        await self._tcp_manager.set_color_temp(hub_device, controllable.mesh_reference_id, color_temp)
+        return await self._submit_fields(controllable, _CommandFields(color_temp=color_temp))
 
     async def set_rgb(self, controllable: CyncControllable, rgb: tuple[int, int, int]):
         """Sets the RGB color. Each color must be between 0 and 255 inclusive."""
         if rgb[0] > 255 or rgb[1] > 255 or rgb[2] > 255:
             raise CyncError("Each RGB value must be between 0 and 255 inclusive")
 
-        associated_home = device_storage.get_home_by_id(self._user.user_id, controllable.parent_home_id)
-        hub_device = await self._fetch_hub_device(associated_home)
-
-        await self._tcp_manager.set_rgb(hub_device, controllable.mesh_reference_id, rgb)
+        return await self._submit_fields(controllable, _CommandFields(rgb=rgb))
 
     async def set_combo(self, controllable: CyncControllable, is_on: bool, brightness: int, color_temp: int | None = None, rgb: tuple[int, int, int] | None = None):
         if brightness < 0 or brightness > 100:
@@ -119,35 +236,441 @@ class CommandClient:
         if rgb is not None and (rgb[0] > 255 or rgb[1] > 255 or rgb[2] > 255):
             raise CyncError("Each RGB value must be between 0 and 255 inclusive")
 
-        associated_home = device_storage.get_home_by_id(self._user.user_id, controllable.parent_home_id)
-        hub_device = await self._fetch_hub_device(associated_home)
-
-        await self._tcp_manager.set_combo(hub_device, controllable.mesh_reference_id, is_on, brightness, color_temp, rgb)
+        return await self._submit_fields(controllable,
+                                         _CommandFields(is_on, brightness, color_temp, rgb, is_combo=True))
 
     async def shut_down(self):
+        self._cancel_pending_work()
         await self._tcp_manager.shut_down()
 
-    async def _send_update_to_listener(self, updated_data: dict[str, CyncDevice]):
+    def close(self):
+        """Drops the connection immediately, without logging out first."""
+        self._cancel_pending_work()
+        if self._tcp_manager is not None:
+            self._tcp_manager.close()
+
+    def _cancel_pending_work(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+        if self._resync_task is not None:
+            self._resync_task.cancel()
+        for fusion_buffer in self._fusion_buffers.values():
+            fusion_buffer.flush_handle.cancel()
+            fusion_buffer.result.cancel()
+        for outbound_slot in self._outbound_slots.values():
+            outbound_slot.sender_task.cancel()
+        self._callback_dispatcher.close()
+
+    async def _submit_fields(self, controllable: CyncControllable, command_fields: _CommandFields) -> asyncio.Future:
+        """
+        Submits the given datapoint changes for a controllable.
+        If the controllable supports combo commands, changes are buffered for a short window first, so changes made
+        in quick succession can be fused into a single COMBO_CONTROL command.
+        Raises NoHubConnectedError right away if the controllable's home has no hub to send the changes through.
+        """
+
+        await self._fetch_hub_device(controllable.parent_home_id)
+
+        if self._command_fusion_window <= 0 or not controllable.supports_capability(CyncCapability.COMBO):
+            return self._submit_command(controllable, command_fields)
+
+        fusion_buffer = self._fusion_buffers.get(controllable.unique_id)
+        if fusion_buffer is None:
+            loop = asyncio.get_running_loop()
+            fusion_result = loop.create_future()
+            fusion_result.add_done_callback(_mark_exception_retrieved)
+            flush_handle = loop.call_later(self._command_fusion_window, self._flush_fusion_buffer,
+                                           controllable.unique_id)
+
+            fusion_buffer = _FusionBuffer(controllable, fusion_result, flush_handle)
+            self._fusion_buffers[controllable.unique_id] = fusion_buffer
+
+        fusion_buffer.command_fields.update(command_fields)
+
+        return fusion_buffer.result
+
+    def _flush_fusion_buffer(self, unique_id: str):
+        fusion_buffer = self._fusion_buffers.pop(unique_id)
+        command_fields = fusion_buffer.command_fields
+
+        # A combo command always sets both the power state and brightness, so changes can only be fused when
+        # both of them were changed. Guessing either one from cached state could turn a light off or dim it.
+        if command_fields.is_on is not None and command_fields.brightness is not None:
+            command_fields.is_combo = True
+
+        command_result = self._submit_command(fusion_buffer.controllable, command_fields)
+        command_result.add_done_callback(lambda future: _copy_future_state(future, fusion_buffer.result))
+
+    def _submit_command(self, controllable: CyncControllable, command_fields: _CommandFields) -> asyncio.Future:
+        """
+        Queues datapoint changes in the controllable's outbound slot for their command kind.
+        Each slot holds at most one unsent command, so newer changes are merged into an unsent older command instead
+        of queueing behind it, replacing any values it set. Commands in a slot are sent once the previous one has been
+        acknowledged, or once the minimum command interval has passed.
+        Returns a future that resolves once the most recent command in the slot has been acknowledged.
+        """
+
+        slot_key = (controllable.unique_id, _get_command_kind(controllable, command_fields))
+        outbound_slot = self._outbound_slots.get(slot_key)
+        if outbound_slot is None:
+            command_history = self._command_histories.get(controllable.unique_id)
+            if command_history is None:
+                command_history = _CommandHistory()
+                self._command_histories[controllable.unique_id] = command_history
+
+            outbound_slot = _OutboundSlot(controllable, command_history)
+            self._outbound_slots[slot_key] = outbound_slot
+
+        if outbound_slot.pending_result is None:
+            outbound_slot.pending_result = asyncio.get_running_loop().create_future()
+            outbound_slot.pending_result.add_done_callback(_mark_exception_retrieved)
+        if outbound_slot.pending_fields is None:
+            outbound_slot.pending_fields = _CommandFields()
+        outbound_slot.pending_fields.update(command_fields)
+        outbound_slot.command_history.record_submitted(command_fields)
+
+        if outbound_slot.sender_task is None:
+            outbound_slot.sender_task = asyncio.create_task(self._send_outbound_slot(slot_key, outbound_slot))
+
+        return outbound_slot.pending_result
+
+    def _build_command(self, controllable: CyncControllable,
+                       command_fields: _CommandFields) -> Callable[[CyncDevice], Awaitable[asyncio.Future]]:
+        """
+        Builds the function that sends the given datapoint changes through a hub, and returns their ack future.
+        Changes that aren't a combo command are sent as one command per datapoint, which share a single ack future.
+        """
+
+        mesh_id = controllable.mesh_reference_id
+        mesh_group_id = controllable.mesh_group_id
+        is_on, brightness, color_temp, rgb = (command_fields.is_on, command_fields.brightness,
+                                              command_fields.color_temp, command_fields.rgb)
+
+        if command_fields.is_combo:
+            return lambda hub_device: self._tcp_manager.set_combo(hub_device, mesh_id, is_on, brightness, color_temp,
+                                                                  rgb)
+
+        send_commands: list[Callable[[CyncDevice], Awaitable[asyncio.Future]]] = []
+        if is_on is not None:
+            send_commands.append(lambda hub_device: (
+                self._tcp_manager.set_power_state(hub_device, mesh_id, mesh_group_id, is_on)))
+        if brightness is not None:
+            send_commands.append(lambda hub_device: self._tcp_manager.set_brightness(hub_device, mesh_id, brightness))
+        if color_temp is not None:
+            send_commands.append(lambda hub_device: self._tcp_manager.set_color_temp(hub_device, mesh_id, color_temp))
+        if rgb is not None:
+            send_commands.append(lambda hub_device: self._tcp_manager.set_rgb(hub_device, mesh_id, rgb))
+
+        if len(send_commands) == 1:
+            return send_commands[0]
+
+        async def send_all_commands(hub_device: CyncDevice) -> asyncio.Future:
+            ack_futures = [await send_command(hub_device) for send_command in send_commands]
+            return asyncio.gather(*ack_futures)
+
+        return send_all_commands
+
+    async def _send_outbound_slot(self, slot_key: tuple[str, CommandKind], outbound_slot: _OutboundSlot):
+        try:
+            while outbound_slot.pending_fields is not None:
+                command_fields, command_result = outbound_slot.pending_fields, outbound_slot.pending_result
+                outbound_slot.pending_fields = None
+                outbound_slot.pending_result = None
+
+                # Every change merged into this command was submitted at or before the latest generation.
+                generation = outbound_slot.command_history.generation
+                send_command = self._build_command(outbound_slot.controllable, command_fields)
+                home_id = outbound_slot.controllable.parent_home_id
+                try:
+                    hub_device, ack_future = await self._send_through_best_hub(home_id, send_command)
+                except Exception as ex:
+                    self._LOGGER.error("Failed to send {} command to {}: {!r}".format(slot_key[1].value, slot_key[0], ex))
+                    command_result.set_exception(ex)
+                    continue
+
+                ack_task = asyncio.create_task(self._await_ack_with_failover(
+                    slot_key, outbound_slot, command_fields, generation, hub_device, ack_future))
+                ack_task.add_done_callback(lambda task, result=command_result: _copy_future_state(task, result))
+                await asyncio.wait([ack_task], timeout=self._min_command_interval)
+        finally:
+            if self._outbound_slots.get(slot_key) is outbound_slot:
+                del self._outbound_slots[slot_key]
+            if outbound_slot.pending_result is not None and not outbound_slot.pending_result.done():
+                outbound_slot.pending_result.cancel()
+
+    async def _send_through_best_hub(self, home_id: int,
+                                     send_command: Callable[[CyncDevice], Awaitable[asyncio.Future]],
+                                     excluded_hub_ids: set[int] = frozenset()) -> tuple[CyncDevice, asyncio.Future]:
+        """Sends a command through the least loaded hub in the home. Returns the hub used, and the ack future."""
+
+        hub_device = await self._fetch_hub_device(home_id, excluded_hub_ids)
+        ack_future = await self._send_through_hub(home_id, hub_device, send_command)
+
+        return hub_device, ack_future
+
+    async def _await_ack_with_failover(self, slot_key: tuple[str, CommandKind], outbound_slot: _OutboundSlot,
+                                       command_fields: _CommandFields, generation: int, hub_device: CyncDevice,
+                                       ack_future: asyncio.Future):
+        """
+        Waits for a sent command to be acknowledged.
+        If the hub doesn't acknowledge the command in time, it is retried through a different hub if one is available.
+        Changes that have been submitted again since are not retried, since retrying them would
+        overwrite the newer values.
+        """
+
+        controllable = outbound_slot.controllable
+        home_id = controllable.parent_home_id
+        attempted_hub_ids = {hub_device.device_id}
+        while True:
+            try:
+                return await ack_future
+            except CommandTimeoutError:
+                retry_fields = outbound_slot.command_history.get_unsuperseded_fields(command_fields, generation)
+                if retry_fields is None:
+                    self._LOGGER.debug("{} command to {} was not acknowledged, but has been superseded".format(
+                        slot_key[1].value, slot_key[0]))
+                    raise
+
+                hub_pool = self._get_hub_pool(home_id)
+                if len(attempted_hub_ids) > _MAX_HUB_FAILOVERS or hub_pool.select_hub(attempted_hub_ids) is None:
+                    raise
+
+                self._LOGGER.warning("Hub {} did not acknowledge {} command to {}, retrying through another hub".format(
+                    hub_device.device_id, slot_key[1].value, slot_key[0]))
+                command_fields = retry_fields
+                send_command = self._build_command(controllable, command_fields)
+
+            try:
+                hub_device, ack_future = await self._send_through_best_hub(home_id, send_command, attempted_hub_ids)
+            except Exception as ex:
+                self._LOGGER.error("Failed to send {} command to {}: {!r}".format(slot_key[1].value, slot_key[0], ex))
+                raise
+            attempted_hub_ids.add(hub_device.device_id)
+
+    async def _send_through_hub(self, home_id: int, hub_device: CyncDevice,
+                                send_command: Callable[[CyncDevice], Awaitable[asyncio.Future]]) -> asyncio.Future:
+        """Sends a command through the given hub, recording its acknowledgement latency in the home's hub pool."""
+
+        hub_pool = self._get_hub_pool(home_id)
+        hub_pool.command_sent(hub_device.device_id)
+        sent_at = time.monotonic()
+
+        try:
+            ack_future = await send_command(hub_device)
+        except Exception:
+            hub_pool.command_finished(hub_device.device_id, None)
+            raise
+
+        def record_outcome(future: asyncio.Future):
+            if future.cancelled() or future.exception() is not None:
+                hub_pool.command_finished(hub_device.device_id, None)
+            else:
+                hub_pool.command_finished(hub_device.device_id, time.monotonic() - sent_at)
+
+        ack_future.add_done_callback(record_outcome)
+        return ack_future
+
+    def _update_hubs(self, updated_data: dict[str, CyncDevice], changed_fields: dict[str, frozenset[str]]):
+        """
+        Keeps the hub pools in step with the online state of the updated devices, leaving every other device alone.
+        Hubs that went offline are evicted from their home's pool. Devices that can act as hubs and came back online
+        are probed again, and added back once the probe response shows they are connected to Wi-Fi.
+        """
+
+        returning_hubs: list[CyncDevice] = []
+        for unique_id, device in updated_data.items():
+            hub_pool = self._hub_pools.get(device.parent_home_id)
+            is_in_hub_pool = hub_pool is not None and device.device_id in hub_pool
+
+            if not device.is_online and is_in_hub_pool:
+                self._LOGGER.debug("Hub {} went offline, no longer sending commands through it.".format(
+                    device.device_id))
+                hub_pool.remove_hub(device.device_id)
+            elif (device.is_online and not is_in_hub_pool and "is_online" in changed_fields.get(unique_id, ()) and
+                  CyncCapability.CAN_ACT_AS_WIFI_PROXY in device.capabilities):
+                returning_hubs.append(device)
+
+        if (len(returning_hubs) > 0 and self._tcp_manager is not None and
+                self._tcp_manager.connection_state >= ConnectionState.PROBED):
+            asyncio.create_task(self._tcp_manager.probe_devices(returning_hubs))
+
+    def _get_hub_pool(self, home_id: int) -> HubPool:
+        hub_pool = self._hub_pools.get(home_id)
+        if hub_pool is None:
+            hub_pool = HubPool(home_id)
+            self._hub_pools[home_id] = hub_pool
+
+        return hub_pool
+
+    def _send_update_to_listener(self, updated_data: dict[str, CyncDevice],
+                                 changed_fields: dict[str, frozenset[str]]):
+        """
+        Hands the update to the callback dispatcher, so packet processing doesn't wait on the callbacks.
+        The update callback gets every updated device, and each subscription gets only the devices it matches.
+        Inline subscriptions are also given the fields that changed on each device.
+        """
+
+        if len(updated_data) == 0:
+            return
+
         callback = device_storage.get_user_device_callback(self._user.user_id)
         if callback is not None:
-            if asyncio.iscoroutinefunction(callback):
-                await callback(updated_data)
+            self._callback_dispatcher.dispatch(callback, updated_data)
+
+        subscriptions = device_storage.get_user_subscriptions(self._user.user_id)
+        for subscription, subscription_data in subscriptions.route(updated_data):
+            if subscription.is_inline:
+                subscription.callback(subscription_data, changed_fields)
             else:
-                callback(updated_data)
+                self._callback_dispatcher.dispatch(subscription.callback, subscription_data)
 
-    async def _fetch_hub_device(self, home: CyncHome) -> CyncDevice:
+    async def _fetch_hub_device(self, home_id: int, excluded_device_ids: set[int] = frozenset()) -> CyncDevice:
         """
         Fetches an eligible 'hub device' from a given home.
         A hub device is a device that is actively connected to Wi-Fi, and can act as a proxy into the Bluetooth mesh.
+        When a home has several hubs, the least loaded one is picked.
         """
 
-        while not self._device_statuses_updated:
-            await asyncio.sleep(1)
-            self._LOGGER.debug("Awaiting probe initialization before fetching hub.")
+        await self._tcp_manager.wait_for_state(ConnectionState.PROBED)
 
-        hub_device = next((device for device in home.get_flattened_device_list() if
-                           device.wifi_connected and CyncCapability.CAN_ACT_AS_WIFI_PROXY in device.capabilities), None)
+        hub_device = self._get_hub_pool(home_id).select_hub(excluded_device_ids)
         if hub_device is None:
             raise NoHubConnectedError
 
         return hub_device
+
+
+class _CommandFields:
+    """A set of datapoint changes for a controllable. Fields left as None are not changed."""
+
+    def __init__(self, is_on: bool | None = None, brightness: int | None = None, color_temp: int | None = None,
+                 rgb: tuple[int, int, int] | None = None, is_combo: bool = False):
+        self.is_on = is_on
+        self.brightness = brightness
+        self.color_temp = color_temp
+        self.rgb = rgb
+        self.is_combo = is_combo
+
+    def update(self, other: _CommandFields):
+        """Applies newer changes on top of these ones. Color temperature and RGB replace each other."""
+
+        if other.is_on is not None:
+            self.is_on = other.is_on
+        if other.brightness is not None:
+            self.brightness = other.brightness
+        if other.color_temp is not None:
+            self.color_temp = other.color_temp
+            self.rgb = None
+        if other.rgb is not None:
+            self.rgb = other.rgb
+            self.color_temp = None
+        self.is_combo = self.is_combo or other.is_combo
+
+    @property
+    def field_names(self) -> frozenset[str]:
+        """The names of the fields that are changed. Color temperature and RGB are both the "color" field."""
+
+        field_names = set()
+        if self.is_on is not None:
+            field_names.add("is_on")
+        if self.brightness is not None:
+            field_names.add("brightness")
+        if self.color_temp is not None or self.rgb is not None:
+            field_names.add("color")
+
+        return frozenset(field_names)
+
+    def subset(self, field_names: frozenset[str]) -> _CommandFields:
+        """
+        Returns only the changes to the given fields.
+        A combo stays a combo only if it keeps both its power state and brightness.
+        """
+
+        is_on = self.is_on if "is_on" in field_names else None
+        brightness = self.brightness if "brightness" in field_names else None
+        color_temp, rgb = (self.color_temp, self.rgb) if "color" in field_names else (None, None)
+        is_combo = self.is_combo and is_on is not None and brightness is not None
+
+        return _CommandFields(is_on, brightness, color_temp, rgb, is_combo)
+
+
+class _FusionBuffer:
+    """Datapoint changes for one controllable that are waiting out the fusion window."""
+
+    def __init__(self, controllable: CyncControllable, result: asyncio.Future, flush_handle: asyncio.TimerHandle):
+        self.controllable = controllable
+        self.command_fields = _CommandFields()
+        self.result = result
+        self.flush_handle = flush_handle
+
+
+class _OutboundSlot:
+    """The latest unsent changes of one command kind for one controllable, and the task sending the slot's commands."""
+
+    def __init__(self, controllable: CyncControllable, command_history: _CommandHistory):
+        self.controllable = controllable
+        self.command_history = command_history
+        self.pending_fields: _CommandFields | None = None
+        self.pending_result: asyncio.Future | None = None
+        self.sender_task: asyncio.Task | None = None
+
+
+class _CommandHistory:
+    """
+    Which submission last changed each field of one controllable.
+    Kept for as long as the command client exists, since a command's ack can time out long after the slot that sent
+    it has been removed, and a newer slot for the controllable may have changed the same fields since.
+    """
+
+    def __init__(self):
+        # Counts the changes submitted for the controllable.
+        self.generation = 0
+        # The generation of the most recent submission that changed each field.
+        self._field_generations: dict[str, int] = {}
+
+    def record_submitted(self, command_fields: _CommandFields):
+        self.generation += 1
+        for field_name in command_fields.field_names:
+            self._field_generations[field_name] = self.generation
+
+    def get_unsuperseded_fields(self, command_fields: _CommandFields, generation: int) -> _CommandFields | None:
+        """
+        Returns the changes from a command sent at the given generation that no newer submission has changed again,
+        or None if every one of them has been superseded.
+        """
+
+        field_names = frozenset(field_name for field_name in command_fields.field_names
+                                if self._field_generations.get(field_name, 0) <= generation)
+        if len(field_names) == 0:
+            return None
+
+        return command_fields.subset(field_names)
+
+
+def _get_command_kind(controllable: CyncControllable, command_fields: _CommandFields) -> CommandKind:
+    if command_fields.is_combo or controllable.supports_capability(CyncCapability.COMBO):
+        return CommandKind.COMBO
+    if command_fields.is_on is not None:
+        return CommandKind.POWER
+    if command_fields.brightness is not None:
+        return CommandKind.BRIGHTNESS
+
+    return CommandKind.COLOR
+
+
+def _copy_future_state(source: asyncio.Future, destination: asyncio.Future):
+    if destination.done():
+        return
+
+    if source.cancelled():
+        destination.cancel()
+    elif source.exception() is not None:
+        destination.set_exception(source.exception())
+    else:
+        destination.set_result(None)
+
+
+def _mark_exception_retrieved(future: asyncio.Future):
+    # Callers aren't required to await command results, so don't log failures as unretrieved.
+    if not future.cancelled():
+        future.exception()
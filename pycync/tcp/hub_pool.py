@@ -0,0 +1,114 @@
+"""
+Tracks the hub devices available in each home, and spreads outbound commands across them.
+A hub device is a device that is actively connected to Wi-Fi, and can act as a proxy into the Bluetooth mesh.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pycync.devices import CyncDevice
+
+# Latency assumed for hubs that haven't acknowledged a command yet.
+_DEFAULT_ACK_LATENCY_SECONDS = 0.1
+# Weight given to the newest sample in the latency and error rate moving averages.
+_SMOOTHING_FACTOR = 0.2
+# Hubs that fail this many commands in a row are only used when no other hub is available.
+_UNHEALTHY_FAILURE_COUNT = 3
+
+
+class HubStats:
+    """Load and health statistics for a single hub device."""
+
+    def __init__(self, device: CyncDevice):
+        self.device = device
+        self.in_flight = 0
+        self.ack_latency = _DEFAULT_ACK_LATENCY_SECONDS
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+
+    @property
+    def is_healthy(self) -> bool:
+        return self.consecutive_failures < _UNHEALTHY_FAILURE_COUNT
+
+    @property
+    def load_score(self) -> float:
+        """Estimated cost of sending one more command through this hub. Lower is better."""
+        return (self.in_flight + 1) * self.ack_latency * (1 + 4 * self.error_rate)
+
+    def record_success(self, ack_latency: float):
+        self.ack_latency += _SMOOTHING_FACTOR * (ack_latency - self.ack_latency)
+        self.error_rate -= _SMOOTHING_FACTOR * self.error_rate
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.error_rate += _SMOOTHING_FACTOR * (1 - self.error_rate)
+        self.consecutive_failures += 1
+
+
+class HubPool:
+    """
+    All known hub devices for a single home.
+    Commands are sent through the least loaded healthy hub, rotating between hubs with equal load.
+    """
+
+    def __init__(self, home_id: int):
+        self.home_id = home_id
+        self._hubs: dict[int, HubStats] = {}
+        self._rotation = 0
+
+    def __len__(self):
+        return len(self._hubs)
+
+    def __contains__(self, device_id: int):
+        return device_id in self._hubs
+
+    @property
+    def hubs(self) -> list[HubStats]:
+        return list(self._hubs.values())
+
+    def add_hub(self, device: CyncDevice):
+        if device.device_id not in self._hubs:
+            self._hubs[device.device_id] = HubStats(device)
+
+    def remove_hub(self, device_id: int):
+        self._hubs.pop(device_id, None)
+
+    def select_hub(self, excluded_device_ids: set[int] = frozenset()) -> CyncDevice | None:
+        """
+        Picks the hub to send the next command through, or None if no hubs are available.
+        Unhealthy hubs are only picked if every other hub is excluded.
+        """
+
+        candidates = [hub for hub in self._hubs.values() if hub.device.device_id not in excluded_device_ids]
+        if len(candidates) == 0:
+            return None
+
+        healthy_candidates = [hub for hub in candidates if hub.is_healthy]
+        if len(healthy_candidates) > 0:
+            candidates = healthy_candidates
+
+        # Start the search at a rotating offset, so hubs with equal load take turns.
+        self._rotation = (self._rotation + 1) % len(candidates)
+        rotated_candidates = candidates[self._rotation:] + candidates[:self._rotation]
+
+        return min(rotated_candidates, key=lambda hub: hub.load_score).device
+
+    def command_sent(self, device_id: int):
+        hub = self._hubs.get(device_id)
+        if hub is not None:
+            hub.in_flight += 1
+
+    def command_finished(self, device_id: int, ack_latency: float | None):
+        """Records the outcome of a command sent through a hub. A latency of None means the command failed."""
+
+        hub = self._hubs.get(device_id)
+        if hub is None:
+            return
+
+        hub.in_flight = max(hub.in_flight - 1, 0)
+        if ack_latency is None:
+            hub.record_failure()
+        else:
+            hub.record_success(ack_latency)
@@ -3,23 +3,30 @@ Provides various definitions pertaining to a Cync TCP packet and its parsed vers
 """
 
 from enum import Enum
-from functools import reduce
 
 
 class ParsedMessage:
-    def __init__(self, message_type, is_response: bool, device_id, data, version, command_code=None):
+    def __init__(self, message_type, is_response: bool, device_id, data, version, command_code=None,
+                 packet_counter=None, inner_sequence=None, changed_fields=None):
         self.message_type = message_type
         self.command_code = command_code
         self.is_response = is_response
         self.version = version
         self.device_id = device_id
         self.data = data
+        self.packet_counter = packet_counter
+        self.inner_sequence = inner_sequence
+        # For device state updates, the names of the fields that changed, keyed by device unique ID.
+        self.changed_fields: dict[str, frozenset[str]] = changed_fields if changed_fields is not None else {}
 
 
 class ParsedInnerFrame:
-    def __init__(self, command_type, data):
+    def __init__(self, command_type, data, sequence=None, pipe_direction=None, changed_fields=None):
         self.command_type = command_type
         self.data = data
+        self.sequence = sequence
+        self.pipe_direction = pipe_direction
+        self.changed_fields = changed_fields
 
 
 class MessageType(Enum):
@@ -52,5 +59,5 @@ def generate_zero_bytes(length: int):
     return bytearray([0 for _ in range(length)])
 
 
-def generate_checksum(byte_array: bytearray) -> int:
-    return reduce(lambda acc, byte: (acc + byte) % 256, byte_array)
+def generate_checksum(byte_array: bytes | bytearray | memoryview) -> int:
+    return sum(byte_array) % 256
@@ -7,18 +7,63 @@ import struct
 
 from ..devices import device_storage
 from ..devices.device_types import DeviceType
-from .packet import ParsedMessage, ParsedInnerFrame, MessageType, PipeCommandCode, generate_checksum
+from .packet import ParsedMessage, ParsedInnerFrame, MessageType, PipeCommandCode, PipeDirection, generate_checksum
 from pycync.devices.capabilities import DEVICE_CAPABILITIES, CyncCapability
 
 if TYPE_CHECKING:
     from pycync.devices import CyncDevice
 
 
-def parse_packet(packet: bytearray, user_id: int) -> ParsedMessage:
-    packet_type = (packet[0] & 0xF0) >> 4
-    is_response = bool((packet[0] & 0x08) >> 3)
-    version = packet[0] & 0x7
-    packet_length = struct.unpack(">I", packet[1:5])[0]
+_HEADER_STRUCT = struct.Struct(">BI")
+_DEVICE_ID_STRUCT = struct.Struct(">I")
+_PACKET_COUNTER_STRUCT = struct.Struct(">H")
+_INNER_SEQUENCE_STRUCT = struct.Struct("<I")
+_SYNC_INFO_LENGTH_STRUCT = struct.Struct(">H")
+_INNER_COMMAND_STRUCT = struct.Struct("<BH")
+_STATUS_PAGE_COUNT_STRUCT = struct.Struct("<H")
+# Mesh ID, online flag, on/off, brightness, color mode, R, G, B. Each device status record is 24 bytes long.
+_DEVICE_STATUS_STRUCT = struct.Struct("<HxB4xB3xB3xB3xBBBx")
+
+_SYNC_STATUS_MARKER = b"\x01\x01\x06"
+_PIPE_ACK_LENGTH = 7
+_CONTROL_COMMAND_CODES = frozenset({
+    PipeCommandCode.SET_POWER_STATE.value,
+    PipeCommandCode.SET_BRIGHTNESS.value,
+    PipeCommandCode.SET_COLOR.value,
+    PipeCommandCode.COMBO_CONTROL.value
+})
+
+
+def parse_packet(packet: bytes | bytearray | memoryview, user_id: int) -> ParsedMessage:
+    """
+    Parses a single, complete packet.
+    The packet may be a memoryview into a larger receive buffer, so no parsed field may keep a reference to it.
+    """
+    with memoryview(packet) as packet_view:
+        return _parse_packet_view(packet_view, user_id)
+
+
+def parse_request_identifiers(request_packet: bytes | bytearray) -> tuple[int, int | None]:
+    """
+    Reads the identifiers of an outbound PIPE request, so responses to it can be matched up.
+    Returns the outer packet counter, and the inner frame's sequence number if the request has an inner frame.
+    """
+    with memoryview(request_packet) as packet_view:
+        packet_counter = _PACKET_COUNTER_STRUCT.unpack_from(packet_view, 9)[0]
+
+        inner_sequence = None
+        if len(packet_view) > 17 and packet_view[12] == 0x7e:
+            inner_frame = _decode_7e_usages(packet_view[13:-1])
+            inner_sequence = _INNER_SEQUENCE_STRUCT.unpack_from(inner_frame)[0]
+
+    return packet_counter, inner_sequence
+
+
+def _parse_packet_view(packet: memoryview, user_id: int) -> ParsedMessage:
+    info_byte, packet_length = _HEADER_STRUCT.unpack_from(packet)
+    packet_type = (info_byte & 0xF0) >> 4
+    is_response = bool((info_byte & 0x08) >> 3)
+    version = info_byte & 0x7
     packet = packet[5:]
 
     if len(packet) != packet_length:
@@ -37,144 +82,197 @@ def parse_packet(packet: bytearray, user_id: int) -> ParsedMessage:
             return _parse_pipe_packet(packet, packet_length, is_response, version, user_id)
         case MessageType.DISCONNECT.value:
             return ParsedMessage(MessageType.DISCONNECT.value, is_response, user_id, packet[0], version)
+        case MessageType.PING.value:
+            return ParsedMessage(MessageType.PING.value, is_response, None, None, version)
         case _:
             raise NotImplementedError
 
 
-def _parse_probe_packet(packet: bytearray, is_response, version) -> ParsedMessage:
-    device_id = struct.unpack(">I", packet[0:4])[0]
-    data = packet[4:]
+def _parse_probe_packet(packet: memoryview, is_response, version) -> ParsedMessage:
+    device_id = _DEVICE_ID_STRUCT.unpack_from(packet)[0]
+    data = packet[4:].tobytes()
 
     return ParsedMessage(MessageType.PROBE.value, is_response, device_id, data, version)
 
 
-def _parse_sync_packet(packet: bytearray, is_response, version, user_id) -> ParsedMessage:
-    device_id = struct.unpack(">I", packet[0:4])[0]
-    device_list = device_storage.get_associated_home_devices(user_id, device_id)
-    device_type = next(device.device_type_id for device in device_list if device.device_id == device_id)
+def _parse_sync_packet(packet: memoryview, is_response, version, user_id) -> ParsedMessage:
+    device_id = _DEVICE_ID_STRUCT.unpack_from(packet)[0]
+    mesh_devices = device_storage.get_associated_home_mesh_devices(user_id, device_id)
+    device_type = device_storage.get_device_by_id(user_id, device_id).device_type_id
     is_mesh_device = CyncCapability.NO_MESH not in DEVICE_CAPABILITIES[device_type]
 
     updated_device_data = {}
-
-    if packet[4:7].hex() == '010106' and is_mesh_device:
-        packet = packet[7:]
-        while len(packet) > 3:
-            info_length = struct.unpack(">H", packet[1:3])[0] & 0x0FFF
-            packet = packet[3:info_length + 3]
-            mesh_id = packet[0]
-
-            resolved_devices: list[CyncDevice] = [device for device in device_list if device.isolated_mesh_id == mesh_id]
-            if len(resolved_devices) == 0:
+    changed_fields = {}
+
+    if packet[4:7] == _SYNC_STATUS_MARKER and is_mesh_device:
+        offset = 7
+        packet_end = len(packet)
+        while packet_end - offset > 3:
+            info_length = _SYNC_INFO_LENGTH_STRUCT.unpack_from(packet, offset + 1)[0] & 0x0FFF
+            offset += 3
+            mesh_id = packet[offset]
+
+            resolved_devices: list[CyncDevice] = mesh_devices.get(mesh_id)
+            if not resolved_devices:
                 raise ValueError("Unable to resolve device ID for mesh ID: {}".format(mesh_id))
             if DeviceType.is_light(resolved_devices[0].device_type_id):
+                is_on = bool(packet[offset + 1])
+                brightness = packet[offset + 2]
+                color_mode = packet[offset + 3]
+                rgb = (packet[offset + 4], packet[offset + 5], packet[offset + 6])
                 for device in resolved_devices:
-                    device.update_state(bool(packet[1]), packet[2], packet[3], (packet[4], packet[5], packet[6]))
-                    updated_device_data[device.unique_id] = device
+                    _record_changes(device, device.update_state(is_on, brightness, color_mode, rgb),
+                                    updated_device_data, changed_fields)
             elif DeviceType.is_plug(resolved_devices[0].device_type_id):
                 for device in resolved_devices:
                     if device.mesh_group_id > 0:
-                        is_on = device.mesh_group_id == packet[2] or packet[2] == 3
+                        is_on = device.mesh_group_id == packet[offset + 2] or packet[offset + 2] == 3
                     else:
-                        is_on = bool(packet[1])
+                        is_on = bool(packet[offset + 1])
 
-                    device.update_state(is_on)
-                    updated_device_data[device.unique_id] = device
+                    _record_changes(device, device.update_state(is_on), updated_device_data, changed_fields)
 
-            packet = packet[info_length + 1:]
+            offset += info_length
 
-        return ParsedMessage(MessageType.SYNC.value, is_response, device_id, updated_device_data, version)
+        return ParsedMessage(MessageType.SYNC.value, is_response, device_id, updated_device_data, version,
+                             changed_fields=changed_fields)
 
     else:
         raise NotImplementedError
 
 
-def _parse_pipe_packet(packet: bytearray, length, is_response, version, user_id) -> ParsedMessage:
-    device_id = struct.unpack(">I", packet[0:4])[0]
-    device_list = device_storage.get_associated_home_devices(user_id, device_id)
+def _parse_pipe_packet(packet: memoryview, length, is_response, version, user_id) -> ParsedMessage:
+    device_id = _DEVICE_ID_STRUCT.unpack_from(packet)[0]
+    packet_counter = _PACKET_COUNTER_STRUCT.unpack_from(packet, 4)[0]
+
+    if is_response and length == _PIPE_ACK_LENGTH:
+        # The server acknowledges each PIPE request it receives by echoing back the request's device ID and counter.
+        return ParsedMessage(MessageType.PIPE.value, is_response, device_id, None, version,
+                             packet_counter=packet_counter)
+
+    mesh_devices = device_storage.get_associated_home_mesh_devices(user_id, device_id)
 
     if length > 7 and packet[7] == 0x7e:
-        inner_frame = _parse_inner_packet_frame(packet[7:], device_list)
+        inner_frame = _parse_inner_packet_frame(packet[7:], mesh_devices)
     else:
         raise NotImplementedError
 
     return ParsedMessage(MessageType.PIPE.value, is_response, device_id, inner_frame.data, version,
-                         inner_frame.command_type)
+                         inner_frame.command_type, packet_counter, inner_frame.sequence, inner_frame.changed_fields)
 
 
-def _parse_inner_packet_frame(frame_bytes: bytearray, device_list) -> ParsedInnerFrame:
+def _parse_inner_packet_frame(frame_bytes: memoryview, mesh_devices: dict[int, list[CyncDevice]]) -> ParsedInnerFrame:
     if frame_bytes[0] != 0x7e or frame_bytes[-1] != 0x7e:
         raise ValueError("Invalid delimiters for inner packet frame")
 
-    frame_bytes = frame_bytes[1:-1]  # Trim off delimiters
-    frame_bytes = _decode_7e_usages(frame_bytes)
+    frame_bytes = _decode_7e_usages(frame_bytes[1:-1])  # Trim off delimiters
 
-    frame_bytes = frame_bytes[4:]  # Trim off sequence number, we don't need it
-
-    command_code = frame_bytes[1]
-    data_length = struct.unpack("<H", frame_bytes[2:4])[0]
+    sequence = _INNER_SEQUENCE_STRUCT.unpack_from(frame_bytes)[0]
+    pipe_direction = frame_bytes[4]
+    command_code, data_length = _INNER_COMMAND_STRUCT.unpack_from(frame_bytes, 5)
 
     frame_checksum = frame_bytes[-1]
-    if not _does_checksum_match(frame_bytes[1:-1], frame_checksum):
+    if not _does_checksum_match(frame_bytes[5:-1], frame_checksum):
         raise ValueError("Invalid checksum for inner packet frame")
 
+    changed_fields = None
     match command_code:
         case PipeCommandCode.QUERY_DEVICE_STATUS_PAGES.value:
-            parsed_data = _parse_device_status_pages_command(frame_bytes[4: 4 + data_length], device_list)
+            parsed_data, changed_fields = _parse_device_status_pages_command(frame_bytes[8: 8 + data_length],
+                                                                             mesh_devices)
+        case code if code in _CONTROL_COMMAND_CODES and pipe_direction == PipeDirection.RESPONSE.value:
+            # A response from the mesh to one of our control commands. Only its sequence number is of interest.
+            parsed_data = None
         case _:
             raise NotImplementedError
 
-    return ParsedInnerFrame(command_code, parsed_data)
+    return ParsedInnerFrame(command_code, parsed_data, sequence, pipe_direction, changed_fields)
 
 
-def _parse_device_status_pages_command(data_bytes: bytearray, device_list) -> dict[int, CyncDevice]:
+def _parse_device_status_pages_command(
+        data_bytes: memoryview,
+        mesh_devices: dict[int, list[CyncDevice]]) -> tuple[dict[str, CyncDevice], dict[str, frozenset[str]]]:
+    """
+    Applies a status page to the home's devices, and returns the devices whose state changed along with their
+    changed fields.
+    The status page lists every device in the home that is online, so the home's devices that it doesn't list are
+    marked offline.
+    """
     updated_device_data = {}
+    changed_fields = {}
+    reported_unique_ids = set()
     if len(data_bytes) < 5:
-        return updated_device_data
-
-    device_count = struct.unpack("<H", data_bytes[4:6])[0]
-    trimmed_bytes = data_bytes[6:]
-
-    for i in range(device_count):
-        device_data = trimmed_bytes[0:24]
-        mesh_id = struct.unpack("<H", device_data[0:2])[0]
-
-        resolved_devices: list[CyncDevice] = [device for device in device_list if device.isolated_mesh_id == mesh_id]
-        if len(resolved_devices) == 0:
+        _mark_unreported_devices_offline(mesh_devices, reported_unique_ids, updated_device_data, changed_fields)
+        return updated_device_data, changed_fields
+
+    device_count = _STATUS_PAGE_COUNT_STRUCT.unpack_from(data_bytes, 4)[0]
+    records_end = 6 + device_count * _DEVICE_STATUS_STRUCT.size
+    if records_end > len(data_bytes):
+        raise ValueError("Device status page is shorter than its device count. Expected: {}, got: {}".format(
+            records_end, len(data_bytes)))
+
+    for mesh_id, is_online, is_on, brightness, color_mode, red, green, blue in _DEVICE_STATUS_STRUCT.iter_unpack(
+            data_bytes[6:records_end]):
+        resolved_devices: list[CyncDevice] = mesh_devices.get(mesh_id)
+        if not resolved_devices:
             raise ValueError("Unable to resolve device ID for mesh ID: {}".format(mesh_id))
 
         if DeviceType.is_light(resolved_devices[0].device_type_id):
-            is_online = device_data[3]
-            is_on = device_data[8]
-            brightness = device_data[12]
-            color_mode = device_data[16]
-            rgb = (device_data[20], device_data[21], device_data[22])
+            rgb = (red, green, blue)
             for device in resolved_devices:
-                device.update_state(bool(is_on), brightness, color_mode, rgb, bool(is_online))
-                updated_device_data[device.unique_id] = device
+                reported_unique_ids.add(device.unique_id)
+                device_changed_fields = device.update_state(bool(is_on), brightness, color_mode, rgb, bool(is_online))
+                _record_changes(device, device_changed_fields, updated_device_data, changed_fields)
         elif DeviceType.is_plug(resolved_devices[0].device_type_id):
-            is_online = device_data[3]
             for device in resolved_devices:
-                is_on = bool(device_data[8])
+                device_is_on = bool(is_on)
                 if device.mesh_group_id > 0:
-                    is_on = is_on and (device.mesh_group_id == device_data[12] or device_data[12] == 3)
+                    # For multi-outlet plugs, the brightness byte indicates which outlet(s) are on
+                    device_is_on = device_is_on and (device.mesh_group_id == brightness or brightness == 3)
 
-                device.update_state(is_on, bool(is_online))
-                updated_device_data[device.unique_id] = device
+                reported_unique_ids.add(device.unique_id)
+                _record_changes(device, device.update_state(device_is_on, bool(is_online)), updated_device_data,
+                                changed_fields)
 
-        trimmed_bytes = trimmed_bytes[24:]
+    _mark_unreported_devices_offline(mesh_devices, reported_unique_ids, updated_device_data, changed_fields)
 
-    return updated_device_data
+    return updated_device_data, changed_fields
 
 
-def _decode_7e_usages(frame_bytes: bytearray) -> bytearray:
+def _mark_unreported_devices_offline(mesh_devices: dict[int, list[CyncDevice]], reported_unique_ids: set[str],
+                                     updated_device_data: dict[str, CyncDevice],
+                                     changed_fields: dict[str, frozenset[str]]):
+    for devices in mesh_devices.values():
+        for device in devices:
+            if device.is_online and device.unique_id not in reported_unique_ids:
+                device.is_online = False
+                _record_changes(device, frozenset({"is_online"}), updated_device_data, changed_fields)
+
+
+def _record_changes(device: CyncDevice, device_changed_fields: frozenset[str],
+                    updated_device_data: dict[str, CyncDevice], changed_fields: dict[str, frozenset[str]]):
+    """Adds a device to an update if any of its fields changed. A device updated twice keeps both sets of changes."""
+
+    if len(device_changed_fields) == 0:
+        return
+
+    updated_device_data[device.unique_id] = device
+    changed_fields[device.unique_id] = changed_fields.get(device.unique_id, frozenset()) | device_changed_fields
+
+
+def _decode_7e_usages(frame_bytes: memoryview) -> memoryview:
     """
     When sending inner frames, the byte 0x7e is encoded as 0x7d5e if it's within the inner frame,
     so it isn't mistaken for a frame boundary marker.
     We need to undo that when reading it.
+    Most frames contain no encoded bytes, in which case the original view is returned without copying.
     """
-    return frame_bytes.replace(b"\x7d\x5e", b"\x7e")
+    if 0x7d not in frame_bytes:
+        return frame_bytes
+
+    return memoryview(frame_bytes.tobytes().replace(b"\x7d\x5e", b"\x7e"))
 
 
-def _does_checksum_match(data_bytes: bytearray, expected_checksum: int) -> bool:
+def _does_checksum_match(data_bytes: memoryview, expected_checksum: int) -> bool:
     checksum_result = generate_checksum(data_bytes)
     return checksum_result == expected_checksum
@@ -0,0 +1,134 @@
+"""
+Holds parsed packets between the TCP protocol, which reads them off the socket, and the task that processes them.
+The queue is bounded by pausing the socket, and device state updates that are already waiting are merged together.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from asyncio import QueueShutDown
+from collections import deque
+
+from .packet import MessageType, ParsedMessage
+
+# Once this many packets are waiting, reading from the socket pauses until the queue drains to the low water mark.
+DEFAULT_INBOUND_QUEUE_HIGH_WATER_MARK = 256
+DEFAULT_INBOUND_QUEUE_LOW_WATER_MARK = 64
+
+
+class InboundPacketQueue:
+    """
+    A queue of parsed packets, with the subset of the asyncio.Queue interface that the TCP manager uses.
+
+    Parsing a SYNC packet already applies its states to the device objects, so a device that is waiting in an
+    earlier SYNC packet will be delivered with its newest state regardless. Such devices are dropped from newer
+    SYNC packets, with their changed fields merged into the earlier packet, and a SYNC packet left with no devices
+    isn't queued at all.
+    Every other packet is queued as is, in the order it arrived.
+    """
+
+    _LOGGER = logging.getLogger(__name__)
+
+    def __init__(self, high_water_mark: int = DEFAULT_INBOUND_QUEUE_HIGH_WATER_MARK,
+                 low_water_mark: int = DEFAULT_INBOUND_QUEUE_LOW_WATER_MARK):
+        self._high_water_mark = high_water_mark
+        self._low_water_mark = low_water_mark
+
+        self._packets = deque()
+        # The queued SYNC packet that holds each device's update.
+        self._pending_sync_packets: dict[str, ParsedMessage] = {}
+        self._packet_available = asyncio.Event()
+        self._is_shut_down = False
+
+        self._transport: asyncio.ReadTransport | None = None
+        self._is_reading_paused = False
+
+    def __len__(self):
+        return len(self._packets)
+
+    def set_transport(self, transport: asyncio.ReadTransport):
+        """Sets the transport to pause while the queue is full."""
+
+        self._transport = transport
+        self._is_reading_paused = False
+
+    def empty(self) -> bool:
+        return len(self._packets) == 0
+
+    def put_nowait(self, packet: ParsedMessage | str):
+        if self._is_shut_down:
+            raise QueueShutDown
+
+        if _is_sync_packet(packet):
+            self._merge_pending_devices(packet)
+            if len(packet.data) == 0:
+                return
+
+            self._pending_sync_packets.update(dict.fromkeys(packet.data, packet))
+
+        self._packets.append(packet)
+        self._packet_available.set()
+
+        if not self._is_reading_paused and len(self._packets) >= self._high_water_mark and self._transport is not None:
+            self._LOGGER.debug("{} packets waiting to be processed, pausing reads.".format(len(self._packets)))
+            self._is_reading_paused = True
+            self._transport.pause_reading()
+
+    def get_nowait(self) -> ParsedMessage | str:
+        if len(self._packets) == 0:
+            if self._is_shut_down:
+                raise QueueShutDown
+            raise asyncio.QueueEmpty
+
+        packet = self._packets.popleft()
+        if _is_sync_packet(packet):
+            for unique_id in packet.data:
+                del self._pending_sync_packets[unique_id]
+
+        if self._is_reading_paused and len(self._packets) <= self._low_water_mark:
+            self._LOGGER.debug("Packet queue drained, resuming reads.")
+            self._is_reading_paused = False
+            self._transport.resume_reading()
+
+        return packet
+
+    async def get(self) -> ParsedMessage | str:
+        """
+        Removes and returns the next packet, waiting for one if the queue is empty.
+        Once the queue has been shut down and emptied, raises QueueShutDown.
+        """
+
+        while len(self._packets) == 0 and not self._is_shut_down:
+            self._packet_available.clear()
+            await self._packet_available.wait()
+
+        return self.get_nowait()
+
+    def shutdown(self):
+        """Stops the queue from accepting packets. Packets already queued can still be taken."""
+
+        self._is_shut_down = True
+        self._packet_available.set()
+
+    def _merge_pending_devices(self, sync_packet: ParsedMessage):
+        """Moves the devices that already have a queued update out of the given SYNC packet, into that update."""
+
+        pending_packets = self._pending_sync_packets
+        new_device_data = {}
+        for unique_id, device in sync_packet.data.items():
+            pending_packet = pending_packets.get(unique_id)
+            if pending_packet is None:
+                new_device_data[unique_id] = device
+                continue
+
+            changed_fields = sync_packet.changed_fields.get(unique_id)
+            if changed_fields:
+                pending_changed_fields = pending_packet.changed_fields.get(unique_id, frozenset())
+                pending_packet.changed_fields[unique_id] = pending_changed_fields | changed_fields
+
+        sync_packet.data = new_device_data
+
+
+def _is_sync_packet(packet: ParsedMessage | str) -> bool:
+    return isinstance(packet, ParsedMessage) and packet.message_type == MessageType.SYNC.value
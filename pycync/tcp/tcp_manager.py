@@ -5,18 +5,24 @@ packets associated with device events.
 
 from __future__ import annotations
 
-from asyncio import CancelledError, QueueShutDown
+from asyncio import QueueShutDown
 from typing import TYPE_CHECKING
 
 import asyncio
 import logging
+import random
 import ssl
 import struct
+import time
+from enum import IntEnum
 from typing import Callable
 
 from pycync import User
+from pycync.exceptions import CommandTimeoutError, CyncError
 from . import packet_builder, packet_parser
-from .packet import MessageType
+from .packet import MessageType, ParsedMessage, PipeCommandCode
+from .packet_queue import (InboundPacketQueue, DEFAULT_INBOUND_QUEUE_HIGH_WATER_MARK,
+                           DEFAULT_INBOUND_QUEUE_LOW_WATER_MARK)
 
 if TYPE_CHECKING:
     from pycync.devices import CyncDevice
@@ -24,70 +30,220 @@ if TYPE_CHECKING:
 TCP_API_HOSTNAME = "cm-sec.gelighting.com"
 TCP_API_TLS_PORT = 23779
 _CONNECTION_LOST_STRING = "CyncConnectionLost"
+_PACKET_LENGTH_STRUCT = struct.Struct(">I")
+
+DEFAULT_MAX_IN_FLIGHT_COMMANDS = 8
+# Bounds for the delay between failed connection attempts.
+_RECONNECT_BASE_DELAY_SECONDS = 1
+_RECONNECT_MAX_DELAY_SECONDS = 60
+# The server disconnects us when another client, like the Cync app, logs in to the same account.
+# Reconnecting right away would just kick that client off in turn, so give it some time first.
+_SERVER_DISCONNECT_RECONNECT_DELAY_SECONDS = 10
+DEFAULT_COMMAND_ACK_TIMEOUT_SECONDS = 5
+# A ping is sent once nothing has been received for this long.
+DEFAULT_HEARTBEAT_INTERVAL_SECONDS = 20
+# After this many pings in a row go unanswered, the connection is considered dead.
+DEFAULT_MAX_MISSED_PONGS = 3
+_PING_REQUEST = bytes.fromhex('d300000000')
+# Once this many bytes are waiting to be sent, senders wait until the buffer drains below the low water mark.
+DEFAULT_WRITE_BUFFER_HIGH_WATER_MARK = 64 * 1024
+DEFAULT_WRITE_BUFFER_LOW_WATER_MARK = 16 * 1024
+
+class ConnectionState(IntEnum):
+    """
+    The states of the connection to the Cync server.
+    States are ordered by progress, so reaching a state also means every state before it has been reached.
+    A lost connection drops back to RECONNECTING, which comes before all connected states.
+    """
+    RECONNECTING = 0
+    CONNECTING = 1
+    LOGGED_IN = 2
+    PROBED = 3
+    READY = 4
+
+
+class _ResumableSSLContext(ssl.SSLContext):
+    """An SSL context that offers the session from its last connection, so reconnects can resume it."""
+
+    session: ssl.SSLSession | None = None
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.session
+
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+
+# Building an SSL context loads the system's CA store, so contexts are only built once per process.
+_shared_ssl_contexts: dict[bool, _ResumableSSLContext] = {}
+# Whether relaxed TLS is what worked on the most recent connection.
+_relaxed_tls_preferred = False
+
+
+def _next_reconnect_delay(previous_delay: float) -> float:
+    """
+    Picks the delay before the next connection attempt, using decorrelated jitter.
+    Each delay is random, but grows up to three times the previous one, capped at the maximum delay.
+    """
+
+    upper_bound = max(previous_delay, _RECONNECT_BASE_DELAY_SECONDS) * 3
+    return min(_RECONNECT_MAX_DELAY_SECONDS, random.uniform(_RECONNECT_BASE_DELAY_SECONDS, upper_bound))
+
+
+def _get_shared_ssl_context(verify: bool) -> _ResumableSSLContext:
+    """Returns the process-wide SSL context, either verifying the server certificate or not."""
+
+    context = _shared_ssl_contexts.get(verify)
+    if context is None:
+        context = _ResumableSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.load_default_certs()
+        if not verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+
+        _shared_ssl_contexts[verify] = context
+
+    return context
+
+
+# Names of the connection phases that end when each state is reached, used for connection timings.
+_PHASE_NAMES = {
+    ConnectionState.LOGGED_IN: "login",
+    ConnectionState.PROBED: "probe",
+    ConnectionState.READY: "initial_status",
+}
+
 
 class TcpManager:
     _LOGGER = logging.getLogger(__name__)
 
-    def __init__(self, user: User, client_callback: Callable, ssl_context: ssl.SSLContext = None, ssl_context_no_verify: ssl.SSLContext = None):
+    def __init__(self, user: User, client_callback: Callable, ssl_context: ssl.SSLContext = None,
+                 ssl_context_no_verify: ssl.SSLContext = None,
+                 max_in_flight_commands: int = DEFAULT_MAX_IN_FLIGHT_COMMANDS,
+                 command_ack_timeout: float = DEFAULT_COMMAND_ACK_TIMEOUT_SECONDS,
+                 state_callback: Callable[[ConnectionState], None] | None = None,
+                 heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL_SECONDS,
+                 max_missed_pongs: int = DEFAULT_MAX_MISSED_PONGS,
+                 write_buffer_high_water_mark: int = DEFAULT_WRITE_BUFFER_HIGH_WATER_MARK,
+                 write_buffer_low_water_mark: int = DEFAULT_WRITE_BUFFER_LOW_WATER_MARK,
+                 inbound_queue_high_water_mark: int = DEFAULT_INBOUND_QUEUE_HIGH_WATER_MARK,
+                 inbound_queue_low_water_mark: int = DEFAULT_INBOUND_QUEUE_LOW_WATER_MARK):
         self._user = user
 
-        self._packet_queue = None
+        self._packet_queue: InboundPacketQueue | None = None
+        self._inbound_queue_high_water_mark = inbound_queue_high_water_mark
+        self._inbound_queue_low_water_mark = inbound_queue_low_water_mark
         self._client_callback = client_callback
+        self._state_callback = state_callback
 
         self._ssl_context = ssl_context
         self._ssl_context_no_verify = ssl_context_no_verify
 
-        self._login_acknowledged = False
-
-        self._tcp_client_startup = asyncio.create_task(self._start_tcp_client())
+        self._state = ConnectionState.CONNECTING
+        self._state_reached_events = {state: asyncio.Event() for state in ConnectionState}
+        self.connection_timings: dict[str, float] = {}
+        self._phase_started_at: float | None = None
+        self._set_state(ConnectionState.CONNECTING)
+
+        self._max_in_flight_commands = max_in_flight_commands
+        self._command_ack_timeout = command_ack_timeout
+        self._in_flight_windows: dict[int, asyncio.Semaphore] = {}
+        self._pending_commands: dict[tuple[int, int], asyncio.Future] = {}
+        self._pending_command_sequences: dict[int, tuple[int, int]] = {}
+
+        self._heartbeat_interval = heartbeat_interval
+        self._max_missed_pongs = max_missed_pongs
+        self._last_received_at = 0.0
+        self._ping_sent_at: float | None = None
+        self.ping_rtt: float | None = None
+
+        self._write_buffer_high_water_mark = write_buffer_high_water_mark
+        self._write_buffer_low_water_mark = write_buffer_low_water_mark
+
+        self._closing = False
+        self._connect_task = asyncio.create_task(self._start_tcp_client())
         self._process_packet_task = None
         self._heartbeat_task = None
         self._transport = None
         self._protocol = None
+        self._connected_ssl_context: ssl.SSLContext | None = None
 
-    async def _start_tcp_client(self, delay_seconds: int | None = None):
-        connected = False
+    async def _start_tcp_client(self, delay_seconds: float = 0):
+        """
+        Connects to the Cync server, retrying until it succeeds.
+        Unless a delay is given, the first attempt is made right away. Failed attempts are retried with exponential
+        backoff and decorrelated jitter, so clients that lost their connections at the same time don't all retry
+        in lockstep.
+        """
 
-        if delay_seconds:
-            await asyncio.sleep(delay_seconds)
+        retry_delay = delay_seconds
+        while True:
+            if retry_delay > 0:
+                await asyncio.sleep(retry_delay)
 
-        while not connected:
             try:
                 await self._establish_tcp_connection()
-            except Exception:
-                self._LOGGER.error("Failed to connect to Cync server. Retrying in 5 seconds...")
-                await asyncio.sleep(5)
+            except Exception as ex:
+                retry_delay = _next_reconnect_delay(retry_delay)
+                self._LOGGER.error("Failed to connect to Cync server: {!r}. Retrying in {:.1f} seconds...".format(
+                    ex, retry_delay))
             else:
-                connected = True
+                break
 
-                self._process_packet_task = asyncio.create_task(self._process_packets(), name="Process Cync Packets")
-                self._heartbeat_task = asyncio.create_task(self._send_pings(), name="Send Heartbeats")
+        self._process_packet_task = asyncio.create_task(self._process_packets(), name="Process Cync Packets")
+        self._heartbeat_task = asyncio.create_task(self._send_pings(), name="Send Heartbeats")
 
-                self._process_packet_task.add_done_callback(self._read_task_finished)
+        self._process_packet_task.add_done_callback(self._read_task_finished)
+
+    def _schedule_reconnect(self, delay_seconds: float = 0):
+        """Starts reconnecting, unless a connection attempt is already in progress."""
+
+        if self._closing or (self._connect_task is not None and not self._connect_task.done()):
+            return
+
+        self._connect_task = asyncio.create_task(self._start_tcp_client(delay_seconds), name="Connect to Cync")
 
     async def _establish_tcp_connection(self):
-        if self._ssl_context is None:
-            context = ssl.create_default_context()
-        else:
-            context = self._ssl_context
+        global _relaxed_tls_preferred
 
-        self._packet_queue = asyncio.Queue()
+        strict_context = self._ssl_context if self._ssl_context is not None else _get_shared_ssl_context(True)
+        relaxed_context = (self._ssl_context_no_verify if self._ssl_context_no_verify is not None
+                           else _get_shared_ssl_context(False))
 
-        try:
-            self._transport, self._protocol = await asyncio.get_event_loop().create_connection(lambda: CyncTcpProtocol(self._packet_queue, self._user), host=TCP_API_HOSTNAME, port=TCP_API_TLS_PORT, ssl=context)
-        except Exception:
-            # Normally this isn't something you'd want to do.
-            # However, Cync's server has a 2+ year expired certificate and the common name doesn't match.
-            # Why they haven't renewed/fixed it, and why their devices allow this, who knows...
-            self._LOGGER.debug("Could not connect to Cync TCP server with strict TLS. Using relaxed TLS.")
-
-            if self._ssl_context_no_verify is None:
-                context.check_hostname = False
-                context.verify_mode = ssl.CERT_NONE
+        # Normally falling back to relaxed TLS isn't something you'd want to do.
+        # However, Cync's server has a 2+ year expired certificate and the common name doesn't match.
+        # Why they haven't renewed/fixed it, and why their devices allow this, who knows...
+        # Whichever mode worked last is tried first, so reconnects don't pay for a handshake that is bound to fail.
+        tls_attempts = [(False, strict_context), (True, relaxed_context)]
+        if _relaxed_tls_preferred:
+            tls_attempts.reverse()
+
+        self._packet_queue = InboundPacketQueue(self._inbound_queue_high_water_mark,
+                                                self._inbound_queue_low_water_mark)
+        connect_started_at = time.monotonic()
+
+        for attempt_number, (is_relaxed, context) in enumerate(tls_attempts, start=1):
+            try:
+                self._transport, self._protocol = await asyncio.get_event_loop().create_connection(self._create_protocol, host=TCP_API_HOSTNAME, port=TCP_API_TLS_PORT, ssl=context)
+            except Exception:
+                if attempt_number == len(tls_attempts):
+                    raise
+
+                self._LOGGER.debug("Could not connect to Cync TCP server with {} TLS. Using {} TLS.".format(
+                    "relaxed" if is_relaxed else "strict", "strict" if is_relaxed else "relaxed"))
             else:
-                context = self._ssl_context_no_verify
+                _relaxed_tls_preferred = is_relaxed
+                self._connected_ssl_context = context
+                break
+
+        self._phase_started_at = time.monotonic()
+        self.connection_timings = {"tls_connect": self._phase_started_at - connect_started_at}
+        self._last_received_at = self._phase_started_at
+        self._ping_sent_at = None
 
-            self._transport, self._protocol = await asyncio.get_event_loop().create_connection(lambda: CyncTcpProtocol(self._packet_queue, self._user), host=TCP_API_HOSTNAME, port=TCP_API_TLS_PORT, ssl=context)
+    def _create_protocol(self) -> CyncTcpProtocol:
+        return CyncTcpProtocol(self._packet_queue, self._user, self._write_buffer_high_water_mark,
+                               self._write_buffer_low_water_mark)
 
     async def _process_packets(self):
         """Process parsed packets as they're added to the async queue."""
@@ -100,45 +256,241 @@ class TcpManager:
                 break
 
             if parsed_packet == _CONNECTION_LOST_STRING:
-                self._LOGGER.error("Cync server connection closed. Reconnecting in 10 seconds...")
-                self._process_packet_task.cancel()
-                asyncio.create_task(self._start_tcp_client(10))
+                raise ConnectionClosedError("Connection lost")
             else:
+                self._last_received_at = time.monotonic()
+
                 match parsed_packet.message_type:
                     case MessageType.LOGIN.value:
-                        self._login_acknowledged = True
+                        self._set_state(ConnectionState.LOGGED_IN)
+                        self._remember_tls_session()
                     case MessageType.DISCONNECT.value:
-                        self._login_acknowledged = False
-                        raise ConnectionClosedError
+                        raise ServerDisconnectedError("Disconnected by the server")
+                    case MessageType.PIPE.value:
+                        self._acknowledge_command(parsed_packet)
+                    case MessageType.PING.value:
+                        self._record_ping_rtt()
 
                 await self._client_callback(parsed_packet)
 
+                # Only advance once the client has handled the packet, so anything waiting on the new state
+                # sees the device information that the packet carried.
+                match parsed_packet.message_type:
+                    case MessageType.PROBE.value if parsed_packet.version != 0:
+                        self._advance_state(ConnectionState.PROBED)
+                    case MessageType.PIPE.value if parsed_packet.command_code == PipeCommandCode.QUERY_DEVICE_STATUS_PAGES.value:
+                        self._advance_state(ConnectionState.READY)
+
     def _read_task_finished(self, future):
+        """
+        Tears down the connection once packet processing stops, and reconnects unless the client is shutting down.
+        This is the only place that reconnects after a connection has been established.
+        """
+
         self._packet_queue.shutdown()
         self._transport.close()
+        self._heartbeat_task.cancel()
+        self._set_state(ConnectionState.RECONNECTING)
 
-        try:
-            self._login_acknowledged = False
-            self._heartbeat_task.cancel()
-            future.result()
-        except CancelledError:
+        if self._closing or future.cancelled():
             self._LOGGER.info("Cync client shutting down")
-        except Exception as e:
-            self._LOGGER.error("Cync server connection closed. Reconnecting in 10 seconds...")
-            asyncio.create_task(self._start_tcp_client(10))
+            return
+
+        close_reason = future.exception()
+        if isinstance(close_reason, ServerDisconnectedError):
+            self._LOGGER.error("Cync server closed the connection. Reconnecting in {} seconds...".format(
+                _SERVER_DISCONNECT_RECONNECT_DELAY_SECONDS))
+            self._schedule_reconnect(_SERVER_DISCONNECT_RECONNECT_DELAY_SECONDS)
+        else:
+            self._LOGGER.error("Cync server connection closed: {!r}. Reconnecting...".format(close_reason))
+            self._schedule_reconnect()
+
+    def _remember_tls_session(self):
+        """
+        Saves the current TLS session, so the next connection can resume it instead of doing a full handshake.
+        This is done after logging in, since TLS 1.3 servers only hand out their session tickets after the handshake.
+        """
+
+        if not isinstance(self._connected_ssl_context, _ResumableSSLContext) or self._transport is None:
+            return
+
+        ssl_object = self._transport.get_extra_info("ssl_object")
+        if ssl_object is not None and ssl_object.session is not None:
+            self._connected_ssl_context.session = ssl_object.session
+
+    @property
+    def connection_state(self) -> ConnectionState:
+        return self._state
+
+    async def wait_for_state(self, state: ConnectionState, timeout: float | None = None):
+        """
+        Waits until the connection has reached at least the given state.
+        Raises a TimeoutError if a timeout is given and the state isn't reached in time.
+        """
+
+        if self._state >= state:
+            return
+
+        self._LOGGER.debug("Awaiting connection state {} before continuing.".format(state.name))
+        async with asyncio.timeout(timeout):
+            await self._state_reached_events[state].wait()
+
+    def _set_state(self, state: ConnectionState):
+        previous_state = self._state
+        self._state = state
+
+        if state == ConnectionState.RECONNECTING:
+            self._fail_pending_commands()
+
+        for candidate_state, reached_event in self._state_reached_events.items():
+            if candidate_state <= state:
+                reached_event.set()
+            else:
+                reached_event.clear()
+
+        if state > previous_state:
+            self._record_phase_timing(state)
+        if state != previous_state and self._state_callback is not None:
+            self._state_callback(state)
+
+    def _record_phase_timing(self, state: ConnectionState):
+        """Records how long it took to reach the given state since the previous phase of the connection ended."""
+
+        phase_name = _PHASE_NAMES.get(state)
+        if phase_name is None or self._phase_started_at is None:
+            return
+
+        phase_ended_at = time.monotonic()
+        self.connection_timings[phase_name] = phase_ended_at - self._phase_started_at
+        self._phase_started_at = phase_ended_at
+
+    def _advance_state(self, state: ConnectionState):
+        """Moves to the given state, unless the connection has already progressed past it."""
+
+        if state > self._state:
+            self._set_state(state)
 
     async def _send_request(self, request):
-        while not self._login_acknowledged:
-            await asyncio.sleep(1)
-            self._LOGGER.debug("Awaiting login acknowledge before sending request.")
+        await self.wait_for_state(ConnectionState.LOGGED_IN)
+        await self._wait_for_write_capacity()
         self._transport.write(request)
 
-    async def _send_pings(self):
-        """Periodically send a ping to the Cync server as a connection heartbeat."""
+    async def _wait_for_write_capacity(self):
+        """Waits while the transport's write buffer is above its high water mark."""
+
+        if self._protocol is not None:
+            await self._protocol.wait_for_write_capacity()
+
+    async def _send_command(self, hub_device: CyncDevice, request_packet: bytes) -> asyncio.Future:
+        """
+        Sends a command through the given hub device.
+        Returns a future that resolves once the command has been acknowledged, or fails with a CommandTimeoutError
+        if no acknowledgement arrives in time.
+        Each hub allows a limited number of unacknowledged commands, so this waits for a free slot before sending.
+        It also waits while the connection's write buffer is full.
+        """
+
+        in_flight_window = self._in_flight_windows.get(hub_device.device_id)
+        if in_flight_window is None:
+            in_flight_window = asyncio.Semaphore(self._max_in_flight_commands)
+            self._in_flight_windows[hub_device.device_id] = in_flight_window
+
+        await in_flight_window.acquire()
+        try:
+            await self.wait_for_state(ConnectionState.LOGGED_IN)
+            await self._wait_for_write_capacity()
+        except BaseException:
+            in_flight_window.release()
+            raise
+
+        loop = asyncio.get_running_loop()
+        packet_counter, inner_sequence = packet_parser.parse_request_identifiers(request_packet)
+        command_key = (hub_device.device_id, packet_counter)
+
+        ack_future = loop.create_future()
+        timeout_handle = loop.call_later(self._command_ack_timeout, self._expire_command, command_key)
+
+        def command_finished(future: asyncio.Future):
+            timeout_handle.cancel()
+            in_flight_window.release()
+            if self._pending_commands.get(command_key) is future:
+                del self._pending_commands[command_key]
+            if inner_sequence is not None and self._pending_command_sequences.get(inner_sequence) == command_key:
+                del self._pending_command_sequences[inner_sequence]
+            if not future.cancelled():
+                # Callers aren't required to await the acknowledgement, so don't log failures as unretrieved.
+                future.exception()
+
+        ack_future.add_done_callback(command_finished)
+        self._pending_commands[command_key] = ack_future
+        if inner_sequence is not None:
+            self._pending_command_sequences[inner_sequence] = command_key
+
+        self._transport.write(request_packet)
+
+        return ack_future
+
+    def _acknowledge_command(self, parsed_packet: ParsedMessage):
+        """Resolves the pending command that the given PIPE packet acknowledges, if there is one."""
+
+        if parsed_packet.is_response and parsed_packet.command_code is None:
+            command_key = (parsed_packet.device_id, parsed_packet.packet_counter)
+        elif parsed_packet.inner_sequence is not None:
+            command_key = self._pending_command_sequences.get(parsed_packet.inner_sequence)
+        else:
+            return
+
+        ack_future = self._pending_commands.get(command_key)
+        if ack_future is not None and not ack_future.done():
+            ack_future.set_result(None)
+
+    def _expire_command(self, command_key: tuple[int, int]):
+        ack_future = self._pending_commands.get(command_key)
+        if ack_future is not None and not ack_future.done():
+            ack_future.set_exception(CommandTimeoutError(
+                "Command {} sent through device {} was not acknowledged within {} seconds.".format(
+                    command_key[1], command_key[0], self._command_ack_timeout)))
 
+    def _fail_pending_commands(self):
+        for ack_future in list(self._pending_commands.values()):
+            if not ack_future.done():
+                ack_future.set_exception(CyncError("Connection to the Cync server was lost before the command was acknowledged."))
+
+    async def _send_pings(self):
+        """
+        Sends pings to the Cync server as a connection heartbeat, and detects connections that silently died.
+        Any packet from the server proves the connection is alive, so a ping is only sent once nothing has been
+        received for a full heartbeat interval. If several pings in a row go unanswered, the connection is aborted,
+        which hands it over to the reconnect logic.
+        """
+
+        missed_pongs = 0
         while True:
-            await asyncio.sleep(20)
-            await self._send_request(bytes.fromhex('d300000000'))
+            idle_seconds = time.monotonic() - self._last_received_at
+            if idle_seconds < self._heartbeat_interval:
+                missed_pongs = 0
+                await asyncio.sleep(self._heartbeat_interval - idle_seconds)
+                continue
+
+            if missed_pongs >= self._max_missed_pongs:
+                self._LOGGER.error("Cync server did not answer {} pings in a row. Closing the connection.".format(
+                    missed_pongs))
+                self._transport.abort()
+                return
+
+            # Pings skip the write buffer limit. A connection whose buffer never drains is exactly what they detect.
+            await self.wait_for_state(ConnectionState.LOGGED_IN)
+            self._ping_sent_at = time.monotonic()
+            self._transport.write(_PING_REQUEST)
+            missed_pongs += 1
+            await asyncio.sleep(self._heartbeat_interval)
+
+    def _record_ping_rtt(self):
+        """Measures the round trip time of the outstanding ping, now that its response has arrived."""
+
+        if self._ping_sent_at is not None:
+            self.ping_rtt = self._last_received_at - self._ping_sent_at
+            self._ping_sent_at = None
 
     async def probe_devices(self, devices: list[CyncDevice]):
         """Probe all account devices to see which ones are responsive over Wi-Fi."""
@@ -151,8 +503,19 @@ class TcpManager:
         """Shut down the Cync client connection."""
 
         await self._send_request(bytes.fromhex('e30000000103'))
+        self._closing = True
         self._process_packet_task.cancel()
 
+    def close(self):
+        """Closes the connection immediately without logging out, and stops any connection attempt in progress."""
+
+        self._closing = True
+        self._connect_task.cancel()
+        if self._process_packet_task is not None:
+            self._process_packet_task.cancel()
+        elif self._transport is not None:
+            self._transport.close()
+
     async def update_mesh_devices(self, hub_devices: list[CyncDevice]):
         """Get new device state."""
         for hub_device in hub_devices:
@@ -162,79 +525,134 @@ class TcpManager:
     async def set_power_state(self, hub_device: CyncDevice, mesh_id: int, mesh_group_id: int, is_on: bool):
         """Set device(s) to either on or off."""
         request_packet = packet_builder.build_power_state_request_packet(hub_device.device_id, mesh_id, mesh_group_id, is_on)
-        await self._send_request(request_packet)
+        return await self._send_command(hub_device, request_packet)
 
     async def set_brightness(self, hub_device: CyncDevice, mesh_id: int, brightness: int):
         """Sets the brightness."""
         request_packet = packet_builder.build_brightness_request_packet(hub_device.device_id, mesh_id, brightness)
-        await self._send_request(request_packet)
+        return await self._send_command(hub_device, request_packet)
 
     async def set_color_temp(self, hub_device: CyncDevice, mesh_id: int, color_temp: int):
         """Sets the color temperature."""
         request_packet = packet_builder.build_color_temp_request_packet(hub_device.device_id, mesh_id, color_temp)
-        await self._send_request(request_packet)
+        return await self._send_command(hub_device, request_packet)
 
     async def set_rgb(self, hub_device: CyncDevice, mesh_id: int, rgb: tuple[int, int, int]):
         """Sets the RGB color."""
         request_packet = packet_builder.build_rgb_request_packet(hub_device.device_id, mesh_id, rgb)
-        await self._send_request(request_packet)
+        return await self._send_command(hub_device, request_packet)
 
     async def set_combo(self, hub_device: CyncDevice, mesh_id: int, is_on: bool, brightness: int, color_temp: int | None, rgb: tuple[int, int, int] | None):
         """Set multiple datapoints in one command."""
         request_packet = packet_builder.build_combo_request_packet(hub_device.device_id, mesh_id, is_on, brightness, color_temp, rgb)
-        await self._send_request(request_packet)
+        return await self._send_command(hub_device, request_packet)
 
 class CyncTcpProtocol(asyncio.Protocol):
     """Protocol class for processing the Cync TCP packets."""
 
     _LOGGER = logging.getLogger(__name__)
 
-    def __init__(self, packet_queue: asyncio.Queue, user):
+    def __init__(self, packet_queue: InboundPacketQueue, user,
+                 write_buffer_high_water_mark: int = DEFAULT_WRITE_BUFFER_HIGH_WATER_MARK,
+                 write_buffer_low_water_mark: int = DEFAULT_WRITE_BUFFER_LOW_WATER_MARK):
         self._transport = None
         self._packet_queue = packet_queue
         self._user = user
 
+        self._write_buffer_high_water_mark = write_buffer_high_water_mark
+        self._write_buffer_low_water_mark = write_buffer_low_water_mark
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+
+        # Reassembly buffer for the TCP stream. Frames may be split across reads,
+        # so any trailing partial frame is held here until the rest of it arrives.
+        self._read_buffer = bytearray()
+
     def connection_made(self, transport):
         self._transport = transport
+        self._read_buffer.clear()
+        transport.set_write_buffer_limits(self._write_buffer_high_water_mark, self._write_buffer_low_water_mark)
+        self._packet_queue.set_transport(transport)
 
         self._log_in()
 
     def connection_lost(self, exc):
+        self._read_buffer.clear()
+        # Nothing more will drain from the buffer, so release anyone waiting to write.
+        self._can_write.set()
+
         try:
             self._packet_queue.put_nowait(_CONNECTION_LOST_STRING)
         except QueueShutDown:
             self._LOGGER.debug("Queue already shut down.")
 
+    def pause_writing(self):
+        self._LOGGER.debug("Write buffer is full, pausing writes.")
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._LOGGER.debug("Write buffer has drained, resuming writes.")
+        self._can_write.set()
+
+    async def wait_for_write_capacity(self):
+        """Waits until the transport's write buffer has drained below its low water mark, if it's currently full."""
+
+        await self._can_write.wait()
+
     def data_received(self, data):
-        while len(data) > 0:
-            try:
-                if len(data) < 5:
-                    break
-                packet_length = struct.unpack(">I", data[1:5])[0]
-                if packet_length + 5 > len(data):
+        self._read_buffer += data
+
+        consumed_length = 0
+        buffer_view = memoryview(self._read_buffer)
+        try:
+            buffer_length = len(buffer_view)
+            while buffer_length - consumed_length >= 5:
+                packet_length = _PACKET_LENGTH_STRUCT.unpack_from(buffer_view, consumed_length + 1)[0]
+                frame_end = consumed_length + packet_length + 5
+                if frame_end > buffer_length:
                     self._LOGGER.debug(
                         "Incomplete packet received, waiting for more data. "
-                        "Expected: {}, got: {}".format(packet_length + 5, len(data))
+                        "Expected: {}, got: {}".format(packet_length + 5, buffer_length - consumed_length)
                     )
                     break
-                packet = data[:packet_length + 5]
-                try:
-                    parsed_packet = packet_parser.parse_packet(packet, self._user.user_id)
-                    self._packet_queue.put_nowait(parsed_packet)
-                except NotImplementedError:
-                    # Simply ignore the packet for now
-                    pass
-                except Exception as ex:
-                    self._LOGGER.debug(
-                        "Skipping unrecognized packet: {}".format(str(ex))
-                    )
-                finally:
-                    data = data[packet_length + 5:]
-            except struct.error as ex:
-                self._LOGGER.error(
-                    "Fatal packet structure error, resetting buffer: {}".format(str(ex))
-                )
-                break
+
+                self._handle_frame(buffer_view[consumed_length:frame_end])
+                consumed_length = frame_end
+        except struct.error as ex:
+            self._LOGGER.error(
+                "Fatal packet structure error, resetting buffer: {}".format(str(ex))
+            )
+            consumed_length = len(self._read_buffer)
+        finally:
+            buffer_view.release()
+
+        self._discard_consumed_bytes(consumed_length)
+
+    def _handle_frame(self, frame: memoryview):
+        try:
+            parsed_packet = packet_parser.parse_packet(frame, self._user.user_id)
+            self._packet_queue.put_nowait(parsed_packet)
+        except NotImplementedError:
+            # Simply ignore the packet for now
+            pass
+        except Exception as ex:
+            self._LOGGER.debug(
+                "Skipping unrecognized packet: {}".format(str(ex))
+            )
+        finally:
+            frame.release()
+
+    def _discard_consumed_bytes(self, consumed_length: int):
+        """Drops fully processed frames from the front of the read buffer, keeping any partial frame."""
+
+        if consumed_length == 0:
+            return
+
+        try:
+            del self._read_buffer[:consumed_length]
+        except BufferError:
+            # A view into the buffer is still held somewhere, so it can't be resized in place.
+            self._read_buffer = self._read_buffer[consumed_length:]
 
     def _log_in(self):
         login_request_packet = packet_builder.build_login_request_packet(self._user.authorize, self._user.user_id)
@@ -242,3 +660,7 @@ class CyncTcpProtocol(asyncio.Protocol):
 
 class ConnectionClosedError(Exception):
     """Connection closed error"""
+
+
+class ServerDisconnectedError(ConnectionClosedError):
+    """The server ended the session, usually because another client logged in to the same account."""
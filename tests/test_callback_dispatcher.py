@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pycync.tcp.callback_dispatcher import CallbackDispatcher
+
+
+@pytest.mark.asyncio
+async def test_updates_for_same_device_stay_in_order():
+    dispatcher = CallbackDispatcher()
+    delivered_updates = []
+
+    async def slow_callback(updated_data):
+        delivered_updates.append(("started", dict(updated_data)))
+        await asyncio.sleep(0.01)
+        delivered_updates.append(("finished", dict(updated_data)))
+
+    dispatcher.dispatch(slow_callback, {"1-1": 1})
+    await asyncio.sleep(0)
+    dispatcher.dispatch(slow_callback, {"1-1": 2, "1-2": 2})
+    await dispatcher.join()
+
+    assert delivered_updates == [
+        ("started", {"1-1": 1}),
+        ("finished", {"1-1": 1}),
+        ("started", {"1-1": 2, "1-2": 2}),
+        ("finished", {"1-1": 2, "1-2": 2})
+    ]
+
+
+@pytest.mark.asyncio
+async def test_waiting_device_update_is_not_repeated():
+    dispatcher = CallbackDispatcher()
+    delivered_updates = []
+
+    dispatcher.dispatch(delivered_updates.append, {"1-1": 1})
+    dispatcher.dispatch(delivered_updates.append, {"1-1": 1, "1-2": 1})
+    await dispatcher.join()
+
+    assert delivered_updates == [{"1-1": 1}, {"1-2": 1}]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callbacks_are_limited():
+    dispatcher = CallbackDispatcher(max_concurrent_callbacks=2)
+    release_callbacks = asyncio.Event()
+    running_callbacks = []
+
+    async def blocking_callback(updated_data):
+        running_callbacks.append(updated_data)
+        await release_callbacks.wait()
+
+    for device_number in range(4):
+        dispatcher.dispatch(blocking_callback, {f"1-{device_number}": device_number})
+    await asyncio.sleep(0.01)
+    assert len(running_callbacks) == 2
+
+    release_callbacks.set()
+    await dispatcher.join()
+    assert len(running_callbacks) == 4
+
+
+@pytest.mark.asyncio
+async def test_sync_callbacks_run_in_executor():
+    callback_threads = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        dispatcher = CallbackDispatcher(executor=executor)
+        dispatcher.dispatch(lambda updated_data: callback_threads.append(threading.current_thread()), {"1-1": 1})
+        await dispatcher.join()
+
+    assert callback_threads and callback_threads[0] is not threading.current_thread()
+
+
+@pytest.mark.asyncio
+async def test_failing_callback_does_not_block_later_updates():
+    dispatcher = CallbackDispatcher()
+    delivered_updates = []
+
+    def flaky_callback(updated_data):
+        delivered_updates.append(updated_data)
+        if len(delivered_updates) == 1:
+            raise ValueError("Callback failed")
+
+    dispatcher.dispatch(flaky_callback, {"1-1": 1})
+    await dispatcher.join()
+    dispatcher.dispatch(flaky_callback, {"1-1": 2})
+    await dispatcher.join()
+
+    assert delivered_updates == [{"1-1": 1}, {"1-1": 2}]
@@ -0,0 +1,506 @@
+import asyncio
+
+import pytest
+
+from pycync import User, CyncLight, CyncHome
+from pycync.devices.device_types import DeviceType
+from pycync.devices.subscriptions import Subscription, SubscriptionRegistry
+from pycync.exceptions import CommandTimeoutError, NoHubConnectedError
+from pycync.tcp.command_client import CommandClient
+from pycync.tcp.hub_pool import HubPool
+from pycync.tcp.packet import MessageType, ParsedMessage, PipeCommandCode
+from pycync.tcp.tcp_manager import ConnectionState
+from tests import TEST_USER_ID
+
+TEST_USER = User("test_token", "test_refresh_token", "test_authorize_string", TEST_USER_ID, expire_in=3600)
+
+HUB_DEVICE = CyncLight(True, True, 1234, 4, 5432, "Hub", 137, DeviceType.LIGHT, "123456ABCDEF", "ID1", "Code")
+SECOND_HUB_DEVICE = CyncLight(True, True, 3456, 8, 5432, "Hub 2", 137, DeviceType.LIGHT, "323456ABCDEF", "ID1",
+                              "Code")
+TEST_LIGHT = CyncLight(True, False, 2345, 7, 5432, "Light", 137, DeviceType.LIGHT, "223456ABCDEF", "ID1", "Code")
+
+
+def _create_command_client(mocker, **kwargs) -> CommandClient:
+    """Create a CommandClient with a mocked connection, where every command is sent through HUB_DEVICE."""
+    command_client = CommandClient(TEST_USER, **kwargs)
+    command_client._tcp_manager = mocker.AsyncMock()
+    command_client._get_hub_pool(HUB_DEVICE.parent_home_id).add_hub(HUB_DEVICE)
+
+    return command_client
+
+
+def _create_ack_futures(count: int) -> list[asyncio.Future]:
+    loop = asyncio.get_running_loop()
+    return [loop.create_future() for _ in range(count)]
+
+
+def test_connection_options_passed_to_tcp_manager(mocker):
+    tcp_manager = mocker.patch("pycync.tcp.command_client.TcpManager")
+    command_client = CommandClient(TEST_USER, max_in_flight_commands=2, command_ack_timeout=1.5,
+                                   heartbeat_interval=30, max_missed_pongs=5, write_buffer_high_water_mark=4096,
+                                   write_buffer_low_water_mark=1024, inbound_queue_high_water_mark=32,
+                                   inbound_queue_low_water_mark=8)
+
+    command_client.start_connection()
+
+    assert tcp_manager.call_args.kwargs["max_in_flight_commands"] == 2
+    assert tcp_manager.call_args.kwargs["command_ack_timeout"] == 1.5
+    assert tcp_manager.call_args.kwargs["heartbeat_interval"] == 30
+    assert tcp_manager.call_args.kwargs["max_missed_pongs"] == 5
+    assert tcp_manager.call_args.kwargs["write_buffer_high_water_mark"] == 4096
+    assert tcp_manager.call_args.kwargs["write_buffer_low_water_mark"] == 1024
+    assert tcp_manager.call_args.kwargs["inbound_queue_high_water_mark"] == 32
+    assert tcp_manager.call_args.kwargs["inbound_queue_low_water_mark"] == 8
+
+
+@pytest.mark.asyncio
+async def test_rapid_commands_are_coalesced(mocker):
+    command_client = _create_command_client(mocker, min_command_interval=10, command_fusion_window=0)
+    ack_futures = _create_ack_futures(2)
+    command_client._tcp_manager.set_brightness.side_effect = ack_futures
+
+    first_result = await command_client.set_brightness(TEST_LIGHT, 10)
+    await asyncio.sleep(0)
+    second_result = await command_client.set_brightness(TEST_LIGHT, 20)
+    third_result = await command_client.set_brightness(TEST_LIGHT, 30)
+    await asyncio.sleep(0)
+
+    command_client._tcp_manager.set_brightness.assert_called_once_with(HUB_DEVICE, 7, 10)
+    assert second_result is third_result
+
+    ack_futures[0].set_result(None)
+    await first_result
+    await asyncio.sleep(0)
+
+    assert command_client._tcp_manager.set_brightness.call_count == 2
+    command_client._tcp_manager.set_brightness.assert_called_with(HUB_DEVICE, 7, 30)
+
+    ack_futures[1].set_result(None)
+    await third_result
+
+
+@pytest.mark.asyncio
+async def test_coalesced_command_sent_after_min_interval(mocker):
+    command_client = _create_command_client(mocker, min_command_interval=0.01, command_fusion_window=0)
+    ack_futures = _create_ack_futures(2)
+    command_client._tcp_manager.set_brightness.side_effect = ack_futures
+
+    await command_client.set_brightness(TEST_LIGHT, 10)
+    await asyncio.sleep(0)
+    await command_client.set_brightness(TEST_LIGHT, 20)
+    await asyncio.sleep(0.05)
+
+    # The first command was never acknowledged, but the minimum interval has passed
+    assert command_client._tcp_manager.set_brightness.call_count == 2
+    command_client._tcp_manager.set_brightness.assert_called_with(HUB_DEVICE, 7, 20)
+
+
+@pytest.mark.asyncio
+async def test_different_command_kinds_are_not_coalesced(mocker):
+    command_client = _create_command_client(mocker, min_command_interval=10, command_fusion_window=0)
+    mocker.patch.object(TEST_LIGHT, "supports_capability", return_value=False)
+    command_client._tcp_manager.set_brightness.side_effect = _create_ack_futures(1)
+    command_client._tcp_manager.set_power_state.side_effect = _create_ack_futures(1)
+
+    await command_client.set_brightness(TEST_LIGHT, 10)
+    await command_client.set_power_state(TEST_LIGHT, True)
+    await asyncio.sleep(0)
+
+    command_client._tcp_manager.set_brightness.assert_called_once_with(HUB_DEVICE, 7, 10)
+    command_client._tcp_manager.set_power_state.assert_called_once_with(HUB_DEVICE, 7, 0, True)
+
+
+@pytest.mark.asyncio
+async def test_failed_send_sets_result_exception(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    command_client._tcp_manager.set_rgb.side_effect = ConnectionError("Connection lost")
+
+    result = await command_client.set_rgb(TEST_LIGHT, (1, 2, 3))
+
+    with pytest.raises(ConnectionError):
+        await result
+
+
+@pytest.mark.asyncio
+async def test_commands_fused_into_combo(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0.01)
+    ack_futures = _create_ack_futures(1)
+    command_client._tcp_manager.set_combo.side_effect = ack_futures
+
+    power_result = await command_client.set_power_state(TEST_LIGHT, True)
+    brightness_result = await command_client.set_brightness(TEST_LIGHT, 80)
+    color_result = await command_client.set_color_temp(TEST_LIGHT, 30)
+    await asyncio.sleep(0.05)
+
+    command_client._tcp_manager.set_combo.assert_called_once_with(HUB_DEVICE, 7, True, 80, 30, None)
+    command_client._tcp_manager.set_power_state.assert_not_called()
+    command_client._tcp_manager.set_brightness.assert_not_called()
+    command_client._tcp_manager.set_color_temp.assert_not_called()
+    assert power_result is brightness_result is color_result
+
+    ack_futures[0].set_result(None)
+    await color_result
+
+
+@pytest.mark.asyncio
+async def test_unfusable_commands_sent_individually(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0.01)
+    command_client._tcp_manager.set_brightness.side_effect = _create_ack_futures(1)
+    command_client._tcp_manager.set_rgb.side_effect = _create_ack_futures(1)
+
+    await command_client.set_brightness(TEST_LIGHT, 80)
+    await command_client.set_color_temp(TEST_LIGHT, 30)
+    await command_client.set_rgb(TEST_LIGHT, (1, 2, 3))
+    await asyncio.sleep(0.05)
+
+    # Without a power state change, there's nothing to fuse brightness with. The RGB change replaced the color temp.
+    command_client._tcp_manager.set_combo.assert_not_called()
+    command_client._tcp_manager.set_brightness.assert_called_once_with(HUB_DEVICE, 7, 80)
+    command_client._tcp_manager.set_rgb.assert_called_once_with(HUB_DEVICE, 7, (1, 2, 3))
+    command_client._tcp_manager.set_color_temp.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_combo_controllable_commands_sent_in_order(mocker):
+    command_client = _create_command_client(mocker, min_command_interval=10, command_fusion_window=0.01)
+    combo_ack_futures = _create_ack_futures(1)
+    command_client._tcp_manager.set_combo.side_effect = combo_ack_futures
+    command_client._tcp_manager.set_power_state.side_effect = _create_ack_futures(1)
+
+    await command_client.set_power_state(TEST_LIGHT, True)
+    await command_client.set_brightness(TEST_LIGHT, 80)
+    await asyncio.sleep(0.05)
+    await command_client.set_power_state(TEST_LIGHT, False)
+    await asyncio.sleep(0.05)
+
+    # The power command waits behind the combo command it overrides, instead of racing it through another slot.
+    command_client._tcp_manager.set_combo.assert_called_once_with(HUB_DEVICE, 7, True, 80, None, None)
+    command_client._tcp_manager.set_power_state.assert_not_called()
+    assert len(command_client._outbound_slots) == 1
+
+    combo_ack_futures[0].set_result(None)
+    await asyncio.sleep(0.01)
+
+    command_client._tcp_manager.set_power_state.assert_called_once_with(HUB_DEVICE, 7, 0, False)
+
+
+@pytest.mark.asyncio
+async def test_controllable_without_combo_is_not_buffered(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=10)
+    command_client._tcp_manager.set_power_state.side_effect = _create_ack_futures(1)
+    mocker.patch.object(TEST_LIGHT, "supports_capability", return_value=False)
+
+    await command_client.set_power_state(TEST_LIGHT, True)
+    await asyncio.sleep(0)
+
+    command_client._tcp_manager.set_power_state.assert_called_once_with(HUB_DEVICE, 7, 0, True)
+
+
+@pytest.mark.asyncio
+async def test_no_hub_connected(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    command_client._hub_pools.clear()
+
+    with pytest.raises(NoHubConnectedError):
+        await command_client.set_brightness(TEST_LIGHT, 10)
+
+    command_client._tcp_manager.set_brightness.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_no_hub_connected_raised_from_device_command(mocker):
+    command_client = _create_command_client(mocker)
+    command_client._hub_pools.clear()
+    light = CyncLight(True, False, 2345, 7, 5432, "Light", 137, DeviceType.LIGHT, "223456ABCDEF", "ID1", "Code",
+                      command_client=command_client)
+
+    with pytest.raises(NoHubConnectedError):
+        await light.turn_on()
+
+
+@pytest.mark.asyncio
+async def test_commands_spread_across_hubs(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    command_client._get_hub_pool(SECOND_HUB_DEVICE.parent_home_id).add_hub(SECOND_HUB_DEVICE)
+    ack_futures = _create_ack_futures(2)
+    command_client._tcp_manager.set_brightness.side_effect = ack_futures
+
+    await command_client.set_brightness(TEST_LIGHT, 10)
+    await command_client.set_brightness(HUB_DEVICE, 20)
+    await asyncio.sleep(0)
+
+    used_hubs = {call.args[0].device_id for call in command_client._tcp_manager.set_brightness.call_args_list}
+    assert used_hubs == {HUB_DEVICE.device_id, SECOND_HUB_DEVICE.device_id}
+
+    for ack_future in ack_futures:
+        ack_future.set_result(None)
+
+
+@pytest.mark.asyncio
+async def test_unacknowledged_command_fails_over_to_another_hub(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    hub_pool = command_client._get_hub_pool(SECOND_HUB_DEVICE.parent_home_id)
+    hub_pool.add_hub(SECOND_HUB_DEVICE)
+    ack_futures = _create_ack_futures(2)
+    command_client._tcp_manager.set_brightness.side_effect = ack_futures
+
+    result = await command_client.set_brightness(TEST_LIGHT, 10)
+    await asyncio.sleep(0)
+
+    first_hub = command_client._tcp_manager.set_brightness.call_args.args[0]
+    ack_futures[0].set_exception(CommandTimeoutError())
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    second_hub = command_client._tcp_manager.set_brightness.call_args.args[0]
+    assert second_hub.device_id != first_hub.device_id
+
+    ack_futures[1].set_result(None)
+    await result
+
+    hub_stats = {hub.device.device_id: hub for hub in hub_pool.hubs}
+    assert hub_stats[first_hub.device_id].consecutive_failures == 1
+    assert hub_stats[second_hub.device_id].consecutive_failures == 0
+
+
+@pytest.mark.asyncio
+async def test_superseded_command_is_not_retried(mocker):
+    command_client = _create_command_client(mocker, min_command_interval=0.01, command_fusion_window=0)
+    command_client._get_hub_pool(SECOND_HUB_DEVICE.parent_home_id).add_hub(SECOND_HUB_DEVICE)
+    ack_futures = _create_ack_futures(3)
+    command_client._tcp_manager.set_brightness.side_effect = ack_futures
+
+    first_result = await command_client.set_brightness(TEST_LIGHT, 10)
+    await asyncio.sleep(0)
+    await command_client.set_brightness(TEST_LIGHT, 20)
+    await asyncio.sleep(0.05)
+    assert command_client._tcp_manager.set_brightness.call_count == 2
+
+    ack_futures[0].set_exception(CommandTimeoutError())
+    with pytest.raises(CommandTimeoutError):
+        await first_result
+    await asyncio.sleep(0.01)
+
+    # Retrying the first command through the other hub would overwrite the newer brightness.
+    assert command_client._tcp_manager.set_brightness.call_count == 2
+    command_client._tcp_manager.set_brightness.assert_called_with(mocker.ANY, 7, 20)
+
+    ack_futures[1].set_result(None)
+
+
+@pytest.mark.asyncio
+async def test_command_superseded_after_slot_exits_is_not_retried(mocker):
+    command_client = _create_command_client(mocker, min_command_interval=0.01, command_fusion_window=0)
+    command_client._get_hub_pool(SECOND_HUB_DEVICE.parent_home_id).add_hub(SECOND_HUB_DEVICE)
+    ack_futures = _create_ack_futures(3)
+    command_client._tcp_manager.set_brightness.side_effect = ack_futures
+
+    first_result = await command_client.set_brightness(TEST_LIGHT, 10)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0.05)
+    assert not command_client._outbound_slots
+
+    await command_client.set_brightness(TEST_LIGHT, 20)
+    await asyncio.sleep(0.01)
+    assert command_client._tcp_manager.set_brightness.call_count == 2
+
+    ack_futures[0].set_exception(CommandTimeoutError())
+    with pytest.raises(CommandTimeoutError):
+        await first_result
+    await asyncio.sleep(0.01)
+
+    # The first command's slot is gone, but retrying it would still overwrite the newer brightness.
+    assert command_client._tcp_manager.set_brightness.call_count == 2
+    command_client._tcp_manager.set_brightness.assert_called_with(mocker.ANY, 7, 20)
+
+    ack_futures[1].set_result(None)
+
+
+def test_hub_pool_prefers_faster_hub():
+    hub_pool = HubPool(HUB_DEVICE.parent_home_id)
+    hub_pool.add_hub(HUB_DEVICE)
+    hub_pool.add_hub(SECOND_HUB_DEVICE)
+
+    for _ in range(5):
+        hub_pool.command_sent(HUB_DEVICE.device_id)
+        hub_pool.command_finished(HUB_DEVICE.device_id, 1.0)
+        hub_pool.command_sent(SECOND_HUB_DEVICE.device_id)
+        hub_pool.command_finished(SECOND_HUB_DEVICE.device_id, 0.01)
+
+    assert all(hub_pool.select_hub() is SECOND_HUB_DEVICE for _ in range(4))
+    assert hub_pool.select_hub({SECOND_HUB_DEVICE.device_id}) is HUB_DEVICE
+
+
+def test_hub_pool_avoids_unhealthy_hub():
+    hub_pool = HubPool(HUB_DEVICE.parent_home_id)
+    hub_pool.add_hub(HUB_DEVICE)
+    hub_pool.add_hub(SECOND_HUB_DEVICE)
+
+    for _ in range(3):
+        hub_pool.command_sent(HUB_DEVICE.device_id)
+        hub_pool.command_finished(HUB_DEVICE.device_id, None)
+
+    assert all(hub_pool.select_hub() is SECOND_HUB_DEVICE for _ in range(4))
+
+    hub_pool.remove_hub(SECOND_HUB_DEVICE.device_id)
+    assert hub_pool.select_hub() is HUB_DEVICE
+
+
+@pytest.mark.asyncio
+async def test_probe_response_adds_hub(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    command_client._hub_pools.clear()
+    mocker.patch("pycync.devices.device_storage.get_device_by_id", return_value=SECOND_HUB_DEVICE)
+
+    await command_client.on_message_received(
+        ParsedMessage(MessageType.PROBE.value, True, SECOND_HUB_DEVICE.device_id, b"", 3))
+
+    assert SECOND_HUB_DEVICE.device_id in command_client._hub_pools[SECOND_HUB_DEVICE.parent_home_id]
+
+
+@pytest.mark.asyncio
+async def test_commands_skip_topology_lookups(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    get_home_by_id = mocker.patch("pycync.devices.device_storage.get_home_by_id")
+    get_flattened_devices = mocker.patch("pycync.devices.device_storage.get_flattened_devices")
+    command_client._tcp_manager.set_brightness.side_effect = _create_ack_futures(1)
+
+    await command_client.set_brightness(TEST_LIGHT, 10)
+    await asyncio.sleep(0)
+
+    command_client._tcp_manager.set_brightness.assert_called_once_with(HUB_DEVICE, 7, 10)
+    get_home_by_id.assert_not_called()
+    get_flattened_devices.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_offline_hub_is_evicted(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    offline_hub = CyncLight(False, True, 1234, 4, 5432, "Hub", 137, DeviceType.LIGHT, "123456ABCDEF", "ID1", "Code")
+
+    await command_client.on_message_received(
+        ParsedMessage(MessageType.SYNC.value, False, HUB_DEVICE.device_id, {offline_hub.unique_id: offline_hub}, 3))
+
+    assert HUB_DEVICE.device_id not in command_client._hub_pools[HUB_DEVICE.parent_home_id]
+
+
+@pytest.mark.asyncio
+async def test_status_page_only_evicts_hubs_it_reports(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    other_home_hub = CyncLight(True, True, 4567, 9, 6543, "Other Hub", 137, DeviceType.LIGHT, "423456ABCDEF", "ID1",
+                               "Code")
+    command_client._get_hub_pool(other_home_hub.parent_home_id).add_hub(other_home_hub)
+    offline_hub = CyncLight(False, True, 1234, 4, 5432, "Hub", 137, DeviceType.LIGHT, "123456ABCDEF", "ID1", "Code")
+
+    await command_client.on_message_received(ParsedMessage(
+        MessageType.PIPE.value, False, HUB_DEVICE.device_id, {offline_hub.unique_id: offline_hub}, 3,
+        PipeCommandCode.QUERY_DEVICE_STATUS_PAGES.value,
+        changed_fields={offline_hub.unique_id: frozenset({"is_online"})}))
+
+    assert HUB_DEVICE.device_id not in command_client._hub_pools[HUB_DEVICE.parent_home_id]
+    assert other_home_hub.device_id in command_client._hub_pools[other_home_hub.parent_home_id]
+
+
+@pytest.mark.asyncio
+async def test_hub_reprobed_when_back_online(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    command_client._tcp_manager.connection_state = ConnectionState.READY
+    hub = CyncLight(False, True, 1234, 4, 5432, "Hub", 137, DeviceType.LIGHT, "123456ABCDEF", "ID1", "Code")
+    mocker.patch("pycync.devices.device_storage.get_device_by_id", return_value=hub)
+
+    await command_client.on_message_received(
+        ParsedMessage(MessageType.SYNC.value, False, hub.device_id, {hub.unique_id: hub}, 3))
+    assert hub.device_id not in command_client._hub_pools[hub.parent_home_id]
+
+    hub.is_online = True
+    await command_client.on_message_received(ParsedMessage(
+        MessageType.SYNC.value, False, hub.device_id, {hub.unique_id: hub}, 3,
+        changed_fields={hub.unique_id: frozenset({"is_online"})}))
+    await asyncio.sleep(0)
+    command_client._tcp_manager.probe_devices.assert_called_once_with([hub])
+
+    await command_client.on_message_received(ParsedMessage(MessageType.PROBE.value, True, hub.device_id, b"", 3))
+    assert hub.device_id in command_client._hub_pools[hub.parent_home_id]
+
+
+@pytest.mark.asyncio
+async def test_slow_update_callback_does_not_block_packets(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    release_callback = asyncio.Event()
+    delivered_updates = []
+
+    async def slow_callback(updated_data):
+        await release_callback.wait()
+        delivered_updates.append(updated_data)
+
+    mocker.patch("pycync.devices.device_storage.get_user_device_callback", return_value=slow_callback)
+
+    sync_message = ParsedMessage(MessageType.SYNC.value, False, HUB_DEVICE.device_id,
+                                 {TEST_LIGHT.unique_id: TEST_LIGHT}, 3)
+    await asyncio.wait_for(command_client.on_message_received(sync_message), 1)
+    assert delivered_updates == []
+
+    release_callback.set()
+    await command_client._callback_dispatcher.join()
+    assert delivered_updates == [{TEST_LIGHT.unique_id: TEST_LIGHT}]
+
+
+@pytest.mark.asyncio
+async def test_subscriptions_receive_only_their_devices(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+    subscriptions = SubscriptionRegistry()
+    light_updates = []
+    subscriptions.add(Subscription(light_updates.append, unique_ids=[TEST_LIGHT.unique_id]),
+                      [CyncHome("Home", HUB_DEVICE.parent_home_id, [], [HUB_DEVICE, TEST_LIGHT])])
+    mocker.patch("pycync.devices.device_storage.get_user_subscriptions", return_value=subscriptions)
+
+    await command_client.on_message_received(ParsedMessage(
+        MessageType.SYNC.value, False, HUB_DEVICE.device_id,
+        {HUB_DEVICE.unique_id: HUB_DEVICE, TEST_LIGHT.unique_id: TEST_LIGHT}, 3))
+    await command_client._callback_dispatcher.join()
+
+    assert light_updates == [{TEST_LIGHT.unique_id: TEST_LIGHT}]
+
+
+@pytest.mark.asyncio
+async def test_hubs_cleared_on_connection_loss(mocker):
+    command_client = _create_command_client(mocker, command_fusion_window=0)
+
+    command_client.on_connection_state_changed(ConnectionState.READY)
+    assert HUB_DEVICE.device_id in command_client._hub_pools[HUB_DEVICE.parent_home_id]
+
+    command_client.on_connection_state_changed(ConnectionState.RECONNECTING)
+    assert not command_client._hub_pools
+
+
+@pytest.mark.asyncio
+async def test_probe_waits_for_topology(mocker):
+    command_client = _create_command_client(mocker)
+    mocker.patch("pycync.devices.device_storage.get_flattened_devices", return_value=(TEST_LIGHT,))
+
+    await command_client.on_message_received(ParsedMessage(MessageType.LOGIN.value, True, None, None, 0))
+    await asyncio.sleep(0)
+    command_client._tcp_manager.probe_devices.assert_not_called()
+
+    command_client.mark_topology_ready()
+    await command_client._probe_task
+
+    command_client._tcp_manager.probe_devices.assert_called_once_with((TEST_LIGHT,))
+
+
+@pytest.mark.asyncio
+async def test_device_states_resynced_after_reconnect(mocker):
+    command_client = _create_command_client(mocker)
+    mocker.patch("pycync.tcp.command_client._RESYNC_PROBE_SETTLE_SECONDS", 0)
+    mocker.patch("pycync.devices.device_storage.get_user_homes",
+                 return_value=[CyncHome("Home", HUB_DEVICE.parent_home_id, [], [HUB_DEVICE])])
+
+    command_client.on_connection_state_changed(ConnectionState.LOGGED_IN)
+    assert command_client._resync_task is None
+
+    command_client.on_connection_state_changed(ConnectionState.RECONNECTING)
+    command_client.on_connection_state_changed(ConnectionState.LOGGED_IN)
+    command_client._get_hub_pool(HUB_DEVICE.parent_home_id).add_hub(HUB_DEVICE)
+    await command_client._resync_task
+
+    command_client._tcp_manager.update_mesh_devices.assert_called_once_with([HUB_DEVICE])
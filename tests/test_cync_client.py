@@ -1,3 +1,4 @@
+import asyncio
 import json
 import time
 from typing import List
@@ -9,6 +10,7 @@ from pycync.devices.device_types import DeviceType
 from unittest.mock import patch
 
 from pycync import User, Cync, CyncDevice, CyncHome, CyncRoom, CyncGroup
+from pycync.exceptions import AuthFailedError
 
 MOCKED_USER = User(
     "test_token",
@@ -95,3 +97,226 @@ async def test_refresh_home_info(auth_client, command_client):
     assert outlets[0].mesh_group_id == 1
     assert outlets[1].name == "Right Outlet"
     assert outlets[1].mesh_group_id == 2
+
+
+def _load_fixture(file_name: str):
+    with open(f"fixtures/{file_name}") as f:
+        return json.load(f)
+
+
+def _two_home_device_info():
+    device_info = _load_fixture("device_api_response.json")
+    second_home = dict(next(device for device in device_info if device.get("source") == 5))
+    second_home["id"] = 987654321
+    second_home["name"] = "Second Home"
+
+    return device_info + [second_home]
+
+
+@pytest.mark.asyncio
+async def test_refresh_home_info_fetches_homes_concurrently(auth_client, command_client):
+    device_info = _two_home_device_info()
+    in_flight_fetches = 0
+    max_in_flight_fetches = 0
+
+    async def responses(*args):
+        nonlocal in_flight_fetches, max_in_flight_fetches
+        if args[0].endswith("/subscribe/devices"):
+            return device_info
+
+        in_flight_fetches += 1
+        max_in_flight_fetches = max(max_in_flight_fetches, in_flight_fetches)
+        await asyncio.sleep(0.01)
+        in_flight_fetches -= 1
+        return _load_fixture("property_api_response.json")
+
+    auth_client._send_user_request.side_effect = responses
+
+    cync = Cync(auth_client)
+    failed_homes = await cync.refresh_home_info()
+
+    assert failed_homes == {}
+    assert max_in_flight_fetches == 2
+    homes = device_storage.get_user_homes(MOCKED_USER.user_id)
+    assert [home.home_id for home in homes] == [1234567890, 987654321]
+
+
+@pytest.mark.asyncio
+async def test_refresh_home_info_keeps_failed_home(auth_client, command_client):
+    device_info = _two_home_device_info()
+    fail_second_home = False
+
+    def responses(*args):
+        if args[0].endswith("/subscribe/devices"):
+            return device_info
+        if fail_second_home and "/987654321/" in args[0]:
+            raise ConnectionError("Request failed")
+        return _load_fixture("property_api_response.json")
+
+    auth_client._send_user_request.side_effect = responses
+
+    cync = Cync(auth_client)
+    await cync.refresh_home_info()
+    previous_second_home = device_storage.get_home_by_id(MOCKED_USER.user_id, 987654321)
+
+    fail_second_home = True
+    failed_homes = await cync.refresh_home_info()
+
+    assert list(failed_homes.keys()) == [987654321]
+    assert isinstance(failed_homes[987654321], ConnectionError)
+    homes = device_storage.get_user_homes(MOCKED_USER.user_id)
+    assert [home.home_id for home in homes] == [1234567890, 987654321]
+    assert homes[1] is previous_second_home
+
+
+@pytest.mark.asyncio
+async def test_refresh_home_info_omits_home_never_loaded(auth_client, command_client):
+    device_info = _two_home_device_info()
+
+    def responses(*args):
+        if args[0].endswith("/subscribe/devices"):
+            return device_info
+        if "/987654321/" in args[0]:
+            raise ConnectionError("Request failed")
+        return _load_fixture("property_api_response.json")
+
+    auth_client._send_user_request.side_effect = responses
+    device_storage.set_user_homes(MOCKED_USER.user_id, [])
+
+    cync = Cync(auth_client)
+    failed_homes = await cync.refresh_home_info()
+
+    assert list(failed_homes.keys()) == [987654321]
+    assert isinstance(failed_homes[987654321], ConnectionError)
+    homes = device_storage.get_user_homes(MOCKED_USER.user_id)
+    assert [home.home_id for home in homes] == [1234567890]
+
+
+@pytest.mark.asyncio
+async def test_refresh_home_info_raises_when_no_home_loaded(auth_client, command_client):
+    device_info = _two_home_device_info()
+
+    def responses(*args):
+        if args[0].endswith("/subscribe/devices"):
+            return device_info
+        raise ConnectionError("Request failed")
+
+    auth_client._send_user_request.side_effect = responses
+    device_storage.set_user_homes(MOCKED_USER.user_id, [])
+
+    cync = Cync(auth_client)
+    with pytest.raises(ConnectionError):
+        await cync.refresh_home_info()
+
+
+@pytest.mark.asyncio
+async def test_refresh_home_info_raises_auth_failure(auth_client, command_client):
+    device_info = _two_home_device_info()
+    fail_second_home = False
+
+    def responses(*args):
+        if args[0].endswith("/subscribe/devices"):
+            return device_info
+        if fail_second_home and "/987654321/" in args[0]:
+            raise AuthFailedError("Refresh token failed")
+        return _load_fixture("property_api_response.json")
+
+    auth_client._send_user_request.side_effect = responses
+
+    cync = Cync(auth_client)
+    await cync.refresh_home_info()
+
+    fail_second_home = True
+    with pytest.raises(AuthFailedError):
+        await cync.refresh_home_info()
+
+
+@pytest.mark.asyncio
+async def test_refresh_home_info_reuses_existing_devices(auth_client, command_client):
+    auth_client._send_user_request.side_effect = home_info_responses
+    device_storage.set_user_homes(MOCKED_USER.user_id, [])
+    topology_changes = []
+
+    cync = Cync(auth_client)
+    cync.set_topology_callback(topology_changes.append)
+
+    await cync.refresh_home_info()
+    devices = cync.get_devices()
+    await cync.refresh_home_info()
+
+    assert len(topology_changes) == 1
+    assert len(topology_changes[0].added) > 0
+    assert all(refreshed is current for refreshed, current in zip(cync.get_devices(), devices))
+
+
+@pytest.mark.asyncio
+async def test_create_with_topology_cache_starts_before_refresh(auth_client, command_client, tmp_path):
+    cache_path = str(tmp_path / "topology.json")
+    auth_client._send_user_request.side_effect = home_info_responses
+    first_cync = await Cync.create(auth_client, topology_cache_path=cache_path)
+    cached_device_ids = [device.device_id for device in first_cync.get_devices()]
+    device_storage.set_user_homes(MOCKED_USER.user_id, [])
+
+    refresh_allowed = asyncio.Event()
+
+    async def delayed_responses(*args):
+        await refresh_allowed.wait()
+        return home_info_responses(*args)
+
+    auth_client._send_user_request.side_effect = delayed_responses
+    command_client.start_connection.reset_mock()
+
+    cync = await Cync.create(auth_client, topology_cache_path=cache_path)
+
+    command_client.start_connection.assert_called_once()
+    assert [device.device_id for device in cync.get_devices()] == cached_device_ids
+    cached_devices = cync.get_devices()
+
+    refresh_allowed.set()
+    await cync._background_refresh
+
+    assert all(refreshed is cached for refreshed, cached in zip(cync.get_devices(), cached_devices))
+
+
+@pytest.mark.asyncio
+async def test_create_connects_while_refreshing(auth_client, command_client):
+    refresh_allowed = asyncio.Event()
+
+    async def delayed_responses(*args):
+        await refresh_allowed.wait()
+        return home_info_responses(*args)
+
+    auth_client._send_user_request.side_effect = delayed_responses
+    command_client.start_connection.reset_mock()
+    command_client.mark_topology_ready.reset_mock()
+
+    create_task = asyncio.create_task(Cync.create(auth_client))
+    await asyncio.sleep(0)
+
+    command_client.start_connection.assert_called_once()
+    command_client.mark_topology_ready.assert_not_called()
+
+    refresh_allowed.set()
+    cync = await create_task
+
+    command_client.mark_topology_ready.assert_called_once()
+    assert "topology_refresh" in cync._startup_timings
+
+
+@pytest.mark.asyncio
+async def test_state_changes_stream_closed_on_shut_down(auth_client, command_client):
+    auth_client._send_user_request.side_effect = home_info_responses
+    cync = await Cync.create(auth_client)
+    bedroom = next(room for room in cync.get_homes()[0].rooms if room.name == "Bedroom")
+    bedroom_lamp = bedroom.devices[0]
+
+    stream = cync.state_changes(rooms=[bedroom])
+    subscriptions = device_storage.get_user_subscriptions(MOCKED_USER.user_id)
+    for subscription, subscription_data in subscriptions.route({device.unique_id: device
+                                                                 for device in cync.get_devices()}):
+        subscription.callback(subscription_data)
+
+    await cync.shut_down()
+
+    assert [state_change.device async for state_change in stream] == [bedroom_lamp]
+    assert len(subscriptions) == 0
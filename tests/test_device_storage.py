@@ -133,4 +133,46 @@ def test_get_devices_in_associated_home():
     assert not set(home_1_test_2).difference(set(home_1_devices))
     assert not set(home_1_test_3).difference(set(home_1_devices))
     assert not set(home_2_test_1).difference(set(home_2_devices))
-    assert not set(home_2_test_2).difference(set(home_2_devices))
\ No newline at end of file
+    assert not set(home_2_test_2).difference(set(home_2_devices))
+
+def test_get_associated_home_mesh_devices():
+    device_storage.set_user_homes(TEST_USER_ID, [home_1, home_2])
+
+    home_1_mesh_devices = device_storage.get_associated_home_mesh_devices(TEST_USER_ID, home_1_room_1_device_1.device_id)
+    home_2_mesh_devices = device_storage.get_associated_home_mesh_devices(TEST_USER_ID, home_2_device_2.device_id)
+
+    assert home_1_mesh_devices[2] == [home_1_room_1_group_1_device_1]
+    assert home_1_mesh_devices[5] == [home_1_room_2_device_1]
+    assert 6 not in home_1_mesh_devices
+    assert home_2_mesh_devices[6] == [home_2_room_1_device_1]
+    assert home_2_mesh_devices[9] == [home_2_device_2]
+
+def test_topology_index_rebuilt_on_set():
+    device_storage.set_user_homes(TEST_USER_ID, [home_1])
+
+    with pytest.raises(CyncError,
+                       match=f'Device ID {home_2_device_1.device_id} not found on user account {TEST_USER_ID}.'):
+        device_storage.get_device_by_id(TEST_USER_ID, home_2_device_1.device_id)
+
+    device_storage.set_user_homes(TEST_USER_ID, [home_1, home_2])
+
+    assert device_storage.get_device_by_id(TEST_USER_ID, home_2_device_1.device_id) == home_2_device_1
+    assert device_storage.get_associated_home(TEST_USER_ID, home_2_device_1.device_id) == home_2
+
+def test_get_home_by_id():
+    device_storage.set_user_homes(TEST_USER_ID, [home_1, home_2])
+
+    assert device_storage.get_home_by_id(TEST_USER_ID, 1234) == home_1
+    assert device_storage.get_home_by_id(TEST_USER_ID, 2345) == home_2
+
+    with pytest.raises(CyncError, match=f'Home ID 9876 not found on user account {TEST_USER_ID}.'):
+        device_storage.get_home_by_id(TEST_USER_ID, 9876)
+
+def test_get_device_by_unique_id():
+    device_storage.set_user_homes(TEST_USER_ID, [home_1, home_2])
+
+    assert device_storage.get_device_by_unique_id(TEST_USER_ID, "1234-3") == home_1_room_1_group_1_device_2
+    assert device_storage.get_device_by_unique_id(TEST_USER_ID, "2345-8") == home_2_device_1
+
+    with pytest.raises(CyncError, match=f'Device 2345-3 not found on user account {TEST_USER_ID}.'):
+        device_storage.get_device_by_unique_id(TEST_USER_ID, "2345-3")
@@ -0,0 +1,73 @@
+from pycync import CyncHome, CyncDevice, CyncGroup, CyncRoom
+from pycync.devices.device_types import DeviceType
+
+HOME_ID = 1234
+
+
+def _create_device(device_id: int, mesh_id: int) -> CyncDevice:
+    return CyncDevice(True, True, device_id, mesh_id, HOME_ID, f"Device {device_id}", 224, DeviceType.LIGHT,
+                      "123456ABCDEF", "ID1", "Code")
+
+
+def test_flattened_device_list_is_cached():
+    group_device = _create_device(12, 2)
+    room_device = _create_device(23, 3)
+    global_device = _create_device(34, 4)
+
+    group = CyncGroup("Group 1", 1, HOME_ID, [group_device])
+    room = CyncRoom("Room 1", 2, HOME_ID, [group], [room_device])
+    home = CyncHome("Home 1", HOME_ID, [room], [global_device])
+
+    flattened_devices = home.get_flattened_device_list()
+
+    assert flattened_devices == (global_device, room_device, group_device)
+    assert home.get_flattened_device_list() is flattened_devices
+
+
+def test_flattened_device_list_rebuilt_on_assignment():
+    room_device = _create_device(23, 3)
+    new_room_device = _create_device(45, 5)
+    new_group_device = _create_device(56, 6)
+
+    group = CyncGroup("Group 1", 1, HOME_ID, [])
+    room = CyncRoom("Room 1", 2, HOME_ID, [group], [room_device])
+    home = CyncHome("Home 1", HOME_ID, [room], [])
+
+    assert home.get_flattened_device_list() == (room_device,)
+
+    room.devices = [room_device, new_room_device]
+    assert home.get_flattened_device_list() == (room_device, new_room_device)
+
+    group.devices = [new_group_device]
+    assert home.get_flattened_device_list() == (room_device, new_room_device, new_group_device)
+
+    home.rooms = []
+    assert home.get_flattened_device_list() == ()
+
+
+def test_flattened_device_list_rebuilt_on_mutation():
+    room_device = _create_device(23, 3)
+    new_group_device = _create_device(56, 6)
+    global_device = _create_device(34, 4)
+
+    group = CyncGroup("Group 1", 1, HOME_ID, [])
+    room = CyncRoom("Room 1", 2, HOME_ID, [group], [room_device])
+    home = CyncHome("Home 1", HOME_ID, [room], [])
+
+    assert home.get_flattened_device_list() == (room_device,)
+
+    group.devices.append(new_group_device)
+    assert home.get_flattened_device_list() == (room_device, new_group_device)
+
+    home.global_devices += [global_device]
+    assert home.get_flattened_device_list() == (global_device, room_device, new_group_device)
+
+    del room.devices[0]
+    assert home.get_flattened_device_list() == (global_device, new_group_device)
+
+    new_room = CyncRoom("Room 2", 3, HOME_ID, [], [room_device])
+    home.rooms.append(new_room)
+    assert home.get_flattened_device_list() == (global_device, new_group_device, room_device)
+
+    new_room.devices.clear()
+    assert home.get_flattened_device_list() == (global_device, new_group_device)
@@ -3,12 +3,17 @@ import pytest
 from pycync import CyncLight
 from pycync.devices.device_types import DeviceType
 from pycync.devices.devices import CyncPlug
+from pycync.devices import device_storage
 from pycync.devices.groups import CyncHome
 from pycync.tcp import packet_parser
 from pycync.tcp.packet import MessageType, PipeCommandCode
 from tests import TEST_USER_ID
 
-TEST_HOME = CyncHome("test_home", 5432, [], [])
+TEST_HOME_ID = 5432
+
+def _mock_home_devices(mocker, devices):
+    test_home = CyncHome("test_home", TEST_HOME_ID, [], devices)
+    mocker.patch.dict(device_storage._user_homes, {TEST_USER_ID: device_storage.UserHomes([test_home])})
 
 def test_login_packet():
     login_response = bytearray.fromhex("18000000020000")
@@ -48,7 +53,7 @@ def test_pipe_packet(mocker):
         device_4567,
         device_5678
     ]
-    mocker.patch("pycync.devices.device_storage.get_associated_home_devices", return_value=mocked_devices)
+    _mock_home_devices(mocker, mocked_devices)
 
     pipe_response = bytearray.fromhex("730000009100000d8002e5007e01010000f9527d5e000500000005000400890100008901010000005000000039000000d796ff0007000001000000010000000000000000fe000000f8383000020000010000000101000000410000001e00000000000000e800000100000001010000005000000039000000000000001e0000010000000101000000500000003900000000000000d17e")
     parsed_message = packet_parser.parse_packet(pipe_response, TEST_USER_ID)
@@ -74,7 +79,7 @@ def test_thermostat_sync_packet(mocker):
     mocked_devices = [
         device_3456
     ]
-    mocker.patch("pycync.devices.device_storage.get_associated_home_devices", return_value=mocked_devices)
+    _mock_home_devices(mocker, mocked_devices)
 
     pipe_response = bytearray.fromhex("430000026700000d8001010657925d73656e736f7273446174613a5b7b2254797065223a22696e7465726e616c222c2254656d7065726174757265223a2237352e3946222c2248756d6964697479223a35302c22416374697665223a747275657d2c7b2254797065223a22736176616e742073656e736f72222c2250696e436f6465223a353332342c2254656d7065726174757265223a2237352e3746222c2248756d6964697479223a34382c22416374697665223a66616c73652c2242617474223a22322e3837227d2c7b2254797065223a22736176616e742073656e736f72222c2250696e436f6465223a353134302c2254656d7065726174757265223a2237352e3246222c2248756d6964697479223a35302c22416374697665223a66616c73652c2242617474223a22322e3930227d2c7b2254797065223a224e6f6e65222c2254656d7065726174757265223a6e756c6c2c2248756d6964697479223a6e756c6c2c22416374697665223a66616c73652c2242617474223a6e756c6c7d2c7b2254797065223a224e6f6e65222c2254656d7065726174757265223a6e756c6c2c2248756d6964697479223a6e756c6c2c22416374697665223a66616c73652c2242617474223a6e756c6c7d2c7b2254797065223a224e6f6e65222c2254656d7065726174757265223a6e756c6c2c2248756d6964697479223a6e756c6c2c22416374697665223a66616c73652c2242617474223a6e756c6c7d2c7b2254797065223a224e6f6e65222c2254656d7065726174757265223a6e756c6c2c2248756d6964697479223a6e756c6c2c22416374697665223a66616c73652c2242617474223a6e756c6c7d5d")
 
@@ -87,7 +92,7 @@ def test_light_sync_packet(mocker):
     mocked_devices = [
         device_2345
     ]
-    mocker.patch("pycync.devices.device_storage.get_associated_home_devices", return_value=mocked_devices)
+    _mock_home_devices(mocker, mocked_devices)
 
     pipe_response = bytearray.fromhex("430000001a0000092901010606001007014cfef8383001141e000000000000")
     parsed_message = packet_parser.parse_packet(pipe_response, TEST_USER_ID)
@@ -103,13 +108,44 @@ def test_light_sync_packet(mocker):
     assert parsed_message.command_code is None
     assert parsed_message.data == expected_device_data
 
+def test_sync_packet_reports_only_changes(mocker):
+    device_2345 = CyncLight(True, True, 2345, 7, 5432, "Device 2", 137, DeviceType.LIGHT, "223456ABCDEF", "ID1","Code")
+    _mock_home_devices(mocker, [device_2345])
+
+    sync_response = bytearray.fromhex("430000001a0000092901010606001007014cfef8383001141e000000000000")
+    first_message = packet_parser.parse_packet(sync_response, TEST_USER_ID)
+    repeated_message = packet_parser.parse_packet(sync_response, TEST_USER_ID)
+
+    assert first_message.changed_fields == {"5432-7": frozenset({"is_on", "brightness", "color_temp", "rgb"})}
+    assert repeated_message.data == {}
+    assert repeated_message.changed_fields == {}
+
+def test_status_page_marks_unreported_devices_offline(mocker):
+    reported_devices = [
+        CyncLight(True, True, device_id, mesh_id, 5432, "Device", 137, DeviceType.LIGHT, "123456ABCDEF", "ID1", "Code")
+        for device_id, mesh_id in [(1234, 4), (2345, 7), (3456, 2), (4567, 232), (5678, 30)]
+    ]
+    unreported_device = CyncLight(True, True, 6789, 99, 5432, "Device 6", 137, DeviceType.LIGHT, "623456ABCDEF", "ID1",
+                                  "Code")
+    _mock_home_devices(mocker, reported_devices + [unreported_device])
+
+    pipe_response = bytearray.fromhex("730000009100000d8002e5007e01010000f9527d5e000500000005000400890100008901010000005000000039000000d796ff0007000001000000010000000000000000fe000000f8383000020000010000000101000000410000001e00000000000000e800000100000001010000005000000039000000000000001e0000010000000101000000500000003900000000000000d17e")
+    first_message = packet_parser.parse_packet(pipe_response, TEST_USER_ID)
+    repeated_message = packet_parser.parse_packet(pipe_response, TEST_USER_ID)
+
+    assert unreported_device.is_online is False
+    assert first_message.data["5432-99"] is unreported_device
+    assert first_message.changed_fields["5432-99"] == frozenset({"is_online"})
+    assert repeated_message.command_code == PipeCommandCode.QUERY_DEVICE_STATUS_PAGES.value
+    assert repeated_message.data == {}
+
 def test_bad_checksum(mocker):
     device_3456 = CyncLight(True, True, 3456, 2, 5432, "Device 3", 224, DeviceType.LIGHT, "323456ABCDEF", "ID1","Code")
 
     mocked_devices = [
         device_3456
     ]
-    mocker.patch("pycync.devices.device_storage.get_associated_home_devices", return_value=mocked_devices)
+    _mock_home_devices(mocker, mocked_devices)
 
     pipe_response = bytearray.fromhex("730000009100000d8002e5007e01010000f9527d5e000500000005000400890100008901010000005000000039000000d796ff0007000001000000010000000000000000fe000000f8383000020000010000000101000000410000001e00000000000000e800000100000001010000005000000039000000000000001e0000010000000101000000500000003900000000000000127e")
 
@@ -121,7 +157,7 @@ def test_outdoor_plug_sync_packet(mocker):
     left_outlet = CyncPlug(True, True, 1234, 1006, 5432, "Left Outlet", 67, DeviceType.PLUG, "654321FEDCBA", "ID1", "Code")
     right_outlet = CyncPlug(True, True, 1234, 2006, 5432, "Right Outlet", 67, DeviceType.PLUG, "654321ABCDEF", "ID1", "Code")
 
-    mocker.patch("pycync.devices.device_storage.get_associated_home_devices", return_value=[left_outlet, right_outlet])
+    _mock_home_devices(mocker, [left_outlet, right_outlet])
 
     # Packet: device_id=1234, marker 010106, one entry: mesh_id=6, is_on=1, outlet_indicator=2 (right outlet on)
     sync_response = bytearray.fromhex("4300000011000004d201010600000706010200000000")
@@ -136,3 +172,80 @@ def test_incorrect_length():
     pipe_response = bytearray.fromhex("430000001c0000092901010606001007014cfef8383001141e000000000000")
     with pytest.raises(ValueError, match='Provided packet length did not match actual packet length. Expected: 28, got: 26'):
         packet_parser.parse_packet(pipe_response, TEST_USER_ID)
+
+def test_multiple_light_sync_packet(mocker):
+    device_2345 = CyncLight(True, True, 2345, 7, 5432, "Device 2", 137, DeviceType.LIGHT, "223456ABCDEF", "ID1","Code")
+    device_3456 = CyncLight(True, True, 3456, 8, 5432, "Device 3", 137, DeviceType.LIGHT, "323456ABCDEF", "ID1","Code")
+
+    mocked_devices = [
+        device_2345,
+        device_3456
+    ]
+    _mock_home_devices(mocker, mocked_devices)
+
+    sync_response = bytearray.fromhex("430000002d00000929010106"
+                                      "06001007014cfef8383001141e000000000000"
+                                      "0600100800200a010203000000000000000000")
+    parsed_message = packet_parser.parse_packet(sync_response, TEST_USER_ID)
+
+    expected_device_data = {
+        "5432-7": device_2345,
+        "5432-8": device_3456
+    }
+
+    assert parsed_message.data == expected_device_data
+    assert device_2345.is_on is True
+    assert device_2345.brightness == 0x4c
+    assert device_3456.is_on is False
+    assert device_3456.brightness == 0x20
+    assert device_3456.color_temp == 10
+    assert device_3456.rgb == (1, 2, 3)
+
+def test_memoryview_packet():
+    probe_response = bytearray.fromhex("ab0000000c499602d2736f6d6564617461")
+    with memoryview(probe_response) as probe_view:
+        parsed_message = packet_parser.parse_packet(probe_view, TEST_USER_ID)
+
+    # The parsed message must not hold on to the caller's buffer
+    probe_response.clear()
+
+    assert parsed_message.message_type == MessageType.PROBE.value
+    assert parsed_message.device_id == 1234567890
+    assert parsed_message.data == b"somedata"
+
+def test_pipe_ack_packet():
+    ack_response = bytearray.fromhex("7b0000000700005ba0002a00")
+    parsed_message = packet_parser.parse_packet(ack_response, TEST_USER_ID)
+
+    assert parsed_message.message_type == MessageType.PIPE.value
+    assert parsed_message.is_response is True
+    assert parsed_message.device_id == 23456
+    assert parsed_message.packet_counter == 42
+    assert parsed_message.command_code is None
+    assert parsed_message.data is None
+
+def test_ping_response_packet():
+    ping_response = bytearray.fromhex("d800000000")
+    parsed_message = packet_parser.parse_packet(ping_response, TEST_USER_ID)
+
+    assert parsed_message.message_type == MessageType.PING.value
+    assert parsed_message.is_response is True
+    assert parsed_message.device_id is None
+    assert parsed_message.data is None
+
+def test_parse_request_identifiers():
+    power_state_request_packet = bytearray.fromhex("730000001f00005ba0002a007e01010000f8d00d0001010000000500d01102010000c87e")
+
+    packet_counter, inner_sequence = packet_parser.parse_request_identifiers(power_state_request_packet)
+
+    assert packet_counter == 42
+    assert inner_sequence == 257
+
+def test_parse_request_identifiers_encoded_sequence():
+    # Sequence number 0x7e01 contains a 7e byte, which is encoded as 7d5e within the inner frame
+    power_state_request_packet = bytearray.fromhex("730000002100005ba00001007e017d5e0000f8d00d00017d5e0000000500d01102010000457e")
+
+    packet_counter, inner_sequence = packet_parser.parse_request_identifiers(power_state_request_packet)
+
+    assert packet_counter == 1
+    assert inner_sequence == 0x7e01
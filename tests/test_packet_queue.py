@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from pycync.tcp.packet import MessageType, ParsedMessage
+from pycync.tcp.packet_queue import InboundPacketQueue
+
+
+def _sync_message(*unique_ids: str) -> ParsedMessage:
+    return ParsedMessage(MessageType.SYNC.value, False, 1234, {unique_id: object() for unique_id in unique_ids}, 3)
+
+
+def _probe_message() -> ParsedMessage:
+    return ParsedMessage(MessageType.PROBE.value, True, 1234, b"", 3)
+
+
+def test_pending_sync_devices_are_merged():
+    packet_queue = InboundPacketQueue()
+    first_sync = _sync_message("1-1", "1-2")
+    probe = _probe_message()
+
+    packet_queue.put_nowait(first_sync)
+    packet_queue.put_nowait(probe)
+    packet_queue.put_nowait(_sync_message("1-2"))
+    packet_queue.put_nowait(_sync_message("1-1", "1-3"))
+
+    assert len(packet_queue) == 3
+    assert packet_queue.get_nowait() is first_sync
+    assert packet_queue.get_nowait() is probe
+    assert list(packet_queue.get_nowait().data) == ["1-3"]
+
+    # Once a device's update has been taken, its next update is queued again.
+    packet_queue.put_nowait(_sync_message("1-1"))
+    assert list(packet_queue.get_nowait().data) == ["1-1"]
+
+
+def test_merged_sync_devices_keep_changed_fields():
+    packet_queue = InboundPacketQueue()
+    first_sync = _sync_message("1-1")
+    first_sync.changed_fields = {"1-1": frozenset({"is_on"})}
+    second_sync = _sync_message("1-1")
+    second_sync.changed_fields = {"1-1": frozenset({"brightness"})}
+
+    packet_queue.put_nowait(first_sync)
+    packet_queue.put_nowait(second_sync)
+
+    assert len(packet_queue) == 1
+    assert packet_queue.get_nowait().changed_fields == {"1-1": frozenset({"is_on", "brightness"})}
+
+
+def test_reading_paused_at_high_water_mark(mocker):
+    packet_queue = InboundPacketQueue(high_water_mark=3, low_water_mark=1)
+    transport = mocker.Mock()
+    packet_queue.set_transport(transport)
+
+    for _ in range(4):
+        packet_queue.put_nowait(_probe_message())
+    transport.pause_reading.assert_called_once()
+
+    packet_queue.get_nowait()
+    packet_queue.get_nowait()
+    transport.resume_reading.assert_not_called()
+
+    packet_queue.get_nowait()
+    transport.resume_reading.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_get_waits_for_packet():
+    packet_queue = InboundPacketQueue()
+    probe = _probe_message()
+
+    waiting_get = asyncio.create_task(packet_queue.get())
+    await asyncio.sleep(0)
+    assert not waiting_get.done()
+
+    packet_queue.put_nowait(probe)
+    assert await asyncio.wait_for(waiting_get, 1) is probe
+
+
+@pytest.mark.asyncio
+async def test_shutdown_drains_then_raises():
+    packet_queue = InboundPacketQueue()
+    probe = _probe_message()
+    packet_queue.put_nowait(probe)
+
+    waiting_get = asyncio.create_task(packet_queue.get())
+    await asyncio.sleep(0)
+    packet_queue.shutdown()
+
+    assert await waiting_get is probe
+    with pytest.raises(asyncio.QueueShutDown):
+        packet_queue.put_nowait(_probe_message())
+    with pytest.raises(asyncio.QueueShutDown):
+        await asyncio.wait_for(packet_queue.get(), 1)
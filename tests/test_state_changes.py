@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from pycync import CyncLight
+from pycync.devices.device_types import DeviceType
+from pycync.devices.state_changes import OverflowPolicy, StateChangeStream
+
+FIRST_LIGHT = CyncLight(True, True, 12, 2, 1234, "Light 1", 137, DeviceType.LIGHT, "123456ABCDEF", "ID1", "Code")
+SECOND_LIGHT = CyncLight(True, True, 23, 3, 1234, "Light 2", 137, DeviceType.LIGHT, "223456ABCDEF", "ID1", "Code")
+THIRD_LIGHT = CyncLight(True, True, 34, 4, 1234, "Light 3", 137, DeviceType.LIGHT, "323456ABCDEF", "ID1", "Code")
+
+
+def _update(*devices: CyncLight) -> dict[str, CyncLight]:
+    return {device.unique_id: device for device in devices}
+
+
+async def _read_buffered(stream: StateChangeStream) -> list[str]:
+    stream.close()
+    return [state_change.unique_id async for state_change in stream]
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_keeps_newest_changes():
+    stream = StateChangeStream(max_buffered_changes=2, overflow_policy=OverflowPolicy.DROP_OLDEST)
+
+    stream.push(_update(FIRST_LIGHT, SECOND_LIGHT))
+    stream.push(_update(FIRST_LIGHT))
+
+    assert await _read_buffered(stream) == [SECOND_LIGHT.unique_id, FIRST_LIGHT.unique_id]
+    assert stream.dropped_changes == 1
+
+
+@pytest.mark.asyncio
+async def test_coalesce_buffers_each_device_once():
+    stream = StateChangeStream(max_buffered_changes=2, overflow_policy=OverflowPolicy.COALESCE)
+
+    stream.push(_update(FIRST_LIGHT, SECOND_LIGHT))
+    stream.push(_update(SECOND_LIGHT, FIRST_LIGHT))
+    assert stream.dropped_changes == 0
+
+    stream.push(_update(THIRD_LIGHT))
+
+    assert await _read_buffered(stream) == [SECOND_LIGHT.unique_id, THIRD_LIGHT.unique_id]
+    assert stream.dropped_changes == 1
+
+
+@pytest.mark.asyncio
+async def test_consumer_waits_for_changes_until_closed():
+    on_close = []
+    received_changes = []
+
+    async def consume(stream: StateChangeStream):
+        async for state_change in stream:
+            received_changes.append(state_change.device)
+
+    async with StateChangeStream(on_close=lambda: on_close.append(True)) as stream:
+        consumer = asyncio.create_task(consume(stream))
+        await asyncio.sleep(0)
+
+        stream.push(_update(FIRST_LIGHT))
+        await asyncio.sleep(0)
+        assert received_changes == [FIRST_LIGHT]
+        assert not consumer.done()
+
+    await asyncio.wait_for(consumer, 1)
+    assert on_close == [True]
+
+    stream.push(_update(SECOND_LIGHT))
+    assert received_changes == [FIRST_LIGHT]
+
+
+@pytest.mark.asyncio
+async def test_coalesced_changes_merge_changed_fields():
+    stream = StateChangeStream()
+
+    stream.push(_update(FIRST_LIGHT), {FIRST_LIGHT.unique_id: frozenset({"is_on"})})
+    stream.push(_update(FIRST_LIGHT), {FIRST_LIGHT.unique_id: frozenset({"brightness"})})
+    stream.close()
+
+    state_changes = [state_change async for state_change in stream]
+    assert len(state_changes) == 1
+    assert state_changes[0].changed_fields == frozenset({"is_on", "brightness"})
@@ -0,0 +1,66 @@
+from pycync import CyncHome, CyncLight, CyncGroup, CyncRoom
+from pycync.devices import device_storage
+from pycync.devices.capabilities import CyncCapability
+from pycync.devices.device_types import DeviceType
+from pycync.devices.subscriptions import Subscription, SubscriptionRegistry
+from tests import TEST_USER_ID
+
+HOME_ID = 1234
+
+group_light = CyncLight(True, True, 12, 2, HOME_ID, "Group Light", 137, DeviceType.LIGHT, "123456ABCDEF", "ID1", "Code")
+room_light = CyncLight(True, True, 23, 3, HOME_ID, "Room Light", 137, DeviceType.LIGHT, "223456ABCDEF", "ID1", "Code")
+white_light = CyncLight(True, True, 34, 4, HOME_ID, "White Light", 128, DeviceType.LIGHT, "323456ABCDEF", "ID1",
+                        "Code")
+global_light = CyncLight(True, True, 45, 5, HOME_ID, "Global Light", 137, DeviceType.LIGHT, "423456ABCDEF", "ID1",
+                         "Code")
+
+group = CyncGroup("Group", 11, HOME_ID, [group_light])
+room = CyncRoom("Room", 1, HOME_ID, [group], [room_light, white_light])
+home = CyncHome("Home", HOME_ID, [room], [global_light])
+
+
+def _resolve(**kwargs) -> set[str]:
+    return Subscription(print, **kwargs).resolve([home])
+
+
+def test_subscription_resolves_matching_devices():
+    assert _resolve(unique_ids=[global_light.unique_id]) == {global_light.unique_id}
+    assert _resolve(groups=[group]) == {group_light.unique_id}
+    assert _resolve(rooms=[room]) == {group_light.unique_id, room_light.unique_id, white_light.unique_id}
+    assert _resolve(homes=[home]) == {device.unique_id for device in home.get_flattened_device_list()}
+    assert _resolve(rooms=[room], capabilities=[CyncCapability.RGB_COLOR]) == {group_light.unique_id,
+                                                                             room_light.unique_id}
+    assert _resolve(capabilities=[CyncCapability.RGB_COLOR]) == {group_light.unique_id, room_light.unique_id,
+                                                                 global_light.unique_id}
+
+
+def test_updates_routed_to_interested_subscriptions():
+    registry = SubscriptionRegistry()
+    room_subscription = Subscription(print, rooms=[room])
+    light_subscription = Subscription(repr, unique_ids=[global_light.unique_id])
+    registry.add(room_subscription, [home])
+    registry.add(light_subscription, [home])
+
+    routed_updates = registry.route({room_light.unique_id: room_light, global_light.unique_id: global_light})
+    assert routed_updates == [
+        (room_subscription, {room_light.unique_id: room_light}),
+        (light_subscription, {global_light.unique_id: global_light})
+    ]
+
+    registry.remove(room_subscription)
+    assert registry.route({room_light.unique_id: room_light}) == []
+
+
+def test_subscriptions_resolved_again_when_homes_change(mocker):
+    mocker.patch.dict(device_storage._user_homes, clear=True)
+    new_light = CyncLight(True, True, 56, 6, HOME_ID, "New Light", 137, DeviceType.LIGHT, "523456ABCDEF", "ID1", "Code")
+    refreshed_room = CyncRoom("Room", 1, HOME_ID, [], [new_light])
+    device_storage.set_user_homes(TEST_USER_ID, [home])
+    room_subscription = Subscription(print, rooms=[room])
+    device_storage.add_user_subscription(TEST_USER_ID, room_subscription)
+
+    device_storage.set_user_homes(TEST_USER_ID, [CyncHome("Home", HOME_ID, [refreshed_room], [])])
+
+    subscriptions = device_storage.get_user_subscriptions(TEST_USER_ID)
+    assert subscriptions.route({room_light.unique_id: room_light}) == []
+    assert subscriptions.route({new_light.unique_id: new_light}) == [(room_subscription, {new_light.unique_id: new_light})]
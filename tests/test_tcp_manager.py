@@ -0,0 +1,488 @@
+import asyncio
+import ssl
+import time
+
+import pytest
+
+from pycync import User, CyncDevice
+from pycync.devices.device_types import DeviceType
+from pycync.exceptions import CommandTimeoutError, CyncError
+from pycync.tcp.packet import MessageType, ParsedMessage
+from pycync.tcp import tcp_manager as tcp_manager_module
+from pycync.tcp.packet_queue import InboundPacketQueue
+from pycync.tcp.tcp_manager import (CyncTcpProtocol, ConnectionState, TcpManager, ConnectionClosedError,
+                                    ServerDisconnectedError)
+from tests import TEST_USER_ID
+
+TEST_USER = User("test_token", "test_refresh_token", "test_authorize_string", TEST_USER_ID, expire_in=3600)
+
+LOGIN_RESPONSE = bytes.fromhex("18000000020000")
+PROBE_RESPONSE = bytes.fromhex("ab0000000c499602d2736f6d6564617461")
+
+
+def _create_protocol() -> tuple[CyncTcpProtocol, InboundPacketQueue]:
+    packet_queue = InboundPacketQueue()
+    protocol = CyncTcpProtocol(packet_queue, TEST_USER)
+
+    return protocol, packet_queue
+
+
+def _drain(packet_queue: InboundPacketQueue) -> list:
+    parsed_packets = []
+    while not packet_queue.empty():
+        parsed_packets.append(packet_queue.get_nowait())
+
+    return parsed_packets
+
+
+def test_multiple_frames_in_one_read():
+    protocol, packet_queue = _create_protocol()
+
+    protocol.data_received(LOGIN_RESPONSE + PROBE_RESPONSE + LOGIN_RESPONSE)
+    parsed_packets = _drain(packet_queue)
+
+    assert [packet.message_type for packet in parsed_packets] == [
+        MessageType.LOGIN.value,
+        MessageType.PROBE.value,
+        MessageType.LOGIN.value
+    ]
+    assert parsed_packets[1].device_id == 1234567890
+    assert parsed_packets[1].data == b"somedata"
+    assert len(protocol._read_buffer) == 0
+
+
+def test_frame_split_across_reads():
+    protocol, packet_queue = _create_protocol()
+
+    protocol.data_received(PROBE_RESPONSE[:3])
+    assert packet_queue.empty()
+
+    protocol.data_received(PROBE_RESPONSE[3:9])
+    assert packet_queue.empty()
+
+    protocol.data_received(PROBE_RESPONSE[9:] + LOGIN_RESPONSE[:4])
+    parsed_packets = _drain(packet_queue)
+    assert len(parsed_packets) == 1
+    assert parsed_packets[0].message_type == MessageType.PROBE.value
+    assert parsed_packets[0].data == b"somedata"
+    assert protocol._read_buffer == LOGIN_RESPONSE[:4]
+
+    protocol.data_received(LOGIN_RESPONSE[4:])
+    parsed_packets = _drain(packet_queue)
+    assert len(parsed_packets) == 1
+    assert parsed_packets[0].message_type == MessageType.LOGIN.value
+    assert len(protocol._read_buffer) == 0
+
+
+def test_byte_at_a_time():
+    protocol, packet_queue = _create_protocol()
+
+    stream = LOGIN_RESPONSE + PROBE_RESPONSE
+    for index in range(len(stream)):
+        protocol.data_received(stream[index:index + 1])
+
+    parsed_packets = _drain(packet_queue)
+    assert [packet.message_type for packet in parsed_packets] == [MessageType.LOGIN.value, MessageType.PROBE.value]
+    assert len(protocol._read_buffer) == 0
+
+
+def test_unrecognized_frame_is_skipped():
+    protocol, packet_queue = _create_protocol()
+
+    unknown_frame = bytes.fromhex("f300000002abcd")
+    protocol.data_received(unknown_frame + LOGIN_RESPONSE)
+
+    parsed_packets = _drain(packet_queue)
+    assert [packet.message_type for packet in parsed_packets] == [MessageType.LOGIN.value]
+    assert len(protocol._read_buffer) == 0
+
+
+HUB_DEVICE = CyncDevice(True, True, 23456, 5, 1234, "Hub", 137, DeviceType.LIGHT, "123456ABCDEF", "ID1", "Code")
+
+
+def _create_tcp_manager(mocker, **kwargs) -> TcpManager:
+    """Create a TcpManager that doesn't open a real connection."""
+    mocker.patch.object(TcpManager, "_start_tcp_client")
+
+    return TcpManager(TEST_USER, mocker.AsyncMock(), **kwargs)
+
+
+def _create_logged_in_tcp_manager(mocker, **kwargs) -> TcpManager:
+    tcp_manager = _create_tcp_manager(mocker, **kwargs)
+    tcp_manager._transport = mocker.Mock()
+    tcp_manager._set_state(ConnectionState.LOGGED_IN)
+
+    return tcp_manager
+
+
+def _ack_message(packet_counter: int) -> ParsedMessage:
+    return ParsedMessage(MessageType.PIPE.value, True, HUB_DEVICE.device_id, None, 3, packet_counter=packet_counter)
+
+
+@pytest.mark.asyncio
+async def test_wait_for_state_wakes_on_state_change(mocker):
+    tcp_manager = _create_tcp_manager(mocker)
+
+    assert tcp_manager.connection_state == ConnectionState.CONNECTING
+
+    logged_in_waiter = asyncio.create_task(tcp_manager.wait_for_state(ConnectionState.LOGGED_IN))
+    probed_waiter = asyncio.create_task(tcp_manager.wait_for_state(ConnectionState.PROBED))
+    await asyncio.sleep(0)
+
+    tcp_manager._set_state(ConnectionState.LOGGED_IN)
+    await asyncio.sleep(0)
+
+    assert logged_in_waiter.done()
+    assert not probed_waiter.done()
+
+    tcp_manager._set_state(ConnectionState.READY)
+    await asyncio.sleep(0)
+
+    assert probed_waiter.done()
+
+
+@pytest.mark.asyncio
+async def test_wait_for_state_timeout(mocker):
+    tcp_manager = _create_tcp_manager(mocker)
+
+    with pytest.raises(TimeoutError):
+        await tcp_manager.wait_for_state(ConnectionState.LOGGED_IN, timeout=0.01)
+
+
+@pytest.mark.asyncio
+async def test_reconnecting_resets_reached_states(mocker):
+    tcp_manager = _create_tcp_manager(mocker)
+
+    tcp_manager._set_state(ConnectionState.READY)
+    await tcp_manager.wait_for_state(ConnectionState.PROBED, timeout=0.01)
+
+    tcp_manager._set_state(ConnectionState.RECONNECTING)
+    with pytest.raises(TimeoutError):
+        await tcp_manager.wait_for_state(ConnectionState.LOGGED_IN, timeout=0.01)
+
+    tcp_manager._advance_state(ConnectionState.PROBED)
+    tcp_manager._advance_state(ConnectionState.LOGGED_IN)
+    assert tcp_manager.connection_state == ConnectionState.PROBED
+
+
+@pytest.mark.asyncio
+async def test_command_resolves_on_ack(mocker):
+    tcp_manager = _create_logged_in_tcp_manager(mocker)
+    mocker.patch("pycync.tcp.packet_builder._get_and_increment_packet_counter", return_value=42)
+
+    ack_future = await tcp_manager.set_brightness(HUB_DEVICE, 5, 50)
+
+    tcp_manager._transport.write.assert_called_once()
+    assert not ack_future.done()
+
+    tcp_manager._acknowledge_command(_ack_message(41))
+    assert not ack_future.done()
+
+    tcp_manager._acknowledge_command(_ack_message(42))
+    await ack_future
+    await asyncio.sleep(0)
+    assert not tcp_manager._pending_commands
+
+
+@pytest.mark.asyncio
+async def test_command_resolves_on_inner_response(mocker):
+    tcp_manager = _create_logged_in_tcp_manager(mocker)
+    mocker.patch("pycync.tcp.inner_packet_builder._get_and_increment_sequence_bytes",
+                 return_value=int(300).to_bytes(4, "little"))
+
+    ack_future = await tcp_manager.set_power_state(HUB_DEVICE, 5, 0, True)
+
+    inner_response = ParsedMessage(MessageType.PIPE.value, False, HUB_DEVICE.device_id, None, 3, 0xd0, 7, 300)
+    tcp_manager._acknowledge_command(inner_response)
+
+    await ack_future
+    await asyncio.sleep(0)
+    assert not tcp_manager._pending_command_sequences
+
+
+@pytest.mark.asyncio
+async def test_command_ack_timeout(mocker):
+    tcp_manager = _create_logged_in_tcp_manager(mocker, command_ack_timeout=0.01)
+
+    ack_future = await tcp_manager.set_brightness(HUB_DEVICE, 5, 50)
+
+    with pytest.raises(CommandTimeoutError):
+        await ack_future
+
+
+@pytest.mark.asyncio
+async def test_in_flight_window(mocker):
+    tcp_manager = _create_logged_in_tcp_manager(mocker, max_in_flight_commands=1)
+    mocker.patch("pycync.tcp.packet_builder._get_and_increment_packet_counter", side_effect=[1, 2])
+
+    first_ack = await tcp_manager.set_brightness(HUB_DEVICE, 5, 50)
+    second_command = asyncio.create_task(tcp_manager.set_brightness(HUB_DEVICE, 5, 60))
+    await asyncio.sleep(0)
+
+    assert not second_command.done()
+    assert tcp_manager._transport.write.call_count == 1
+
+    tcp_manager._acknowledge_command(_ack_message(1))
+    await first_ack
+    second_ack = await second_command
+
+    assert tcp_manager._transport.write.call_count == 2
+    assert not second_ack.done()
+
+
+@pytest.mark.asyncio
+async def test_pending_commands_fail_on_connection_loss(mocker):
+    tcp_manager = _create_logged_in_tcp_manager(mocker)
+
+    ack_future = await tcp_manager.set_brightness(HUB_DEVICE, 5, 50)
+    tcp_manager._set_state(ConnectionState.RECONNECTING)
+
+    with pytest.raises(CyncError):
+        await ack_future
+
+
+@pytest.mark.asyncio
+async def test_state_callback_called_on_change(mocker):
+    state_callback = mocker.Mock()
+    tcp_manager = _create_tcp_manager(mocker, state_callback=state_callback)
+
+    tcp_manager._set_state(ConnectionState.LOGGED_IN)
+    tcp_manager._advance_state(ConnectionState.LOGGED_IN)
+    tcp_manager._set_state(ConnectionState.RECONNECTING)
+
+    assert [call.args[0] for call in state_callback.call_args_list] == [
+        ConnectionState.LOGGED_IN,
+        ConnectionState.RECONNECTING
+    ]
+
+
+@pytest.mark.asyncio
+async def test_connection_phase_timings(mocker):
+    tcp_manager = _create_tcp_manager(mocker)
+    tcp_manager._phase_started_at = 0
+    mocked_time = mocker.patch("pycync.tcp.tcp_manager.time")
+    mocked_time.monotonic.side_effect = [2.0, 5.0, 5.5]
+
+    tcp_manager._set_state(ConnectionState.LOGGED_IN)
+    tcp_manager._advance_state(ConnectionState.PROBED)
+    tcp_manager._advance_state(ConnectionState.READY)
+
+    assert tcp_manager.connection_timings == {"login": 2.0, "probe": 3.0, "initial_status": 0.5}
+
+
+def test_ssl_contexts_are_shared():
+    strict_context = tcp_manager_module._get_shared_ssl_context(True)
+    relaxed_context = tcp_manager_module._get_shared_ssl_context(False)
+
+    assert tcp_manager_module._get_shared_ssl_context(True) is strict_context
+    assert tcp_manager_module._get_shared_ssl_context(False) is relaxed_context
+    assert strict_context.verify_mode == ssl.CERT_REQUIRED
+    assert relaxed_context.verify_mode == ssl.CERT_NONE
+
+
+@pytest.mark.asyncio
+async def test_working_tls_mode_is_remembered(mocker):
+    mocker.patch.object(tcp_manager_module, "_relaxed_tls_preferred", False)
+    create_connection = mocker.patch.object(asyncio.get_running_loop(), "create_connection",
+                                            side_effect=[ssl.SSLError("Certificate expired"),
+                                                         (mocker.Mock(), mocker.Mock()),
+                                                         (mocker.Mock(), mocker.Mock())])
+    relaxed_context = tcp_manager_module._get_shared_ssl_context(False)
+
+    await _create_tcp_manager(mocker)._establish_tcp_connection()
+
+    assert create_connection.call_count == 2
+    assert create_connection.call_args.kwargs["ssl"] is relaxed_context
+
+    await _create_tcp_manager(mocker)._establish_tcp_connection()
+
+    assert create_connection.call_count == 3
+    assert create_connection.call_args.kwargs["ssl"] is relaxed_context
+
+
+def test_tls_session_offered_on_reconnect(mocker):
+    context = tcp_manager_module._ResumableSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    wrap_bio = mocker.patch.object(ssl.SSLContext, "wrap_bio")
+    saved_session = mocker.Mock()
+
+    context.wrap_bio(ssl.MemoryBIO(), ssl.MemoryBIO(), server_hostname="example.com")
+    assert wrap_bio.call_args.args[-1] is None
+
+    context.session = saved_session
+    context.wrap_bio(ssl.MemoryBIO(), ssl.MemoryBIO(), server_hostname="example.com")
+    assert wrap_bio.call_args.args[-1] is saved_session
+
+
+@pytest.mark.asyncio
+async def test_tls_session_saved_after_login(mocker):
+    tcp_manager = _create_logged_in_tcp_manager(mocker)
+    tcp_manager._connected_ssl_context = tcp_manager_module._ResumableSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ssl_object = tcp_manager._transport.get_extra_info.return_value
+
+    tcp_manager._remember_tls_session()
+
+    tcp_manager._transport.get_extra_info.assert_called_once_with("ssl_object")
+    assert tcp_manager._connected_ssl_context.session is ssl_object.session
+
+
+def test_reconnect_delay_grows_with_jitter():
+    first_delays = [tcp_manager_module._next_reconnect_delay(0) for _ in range(100)]
+    assert all(1 <= delay <= 3 for delay in first_delays)
+    assert len(set(first_delays)) > 1
+
+    assert all(tcp_manager_module._next_reconnect_delay(50) <= 60 for _ in range(100))
+
+
+async def _wait_forever():
+    await asyncio.Event().wait()
+
+
+def _create_supervised_tcp_manager(mocker, connection_results: list) -> TcpManager:
+    """Create a TcpManager whose connection attempts return or raise the given results, without any real I/O."""
+    mocker.patch.object(TcpManager, "_establish_tcp_connection", side_effect=connection_results)
+    mocker.patch.object(TcpManager, "_process_packets", side_effect=_wait_forever)
+    mocker.patch.object(TcpManager, "_send_pings", side_effect=_wait_forever)
+    mocker.patch.object(tcp_manager_module, "_next_reconnect_delay", return_value=0.001)
+
+    tcp_manager = TcpManager(TEST_USER, mocker.AsyncMock())
+    tcp_manager._packet_queue = mocker.Mock()
+    tcp_manager._transport = mocker.Mock()
+
+    return tcp_manager
+
+
+@pytest.mark.asyncio
+async def test_connection_retried_after_failure(mocker):
+    tcp_manager = _create_supervised_tcp_manager(mocker, [OSError("Network unreachable"), None])
+
+    await tcp_manager._connect_task
+
+    assert tcp_manager._establish_tcp_connection.call_count == 2
+    tcp_manager_module._next_reconnect_delay.assert_called_once_with(0)
+    assert not tcp_manager._process_packet_task.done()
+
+    tcp_manager.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_loss_reconnects_once(mocker):
+    tcp_manager = _create_supervised_tcp_manager(mocker, [None, None])
+    await tcp_manager._connect_task
+
+    lost_connection = asyncio.get_running_loop().create_future()
+    lost_connection.set_exception(ConnectionClosedError("Connection lost"))
+    tcp_manager._read_task_finished(lost_connection)
+    tcp_manager._read_task_finished(lost_connection)
+
+    assert tcp_manager.connection_state == ConnectionState.RECONNECTING
+    await tcp_manager._connect_task
+    assert tcp_manager._establish_tcp_connection.call_count == 2
+
+    tcp_manager.close()
+
+
+@pytest.mark.asyncio
+async def test_server_disconnect_delays_reconnect(mocker):
+    tcp_manager = _create_tcp_manager(mocker)
+    tcp_manager._connect_task = None
+    tcp_manager._packet_queue = mocker.Mock()
+    tcp_manager._transport = mocker.Mock()
+    tcp_manager._heartbeat_task = mocker.Mock()
+
+    disconnected = asyncio.get_running_loop().create_future()
+    disconnected.set_exception(ServerDisconnectedError("Disconnected by the server"))
+    tcp_manager._read_task_finished(disconnected)
+    await tcp_manager._connect_task
+
+    TcpManager._start_tcp_client.assert_called_with(tcp_manager_module._SERVER_DISCONNECT_RECONNECT_DELAY_SECONDS)
+
+
+@pytest.mark.asyncio
+async def test_no_reconnect_after_shut_down(mocker):
+    tcp_manager = _create_supervised_tcp_manager(mocker, [None, None])
+    await tcp_manager._connect_task
+
+    tcp_manager.close()
+    await asyncio.sleep(0)
+
+    assert tcp_manager._process_packet_task.cancelled()
+    assert tcp_manager._connect_task.done()
+    assert tcp_manager._establish_tcp_connection.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_ping_rtt_measured(mocker):
+    tcp_manager = _create_logged_in_tcp_manager(mocker)
+    tcp_manager._packet_queue = InboundPacketQueue()
+    mocked_time = mocker.patch("pycync.tcp.tcp_manager.time")
+    mocked_time.monotonic.return_value = 100.25
+    tcp_manager._ping_sent_at = 100.0
+
+    tcp_manager._packet_queue.put_nowait(ParsedMessage(MessageType.PING.value, True, None, None, 0))
+    tcp_manager._packet_queue.put_nowait(tcp_manager_module._CONNECTION_LOST_STRING)
+    with pytest.raises(ConnectionClosedError):
+        await tcp_manager._process_packets()
+
+    assert tcp_manager.ping_rtt == 0.25
+    assert tcp_manager._ping_sent_at is None
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_skipped_while_traffic_flows(mocker):
+    tcp_manager = _create_logged_in_tcp_manager(mocker, heartbeat_interval=0.05)
+    heartbeat_task = asyncio.create_task(tcp_manager._send_pings())
+
+    for _ in range(20):
+        tcp_manager._last_received_at = time.monotonic()
+        await asyncio.sleep(0.01)
+    heartbeat_task.cancel()
+
+    tcp_manager._transport.write.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_missed_pongs_abort_connection(mocker):
+    tcp_manager = _create_logged_in_tcp_manager(mocker, heartbeat_interval=0.01, max_missed_pongs=2)
+
+    await asyncio.wait_for(tcp_manager._send_pings(), 1)
+
+    assert [call.args[0] for call in tcp_manager._transport.write.call_args_list] == [
+        tcp_manager_module._PING_REQUEST,
+        tcp_manager_module._PING_REQUEST
+    ]
+    tcp_manager._transport.abort.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_protocol_write_backpressure(mocker):
+    protocol = CyncTcpProtocol(InboundPacketQueue(), TEST_USER, write_buffer_high_water_mark=1000,
+                               write_buffer_low_water_mark=100)
+    transport = mocker.Mock()
+
+    protocol.connection_made(transport)
+    transport.set_write_buffer_limits.assert_called_once_with(1000, 100)
+
+    protocol.pause_writing()
+    waiting_writer = asyncio.create_task(protocol.wait_for_write_capacity())
+    await asyncio.sleep(0)
+    assert not waiting_writer.done()
+
+    protocol.resume_writing()
+    await asyncio.wait_for(waiting_writer, 1)
+
+
+@pytest.mark.asyncio
+async def test_commands_wait_for_write_capacity(mocker):
+    tcp_manager = _create_logged_in_tcp_manager(mocker)
+    tcp_manager._protocol = CyncTcpProtocol(InboundPacketQueue(), TEST_USER)
+
+    tcp_manager._protocol.pause_writing()
+    command = asyncio.create_task(tcp_manager.set_brightness(HUB_DEVICE, 5, 50))
+    request = asyncio.create_task(tcp_manager.update_mesh_devices([HUB_DEVICE]))
+    await asyncio.sleep(0)
+    tcp_manager._transport.write.assert_not_called()
+
+    tcp_manager._protocol.resume_writing()
+    await command
+    await request
+    assert tcp_manager._transport.write.call_count == 2
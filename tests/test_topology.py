@@ -0,0 +1,194 @@
+from pycync.devices.topology import build_home, index_device_info, reconcile_homes
+
+HOME_ID = 1000000
+DEVICES_PER_GROUP = 10
+GROUPS_PER_ROOM = 2
+DEVICES_PER_ROOM = 40
+
+
+def _create_account(device_count: int):
+    """
+    Creates REST responses for a home with the given number of devices.
+    Each room holds a run of devices directly, plus two groups of its own. Every tenth device is not in any room.
+    """
+
+    device_info = [{"id": 5000 + index, "mac": f"{index:012X}", "product_id": "1234", "is_online": True}
+                   for index in range(device_count)]
+    bulbs = [{"switchID": 5000 + index, "deviceID": index + 1, "deviceType": 137, "displayName": f"Light {index}"}
+             for index in range(device_count)]
+
+    groups = []
+    rooms = []
+    mesh_ids = [bulb["deviceID"] for index, bulb in enumerate(bulbs) if index % 10 != 9]
+    room_size = DEVICES_PER_ROOM + DEVICES_PER_GROUP * GROUPS_PER_ROOM
+    for room_index, room_start in enumerate(range(0, len(mesh_ids), room_size)):
+        room_mesh_ids = mesh_ids[room_start:room_start + room_size]
+        subgroup_ids = []
+        for group_index in range(GROUPS_PER_ROOM):
+            group_start = DEVICES_PER_ROOM + group_index * DEVICES_PER_GROUP
+            group_id = 10000 + room_index * GROUPS_PER_ROOM + group_index
+            subgroup_ids.append(group_id)
+            groups.append({"groupID": group_id, "displayName": f"Group {group_id}", "isSubgroup": True,
+                           "deviceIDArray": room_mesh_ids[group_start:group_start + DEVICES_PER_GROUP]})
+
+        # Rooms list every device in them, including the ones that belong to their groups.
+        rooms.append({"groupID": room_index + 1, "displayName": f"Room {room_index}", "isSubgroup": False,
+                      "deviceIDArray": room_mesh_ids, "subgroupIDArray": subgroup_ids})
+
+    home_json = {"id": HOME_ID, "name": "Large Home", "product_id": "1234", "source": 5}
+    mesh_device_info = {"bulbsArray": bulbs, "groupsArray": rooms + groups}
+
+    return home_json, mesh_device_info, device_info
+
+
+def test_build_large_home():
+    home_json, mesh_device_info, device_info = _create_account(1000)
+
+    home = build_home(home_json, mesh_device_info, index_device_info(device_info), None)
+
+    assert len(home.get_flattened_device_list()) == 1000
+    assert len(home.global_devices) == 100
+    assert len(home.rooms) == 15
+
+    first_room = home.rooms[0]
+    assert len(first_room.devices) == DEVICES_PER_ROOM
+    assert [group.group_id for group in first_room.groups] == [10000, 10001]
+    assert all(len(group.devices) == DEVICES_PER_GROUP for group in first_room.groups)
+
+    # Devices that are in a group aren't repeated in the room.
+    room_device_ids = {device.device_id for device in first_room.devices}
+    group_device_ids = {device.device_id for group in first_room.groups for device in group.devices}
+    assert room_device_ids.isdisjoint(group_device_ids)
+
+
+def test_device_claimed_by_first_group_only():
+    home_json, mesh_device_info, device_info = _create_account(3)
+    mesh_device_info["groupsArray"] = [
+        {"groupID": 1, "displayName": "Room", "isSubgroup": False, "deviceIDArray": [1, 2, 3],
+         "subgroupIDArray": [11, 12]},
+        {"groupID": 11, "displayName": "First Group", "isSubgroup": True, "deviceIDArray": [2, 1]},
+        {"groupID": 12, "displayName": "Second Group", "isSubgroup": True, "deviceIDArray": [1]},
+    ]
+
+    home = build_home(home_json, mesh_device_info, index_device_info(device_info), None)
+
+    first_group, second_group = home.rooms[0].groups
+    assert [device.mesh_device_id for device in first_group.devices] == [1, 2]
+    assert second_group.devices == []
+    assert [device.mesh_device_id for device in home.rooms[0].devices] == [3]
+    assert home.global_devices == []
+
+
+class _CountingList(list):
+    """A list that counts how many of its elements are visited by iteration and membership checks."""
+
+    def __init__(self, items, counter: list[int]):
+        super().__init__(items)
+        self._counter = counter
+
+    def __iter__(self):
+        for item in super().__iter__():
+            self._counter[0] += 1
+            yield item
+
+    def __contains__(self, item):
+        self._counter[0] += len(self)
+        return super().__contains__(item)
+
+
+class _CountingDict(dict):
+    """A dict that counts its lookups."""
+
+    def __init__(self, items, counter: list[int]):
+        super().__init__(items)
+        self._counter = counter
+
+    def get(self, key, default=None):
+        self._counter[0] += 1
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        self._counter[0] += 1
+        return super().__getitem__(key)
+
+
+def test_build_home_scales_linearly():
+    """Quadrupling the account size should quadruple the work done while building, not increase it sixteenfold."""
+
+    def count_build_operations(device_count: int) -> int:
+        counter = [0]
+        home_json, mesh_device_info, device_info = _create_account(device_count)
+        mesh_device_info["bulbsArray"] = _CountingList(mesh_device_info["bulbsArray"], counter)
+        for group in mesh_device_info["groupsArray"]:
+            group["deviceIDArray"] = _CountingList(group["deviceIDArray"], counter)
+        mesh_device_info["groupsArray"] = _CountingList(mesh_device_info["groupsArray"], counter)
+
+        build_home(home_json, mesh_device_info, _CountingDict(index_device_info(device_info), counter), None)
+
+        return counter[0]
+
+    assert count_build_operations(4000) <= count_build_operations(1000) * 5
+
+
+def _build_small_home(mesh_device_info_changes=None, home_id=HOME_ID, name="Large Home"):
+    home_json, mesh_device_info, device_info = _create_account(200)
+    home_json["id"] = home_id
+    home_json["name"] = name
+    if mesh_device_info_changes is not None:
+        mesh_device_info_changes(mesh_device_info)
+
+    return build_home(home_json, mesh_device_info, index_device_info(device_info), None)
+
+
+def test_reconcile_unchanged_home_keeps_objects_and_state():
+    current_home = _build_small_home()
+    current_light = current_home.rooms[0].devices[0]
+    current_light.update_state(True, 80, 50, (1, 2, 3), True)
+    current_light.set_wifi_connected(True)
+
+    homes, topology_change = reconcile_homes([current_home], [_build_small_home()])
+
+    assert topology_change.is_empty
+    assert homes[0] is current_home
+    assert homes[0].rooms[0].devices[0] is current_light
+    assert current_light.is_on and current_light.brightness == 80 and current_light.wifi_connected
+
+
+def test_reconcile_reports_added_removed_and_changed():
+    current_home = _build_small_home()
+    current_devices = {device.unique_id: device for device in current_home.get_flattened_device_list()}
+    first_room = current_home.rooms[0]
+
+    def change_topology(mesh_device_info):
+        bulbs = mesh_device_info["bulbsArray"]
+        bulbs[0]["displayName"] = "Renamed Light"
+        bulbs.append({"switchID": 5000, "deviceID": 999, "deviceType": 137, "displayName": "New Light"})
+        del bulbs[1]
+
+    homes, topology_change = reconcile_homes([current_home], [_build_small_home(change_topology)])
+
+    renamed_light = current_devices[f"{HOME_ID}-1"]
+    removed_light = current_devices[f"{HOME_ID}-2"]
+    assert homes[0] is current_home
+    assert renamed_light.name == "Renamed Light"
+    assert [entity.unique_id for entity in topology_change.added] == [f"{HOME_ID}-999"]
+    assert topology_change.removed == [removed_light]
+    assert renamed_light in topology_change.changed
+    assert first_room in topology_change.changed
+    assert homes[0].rooms[0].devices[0] is renamed_light
+    assert removed_light not in homes[0].get_flattened_device_list()
+
+
+def test_reconcile_reports_homes_added_removed_and_renamed():
+    renamed_home = _build_small_home()
+    removed_home = _build_small_home(home_id=HOME_ID + 1)
+    added_home = _build_small_home(home_id=HOME_ID + 2)
+
+    homes, topology_change = reconcile_homes([renamed_home, removed_home],
+                                             [_build_small_home(name="Renamed Home"), added_home])
+
+    assert homes == [renamed_home, added_home]
+    assert renamed_home.name == "Renamed Home"
+    assert topology_change.changed == [renamed_home]
+    assert added_home in topology_change.added
+    assert removed_home in topology_change.removed
@@ -0,0 +1,73 @@
+import json
+
+from pycync import CyncLight, CyncPlug
+from pycync.devices.topology import build_home, index_device_info
+from pycync.devices.topology_cache import load_topology_cache, save_topology_cache, TOPOLOGY_CACHE_VERSION
+from tests import TEST_USER_ID
+
+
+def _load_fixture_home():
+    with open("fixtures/device_api_response.json") as f:
+        device_info = json.load(f)
+    with open("fixtures/property_api_response.json") as f:
+        mesh_device_info = json.load(f)
+
+    home_json = next(device for device in device_info if device.get("source") == 5)
+    return build_home(home_json, mesh_device_info, index_device_info(device_info), None)
+
+
+def test_cache_round_trip(tmp_path):
+    cache_path = str(tmp_path / "topology.json")
+    home = _load_fixture_home()
+    light = next(device for device in home.get_flattened_device_list() if isinstance(device, CyncLight))
+    light.update_state(True, 75, 40, (10, 20, 30), True)
+
+    save_topology_cache(cache_path, TEST_USER_ID, [home])
+    loaded_homes = load_topology_cache(cache_path, TEST_USER_ID)
+
+    assert [loaded_home.to_dict() for loaded_home in loaded_homes] == [home.to_dict()]
+
+    loaded_devices = {device.unique_id: device for device in loaded_homes[0].get_flattened_device_list()}
+    loaded_light = loaded_devices[light.unique_id]
+    assert type(loaded_light) is CyncLight
+    assert loaded_light.brightness == 75
+    assert loaded_light.rgb == (10, 20, 30)
+    assert any(isinstance(device, CyncPlug) for device in loaded_devices.values())
+    assert [room.name for room in loaded_homes[0].rooms] == [room.name for room in home.rooms]
+
+
+def test_missing_cache(tmp_path):
+    assert load_topology_cache(str(tmp_path / "missing.json"), TEST_USER_ID) is None
+
+
+def test_cache_for_other_version_or_user_is_ignored(tmp_path):
+    cache_path = str(tmp_path / "topology.json")
+    save_topology_cache(cache_path, TEST_USER_ID, [_load_fixture_home()])
+
+    assert load_topology_cache(cache_path, TEST_USER_ID + 1) is None
+
+    with open(cache_path) as f:
+        cache_data = json.load(f)
+    cache_data["version"] = TOPOLOGY_CACHE_VERSION + 1
+    with open(cache_path, "w") as f:
+        json.dump(cache_data, f)
+
+    assert load_topology_cache(cache_path, TEST_USER_ID) is None
+
+
+def test_corrupt_cache_is_ignored(tmp_path):
+    cache_path = tmp_path / "topology.json"
+    cache_path.write_text("{not json")
+
+    assert load_topology_cache(str(cache_path), TEST_USER_ID) is None
+
+
+def test_cache_that_is_not_an_object_is_ignored(tmp_path):
+    cache_path = tmp_path / "topology.json"
+    cache_path.write_text("[]")
+
+    assert load_topology_cache(str(cache_path), TEST_USER_ID) is None
+
+    cache_path.write_text(json.dumps({"version": TOPOLOGY_CACHE_VERSION, "user_id": TEST_USER_ID, "homes": [1]}))
+
+    assert load_topology_cache(str(cache_path), TEST_USER_ID) is None